@@ -5,8 +5,8 @@ from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import os, io, time, json, math, glob
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from .utils.rag_snapshot import FittedTfidf, TFIDF_PARAMS, fit_tfidf, load_or_build
 
 APP_NAME = "SIMA AI — ENGINES MAX"
 APP_DESC = "All-local suite: design, render, layout, structure, identity, chat (RAG), 3D gen, materials, eco, plus trainer 24/7."
@@ -226,19 +226,11 @@ async def eco_assess(body: EcoIn):
     return {"embodied_carbon_kgco2e": round(kgco2e,2), "note":"Heuristic; replace with LCA dataset as needed."}
 
 # ---------- RAG Chat Engine ----------
-VEC = None
-DOCS = None
-def build_index():
-    global VEC, DOCS
-    files = sorted(glob.glob("app/corpus/*.md"))
-    texts = []
-    for f in files:
-        with open(f, "r", encoding="utf-8") as fh:
-            texts.append(fh.read())
-    DOCS = texts
-    VEC = TfidfVectorizer(stop_words="english")
-    if texts:
-        VEC.fit(texts)
+RAG = None
+def build_index(force=False):
+    # vocabulary, idf and document matrix come from a mmap'd snapshot, rebuilt only when the corpus changes
+    global RAG
+    RAG = FittedTfidf(load_or_build("tfidf", TFIDF_PARAMS, sorted(glob.glob("app/corpus/*.md")), fit_tfidf, force=force))
 
 build_index()
 
@@ -248,18 +240,15 @@ class ChatIn(BaseModel):
 
 @app.post("/v1/chat")
 async def chat(body: ChatIn):
-    if VEC is None or not DOCS:
+    if RAG is None or not len(RAG.docs):
         return {"answer": "لا توجد معرفة متاحة بعد.", "context": []}
-    q = [body.message]
-    Xq = VEC.transform(q) if hasattr(VEC, 'transform') and hasattr(VEC, 'vocabulary_') else VEC.fit_transform(DOCS)
-    Xd = VEC.transform(DOCS)
-    sims = (Xd @ Xq.T).toarray().ravel()
-    top = sims.argsort()[::-1][:2]
-    ctx = [{"doc": f"doc_{i}", "excerpt": DOCS[i][:160]} for i in top]
+    ctx = []
+    for i, s in RAG.search(body.message, 2):   # best-matching passages, each pointing back to its source file
+        h = RAG.hit(i, s); ctx.append({"doc": h["doc_id"], "excerpt": h["excerpt"], "score": s})
     answer = "استنادًا إلى المراجع: " + " | ".join([c["excerpt"] for c in ctx])
     return {"answer": answer, "context": ctx}
 
 @app.post("/v1/admin/retrain")
 async def retrain():
-    build_index()
-    return {"ok": True, "docs": len(DOCS)}
+    build_index(force=True)
+    return {"ok": True, "docs": len(RAG.docs)}
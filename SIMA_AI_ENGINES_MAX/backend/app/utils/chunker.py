@@ -0,0 +1,78 @@
+import os, re
+from typing import List, Tuple
+import numpy as np
+
+# Sentence/paragraph-aware passage chunker for the RAG indexes. Passages are (start, end) character
+# spans into the source document, packed from whole sentences up to RAG_CHUNK_CHARS, with the trailing
+# sentences (up to RAG_CHUNK_OVERLAP chars) repeated at the start of the next passage. Sentence ends
+# include Arabic ؟ ؛ ۔ as well as . ! ? …; blank lines are paragraph breaks and are not overlapped across.
+RAG_CHUNK_CHARS = int(os.getenv("RAG_CHUNK_CHARS","600"))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP","120"))
+
+_BOUNDARY = re.compile(r"(?<=[.!?؟؛۔…])[\"'”»)\]]*\s+|\s*\n\s*")
+_SPACE = re.compile(r"\s+")
+
+def _sentences(text: str) -> List[Tuple[int, int, bool]]:
+    """(start, end, starts_paragraph) for each sentence, whitespace trimmed."""
+    out, pos, para = [], 0, True
+    for m in list(_BOUNDARY.finditer(text)) + [None]:
+        end = m.start() if m else len(text)
+        seg = text[pos:end]
+        if seg.strip():
+            lead = len(seg) - len(seg.lstrip())
+            out.append((pos + lead, pos + len(seg.rstrip()), para)); para = False
+        if m is None: break
+        if m.group().count("\n") >= 2: para = True
+        pos = m.end()
+    return out
+
+def _split_long(s: int, e: int, text: str, size: int) -> List[Tuple[int, int, bool]]:
+    """Break a sentence longer than `size` at whitespace."""
+    out, start = [], s
+    while e - start > size:
+        cut = start + size
+        ws = [m.start() for m in _SPACE.finditer(text, start + size // 2, cut)]
+        cut = ws[-1] if ws else cut
+        out.append((start, cut, False))
+        start = cut + len(text[cut:e]) - len(text[cut:e].lstrip())
+    out.append((start, e, False))
+    return out
+
+def chunk_spans(text: str, size: int = RAG_CHUNK_CHARS, overlap: int = RAG_CHUNK_OVERLAP) -> List[Tuple[int, int]]:
+    units = []
+    for s, e, para in _sentences(text or ""):
+        parts = _split_long(s, e, text, size) if e - s > size else [(s, e, False)]
+        units.append((parts[0][0], parts[0][1], para)); units.extend(parts[1:])
+    spans, cur = [], []
+    for u in units:
+        # a new paragraph closes the passage unless what we have is heading-sized
+        if cur and (u[1] - cur[0][0] > size or (u[2] and cur[-1][1] - cur[0][0] >= min(64, size // 4))):
+            spans.append((cur[0][0], cur[-1][1]))
+            tail = []
+            if not u[2]:
+                for t in reversed(cur[1:]):
+                    if cur[-1][1] - t[0] > overlap: break
+                    tail.insert(0, t)
+            while tail and u[1] - tail[0][0] > size: tail.pop(0)
+            cur = tail
+        cur.append(u)
+    if cur: spans.append((cur[0][0], cur[-1][1]))
+    return spans
+
+def passage_spans(docs: List[str], size: int = RAG_CHUNK_CHARS, overlap: int = RAG_CHUNK_OVERLAP):
+    """Chunk every document; returns (src doc index, start, end) arrays, one entry per passage."""
+    src, start, end = [], [], []
+    for d, text in enumerate(docs):
+        for s, e in chunk_spans(text, size, overlap):
+            src.append(d); start.append(s); end.append(e)
+    return np.asarray(src, dtype=np.int32), np.asarray(start, dtype=np.int64), np.asarray(end, dtype=np.int64)
+
+class Passages:
+    """Mixin for indexes whose rows are passages: p_src/p_start/p_end map row -> span of docs[src]."""
+    def passage(self, i: int) -> dict:
+        d, s, e = int(self.p_src[i]), int(self.p_start[i]), int(self.p_end[i])
+        return {"doc_id": self.ids[d], "passage": int(i), "start": s, "end": e, "text": self.docs[d][s:e]}
+
+    def hit(self, i: int, score: float) -> dict:
+        p = self.passage(i)
+        return {"doc_id": p["doc_id"], "passage": p["passage"], "span": [p["start"], p["end"]], "score": score, "excerpt": p["text"]}
@@ -0,0 +1,151 @@
+import os, json, time, fcntl, shutil, hashlib
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+from .chunker import RAG_CHUNK_CHARS, RAG_CHUNK_OVERLAP, Passages, passage_spans
+
+# Versioned on-disk RAG index snapshots. A snapshot is a directory of .npy arrays (CSR matrices, idf, ...)
+# plus the corpus text and a meta.json; workers np.load(mmap_mode="r") it, so the pages are shared
+# through the OS page cache instead of every process re-reading and re-vectorizing the corpus.
+# The snapshot key covers the format, the index kind/params and the content hash of every corpus
+# file; per-file hashes are reused while (size, mtime) are unchanged, so an unchanged corpus is not read.
+# <kind>.lock guards the directory: loaders hold it shared while they open a snapshot's files, the builder
+# holds it exclusively while it writes and removes snapshots, so nothing is deleted under a half-done load.
+# Once loaded, the mmaps stay valid after the files are unlinked.
+RAG_SNAPSHOT_DIR = os.getenv("RAG_SNAPSHOT_DIR",".rag_snapshot")
+SNAPSHOT_FORMAT = 2
+TFIDF_PARAMS = {"stop_words": "english", "chunk_chars": RAG_CHUNK_CHARS, "chunk_overlap": RAG_CHUNK_OVERLAP}
+
+class Snapshot(NamedTuple):
+    path: str
+    arrays: Dict[str, np.ndarray]
+    meta: dict
+    docs: "DocList"
+    ids: List[str]
+
+class DocList:
+    """Corpus texts backed by one mmap'd utf-8 blob plus offsets; appended docs stay in memory."""
+    def __init__(self, blob: Optional[np.ndarray] = None, offsets: Optional[np.ndarray] = None):
+        self.blob, self.offsets, self.extra = blob, offsets, []
+
+    def _base(self): return 0 if self.offsets is None else len(self.offsets) - 1
+
+    def __len__(self): return self._base() + len(self.extra)
+
+    def __getitem__(self, i: int) -> str:
+        n = self._base()
+        if i < 0: i += len(self)
+        if i >= n: return self.extra[i - n]
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)): yield self[i]
+
+    def append(self, doc: str): self.extra.append(doc)
+
+    def extend(self, docs: List[str]): self.extra.extend(docs)
+
+def csr_arrays(prefix: str, m: sp.csr_matrix) -> Dict[str, np.ndarray]:
+    return {f"{prefix}_data": m.data, f"{prefix}_indices": m.indices, f"{prefix}_indptr": m.indptr,
+            f"{prefix}_shape": np.asarray(m.shape, dtype=np.int64)}
+
+def csr_from(arrays: Dict[str, np.ndarray], prefix: str) -> sp.csr_matrix:
+    shape = tuple(int(x) for x in arrays[f"{prefix}_shape"])
+    return sp.csr_matrix((arrays[f"{prefix}_data"], arrays[f"{prefix}_indices"], arrays[f"{prefix}_indptr"]), shape=shape, copy=False)
+
+def _file_hashes(files: List[str], previous: Dict[str, list]) -> Dict[str, list]:
+    out = {}
+    for f in files:
+        st = os.stat(f); prev = previous.get(f)
+        if prev and prev[0] == st.st_size and prev[1] == st.st_mtime_ns:
+            out[f] = prev; continue
+        h = hashlib.sha256()
+        with open(f, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""): h.update(block)
+        out[f] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+    return out
+
+def _key(kind: str, params: dict, hashes: Dict[str, list]) -> str:
+    h = hashlib.sha256(json.dumps([SNAPSHOT_FORMAT, kind, params], sort_keys=True).encode())
+    for f in sorted(hashes): h.update(f"{os.path.basename(f)}\x00{hashes[f][2]}\n".encode())
+    return h.hexdigest()[:20]
+
+def _load(path: str) -> Snapshot:
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as fh: meta = json.load(fh)
+    arrays = {n: np.load(os.path.join(path, n + ".npy"), mmap_mode="r") for n in meta["arrays"]}
+    docs = DocList(np.load(os.path.join(path, "docs.npy"), mmap_mode="r"), np.load(os.path.join(path, "offsets.npy")))
+    return Snapshot(path, arrays, meta, docs, meta["ids"])
+
+def _save(root: str, key: str, kind: str, arrays: Dict[str, np.ndarray], meta: dict, docs: List[str], ids: List[str], hashes) -> str:
+    path = os.path.join(root, f"{kind}-v{SNAPSHOT_FORMAT}-{key}")
+    tmp = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True); os.makedirs(tmp)
+    for n, a in arrays.items(): np.save(os.path.join(tmp, n + ".npy"), np.ascontiguousarray(a))
+    enc = [d.encode("utf-8") for d in docs]
+    np.save(os.path.join(tmp, "docs.npy"), np.frombuffer(b"".join(enc), dtype=np.uint8))
+    np.save(os.path.join(tmp, "offsets.npy"), np.concatenate([[0], np.cumsum([len(e) for e in enc], dtype=np.int64)]).astype(np.int64))
+    meta = dict(meta, format=SNAPSHOT_FORMAT, kind=kind, key=key, ids=list(ids), arrays=sorted(arrays), files=hashes, created=time.time())
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as fh: json.dump(meta, fh, ensure_ascii=False)
+    shutil.rmtree(path, ignore_errors=True); os.replace(tmp, path)
+    with open(os.path.join(root, f"{kind}.current"), "w") as fh: fh.write(os.path.basename(path))
+    for old in os.listdir(root):   # caller holds the exclusive lock; readers that already map an old snapshot keep their pages
+        if old.startswith(f"{kind}-v") and os.path.join(root, old) != path: shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return path
+
+def load_or_build(kind: str, params: dict, files: List[str],
+                  build: Callable[[List[str], List[str]], Tuple[Dict[str, np.ndarray], dict]],
+                  root: str = RAG_SNAPSHOT_DIR, force: bool = False) -> Snapshot:
+    """Map the snapshot for these files, building it first (under an exclusive file lock) if missing or stale."""
+    os.makedirs(root, exist_ok=True)
+    current = os.path.join(root, f"{kind}.current")
+    previous = {}
+    try:
+        with open(current) as fh: name = fh.read().strip()
+        with open(os.path.join(root, name, "meta.json"), encoding="utf-8") as fh: previous = json.load(fh).get("files", {})
+    except (OSError, ValueError):
+        pass
+    hashes = _file_hashes(files, previous)
+    key = _key(kind, params, hashes)
+    path = os.path.join(root, f"{kind}-v{SNAPSHOT_FORMAT}-{key}")
+    with open(os.path.join(root, f"{kind}.lock"), "a") as lock:
+        if not force:
+            fcntl.flock(lock, fcntl.LOCK_SH)   # a builder cannot remove the snapshot while we open it
+            if os.path.exists(os.path.join(path, "meta.json")): return _load(path)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        fcntl.flock(lock, fcntl.LOCK_EX)   # one worker builds, the others wait and then map its result
+        if not force and os.path.exists(os.path.join(path, "meta.json")): return _load(path)
+        docs, ids = [], []
+        for f in files:
+            with open(f, "r", encoding="utf-8", errors="ignore") as fh: docs.append(fh.read())
+            ids.append(os.path.basename(f))
+        arrays, meta = build(docs, ids)
+        return _load(_save(root, key, kind, arrays, meta, docs, ids, hashes))
+
+def fit_tfidf(docs: List[str], ids: List[str]) -> Tuple[Dict[str, np.ndarray], dict]:
+    """`build` callback for a fitted-vocabulary TF-IDF index over passages: idf, l2-normalised matrix, spans, terms."""
+    src, start, end = passage_spans(docs)
+    spans = {"p_src": src, "p_start": start, "p_end": end}
+    if not len(src): return {"idf": np.zeros(0, np.float32), **spans, **csr_arrays("X", sp.csr_matrix((0, 0), dtype=np.float32))}, {"terms": []}
+    vec = TfidfVectorizer(stop_words="english")
+    X = vec.fit_transform([docs[d][s:e] for d, s, e in zip(src, start, end)]).astype(np.float32)
+    return {"idf": vec.idf_.astype(np.float32), **spans, **csr_arrays("X", X)}, {"terms": vec.get_feature_names_out().tolist()}
+
+class FittedTfidf(Passages):
+    """Query side of fit_tfidf: scores passages against the mapped matrix, same weighting as TfidfVectorizer."""
+    def __init__(self, snap: Snapshot):
+        self.snap, self.docs, self.ids = snap, snap.docs, snap.ids
+        self.X, self.idf = csr_from(snap.arrays, "X"), np.asarray(snap.arrays["idf"])
+        self.p_src, self.p_start, self.p_end = snap.arrays["p_src"], snap.arrays["p_start"], snap.arrays["p_end"]
+        terms = snap.meta["terms"]
+        self.cv = CountVectorizer(stop_words="english", vocabulary=terms) if terms else None
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (passage index, score); see Passages.passage for the text and source."""
+        if self.cv is None or self.X.shape[0] == 0: return []
+        q = normalize(sp.csr_matrix(self.cv.transform([query]).multiply(self.idf), dtype=np.float32))
+        sims = (self.X @ q.T).toarray().ravel()
+        k = min(max(1, k), sims.shape[0])
+        idx = np.argpartition(-sims, k - 1)[:k]
+        return [(int(i), float(sims[i])) for i in idx[np.argsort(-sims[idx])]]
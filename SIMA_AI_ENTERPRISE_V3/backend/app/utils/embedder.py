@@ -1,7 +1,11 @@
-import hashlib, math, re
+import hashlib, math
+from .tokenizer import tokenize
+
+VERSION = "sha256-hash-ar1"   # part of the embed_cache key: bump whenever tokenization or weighting changes
+
 def embed(text: str, dim: int=256) -> list[float]:
     vec = [0.0]*dim
-    for tok in re.findall(r"[\w\-]+", (text or "").lower()):
+    for tok in tokenize(text):
         h = int(hashlib.sha256(tok.encode()).hexdigest(), 16)
         idx = h % dim
         sign = -1.0 if (h>>8) & 1 else 1.0
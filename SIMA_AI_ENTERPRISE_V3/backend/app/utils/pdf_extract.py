@@ -0,0 +1,124 @@
+import os, json, mmap, signal, hashlib, asyncio, tempfile
+import concurrent.futures as cf
+import multiprocessing as mp
+from functools import lru_cache
+from typing import List, Optional, Union
+from pypdf import PdfReader
+
+# PDF text extraction on a process pool: pages fan out across workers, each page gets a
+# SIGALRM budget inside the worker, and results are cached on disk by file SHA-256. A document is only
+# cached when every page extracted: a page that timed out or failed (possibly from load) is retried next time.
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGE_TIMEOUT = float(os.getenv("PDF_PAGE_TIMEOUT","20"))
+PDF_TEXT_CACHE = os.getenv("PDF_TEXT_CACHE","uploads/.pdftext")
+
+_pool = None
+
+def _executor():
+    global _pool
+    if _pool is None:
+        # spawn: the API process has live threads (MQTT, event loop), forking it is unsafe
+        _pool = cf.ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=mp.get_context("spawn"))
+    return _pool
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True); _pool = None
+
+# ---- worker side
+@lru_cache(maxsize=2)
+def _reader(path: str, mtime: float):
+    # mmap instead of a path: pypdf would copy the whole file into a BytesIO in every worker
+    with open(path, "rb") as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    return PdfReader(mm)
+
+def _on_alarm(signum, frame):
+    raise TimeoutError
+
+def _page_count(path: str, mtime: float) -> int:
+    return len(_reader(path, mtime).pages)
+
+def _page_text(path: str, mtime: float, i: int, timeout: float):
+    signal.signal(signal.SIGALRM, _on_alarm)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, timeout)   # armed inside the try: an early alarm is a failed page too
+        return i, _reader(path, mtime).pages[i].extract_text() or ""
+    except Exception:   # timed out or unparsable page: keep the rest of the document
+        return i, None
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+# ---- cache
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""): h.update(block)
+    return h.hexdigest()
+
+def _cache_get(sha: str, max_pages: Optional[int]):
+    try:
+        with open(os.path.join(PDF_TEXT_CACHE, f"{sha}.json"), "r", encoding="utf-8") as fh: c = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    # a cache entry made with a page cap only serves requests within that cap
+    if c.get("max_pages") and (not max_pages or max_pages > c["max_pages"]): return None
+    return c["pages"][:max_pages] if max_pages else c["pages"]
+
+def _cache_put(sha: str, pages: List[str], max_pages: Optional[int], total: int):
+    os.makedirs(PDF_TEXT_CACHE, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=PDF_TEXT_CACHE, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as fh:
+        json.dump({"pages": pages, "max_pages": max_pages if max_pages and max_pages < total else None}, fh, ensure_ascii=False)
+    os.replace(tmp, os.path.join(PDF_TEXT_CACHE, f"{sha}.json"))
+
+def _deadline(n: int) -> float:
+    return PDF_PAGE_TIMEOUT * (n // max(1, PDF_WORKERS) + 2)
+
+# ---- async API (FastAPI handlers)
+async def iter_pdf_pages(path: str, max_pages: Optional[int] = None):
+    """Yield (page_index, text) in completion order; text is None for a page that failed or timed out."""
+    loop = asyncio.get_running_loop(); ex = _executor(); mtime = os.path.getmtime(path)
+    n = await loop.run_in_executor(ex, _page_count, path, mtime)
+    if max_pages: n = min(n, max_pages)
+    futs = [asyncio.wrap_future(ex.submit(_page_text, path, mtime, i, PDF_PAGE_TIMEOUT)) for i in range(n)]
+    try:
+        for f in asyncio.as_completed(futs, timeout=_deadline(n)):
+            yield await f
+    finally:
+        for f in futs: f.cancel()
+
+async def extract_pdf_text(path: str, sha: Optional[str] = None, max_pages: Optional[int] = None) -> List[str]:
+    sha = sha or await asyncio.to_thread(file_sha256, path)
+    cached = _cache_get(sha, max_pages)
+    if cached is not None: return cached
+    pages = {}
+    async for i, t in iter_pdf_pages(path, max_pages): pages[i] = t
+    out = [pages[i] or "" for i in range(len(pages))]
+    capped = bool(max_pages) and len(out) >= max_pages   # may have more pages than we read
+    if None not in pages.values(): await asyncio.to_thread(_cache_put, sha, out, max_pages, len(out) + capped)
+    return out
+
+# ---- sync API (def handlers running in the threadpool)
+def extract_pdf_text_sync(src: Union[str, bytes], max_pages: Optional[int] = None, sha: Optional[str] = None) -> List[str]:
+    sha = sha or (hashlib.sha256(src).hexdigest() if isinstance(src, (bytes, bytearray)) else file_sha256(src))
+    cached = _cache_get(sha, max_pages)
+    if cached is not None: return cached
+    path, tmp = src, None
+    if isinstance(src, (bytes, bytearray)):
+        os.makedirs(PDF_TEXT_CACHE, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=PDF_TEXT_CACHE, suffix=".pdf")
+        with os.fdopen(fd, "wb") as fh: fh.write(src)
+        path = tmp
+    try:
+        ex = _executor(); mtime = os.path.getmtime(path)
+        total = ex.submit(_page_count, path, mtime).result()
+        n = min(total, max_pages) if max_pages else total
+        futs = [ex.submit(_page_text, path, mtime, i, PDF_PAGE_TIMEOUT) for i in range(n)]
+        pages = dict(f.result() for f in cf.as_completed(futs, timeout=_deadline(n)))
+    finally:
+        if tmp: os.unlink(tmp)
+    out = [pages[i] or "" for i in range(n)]
+    if None not in pages.values(): _cache_put(sha, out, max_pages, total)
+    return out
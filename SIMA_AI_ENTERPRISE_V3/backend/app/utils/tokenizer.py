@@ -0,0 +1,15 @@
+import re
+from typing import List
+
+# Arabic-aware word tokenizer shared by the embedders.
+# Strips harakat/Quranic marks and tatweel, folds alef variants (آ أ إ ٱ -> ا), then splits on Unicode \w.
+_STRIP = [chr(c) for c in list(range(0x0610, 0x061B)) + list(range(0x064B, 0x0660)) + [0x0670] + list(range(0x06D6, 0x06EE))] + ["ـ"]
+_NORM = str.maketrans({**{ch: None for ch in _STRIP}, "آ": "ا", "أ": "ا", "إ": "ا", "ٱ": "ا"})
+
+TOKEN_RE = re.compile(r"\w+")
+
+def normalize(text: str) -> str:
+    return (text or "").lower().translate(_NORM)
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(normalize(text))
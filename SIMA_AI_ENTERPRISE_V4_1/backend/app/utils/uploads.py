@@ -0,0 +1,65 @@
+import os, asyncio, hashlib, tempfile
+from typing import NamedTuple, Optional
+from fastapi import HTTPException, UploadFile
+from starlette.responses import PlainTextResponse
+
+# Uploads are copied in fixed-size chunks to a temp file next to the destination, hashed and
+# size-checked on the way, then renamed into place; nothing holds the whole file in memory.
+UPLOAD_DIR = os.getenv("UPLOAD_DIR","uploads")
+UPLOAD_CHUNK = int(os.getenv("UPLOAD_CHUNK", str(1 << 20)))
+UPLOAD_MAX_MB = float(os.getenv("UPLOAD_MAX_MB","1024"))
+
+class Saved(NamedTuple):
+    path: str
+    size: int
+    sha256: str
+
+def max_bytes(limit_mb: Optional[float] = None) -> int:
+    return int((limit_mb if limit_mb is not None else UPLOAD_MAX_MB) * 1024 * 1024)
+
+def safe_name(name: Optional[str]) -> str:
+    return os.path.basename((name or "upload").replace("\\", "/")) or "upload"
+
+def _too_large(limit: int):
+    return HTTPException(413, f"upload exceeds {limit // (1024 * 1024)} MB")
+
+def _open_tmp(dest: str):
+    d = os.path.dirname(dest) or "."
+    os.makedirs(d, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=d, prefix=".upload-", suffix=".part")
+    return os.fdopen(fd, "wb"), tmp
+
+async def save_upload(file: UploadFile, dest: str, limit_mb: Optional[float] = None) -> Saved:
+    # the whole copy (read, hash, write, rename) runs on a worker thread: one hop per upload instead of
+    # blocking the event loop on disk I/O and sha256 for every chunk
+    return await asyncio.to_thread(save_upload_sync, file, dest, limit_mb)
+
+def save_upload_sync(file: UploadFile, dest: str, limit_mb: Optional[float] = None) -> Saved:
+    limit = max_bytes(limit_mb)
+    if file.size is not None and file.size > limit: raise _too_large(limit)
+    h, n = hashlib.sha256(), 0
+    out, tmp = _open_tmp(dest)
+    try:
+        with out:
+            while chunk := file.file.read(UPLOAD_CHUNK):
+                n += len(chunk)
+                if n > limit: raise _too_large(limit)
+                h.update(chunk); out.write(chunk)
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp): os.unlink(tmp)
+        raise
+    return Saved(dest, n, h.hexdigest())
+
+class UploadLimit:
+    """ASGI middleware: reject oversized request bodies from Content-Length before they are read."""
+    def __init__(self, app, limit_mb: Optional[float] = None):
+        self.app, self.limit = app, max_bytes(limit_mb)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            cl = dict(scope.get("headers") or []).get(b"content-length")
+            if cl and cl.isdigit() and int(cl) > self.limit:
+                resp = PlainTextResponse(f"upload exceeds {self.limit // (1024 * 1024)} MB", status_code=413)
+                return await resp(scope, receive, send)
+        await self.app(scope, receive, send)
@@ -5,16 +5,19 @@ from pydantic import BaseModel, Field
 import os, io, json, time, uuid, datetime, re, math
 import psycopg
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from pypdf import PdfReader
+from .utils.pdf_extract import extract_pdf_text_sync
+from .utils.uploads import UploadLimit, safe_name, save_upload_sync
 import jwt
 from passlib.context import CryptContext
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
-from .utils.embedder import embed
+from .utils.embedder import VERSION as EMBED_VERSION, embed
+from .utils.embed_cache import EMBED_CACHE_DDL, EmbedCache
 
 app = FastAPI(title="SIMA API v4.2")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True)
+app.add_middleware(UploadLimit)
 
 REQ = Counter("sima_requests_total","reqs",["route","method"])
 LAT = Histogram("sima_request_latency_seconds","lat",["route"], buckets=[0.05,0.1,0.2,0.5,1,2,5,8,13])
@@ -23,6 +26,7 @@ FAIL = Counter("sima_cert_fail_total","fail")
 
 DB = os.getenv("DB_DSN","postgresql://postgres:postgres@db:5432/sima")
 EMB_DIM = int(os.getenv("EMBED_DIM","256"))
+embed_cache = EmbedCache(lambda t: embed(t, dim=EMB_DIM), f"{EMBED_VERSION}-{EMB_DIM}")
 JWT_SECRET = os.getenv("JWT_SECRET","dev")
 JWT_ISS = os.getenv("JWT_ISS","sima")
 JWT_AUD = os.getenv("JWT_AUD","web")
@@ -37,6 +41,8 @@ def init():
             cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
             cur.execute("CREATE TABLE IF NOT EXISTS users(id UUID PRIMARY KEY,email TEXT UNIQUE,full_name TEXT,role TEXT,password_hash TEXT,created_at TIMESTAMPTZ DEFAULT now());")
             cur.execute(f"CREATE TABLE IF NOT EXISTS rag_docs(id TEXT PRIMARY KEY,title TEXT,content TEXT,embedding vector({EMB_DIM}));")
+            cur.execute("CREATE INDEX IF NOT EXISTS rag_docs_embedding_hnsw_ip ON rag_docs USING hnsw (embedding vector_ip_ops);")
+            cur.execute(EMBED_CACHE_DDL)
             cur.execute("CREATE TABLE IF NOT EXISTS projects(id UUID PRIMARY KEY,tracking_no TEXT UNIQUE,title TEXT,consultant UUID,region TEXT,function TEXT,city TEXT,status TEXT,files JSONB DEFAULT '[]',created_at TIMESTAMPTZ DEFAULT now());")
             cur.execute("CREATE TABLE IF NOT EXISTS models(id UUID PRIMARY KEY,project_id UUID,name TEXT,state JSONB DEFAULT '{}',created_at TIMESTAMPTZ DEFAULT now());")
             cur.execute("CREATE TABLE IF NOT EXISTS sensor_data(id UUID PRIMARY KEY,project_id UUID,sensor_type TEXT,val REAL,ts TIMESTAMPTZ DEFAULT now());")
@@ -107,34 +113,26 @@ def create_project(body: ProjectIn, payload=Depends(auth_required(["consultant",
 
 @app.post("/v1/project/{pid}/upload")
 def upload(pid:str, file: UploadFile = File(...), payload=Depends(auth_required(["consultant","authority"]))):
-    content = file.file.read()
-    os.makedirs(f"/app/uploads/{pid}", exist_ok=True)
-    path = f"/app/uploads/{pid}/{file.filename}"
-    open(path,"wb").write(content)
-    if file.filename.lower().endswith(".pdf"):
-        _ingest_pdf(content, file.filename)
+    path = f"/app/uploads/{pid}/{safe_name(file.filename)}"
+    saved = save_upload_sync(file, path)
+    if path.lower().endswith(".pdf"):
+        _ingest_pdf(path, file.filename, saved.sha256)
     with db() as c:
         with c.cursor() as cur:
             cur.execute("UPDATE projects SET files = COALESCE(files,'[]'::jsonb) || %s::jsonb WHERE id=%s",
                         (json.dumps([{"name":file.filename,"path":path}]), pid))
     return {"ok":True}
 
-def _ingest_pdf(pdf_bytes:bytes, title:str):
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    pages = min(len(reader.pages), 35)
-    text_blocks = []
-    for i in range(pages):
-        t = reader.pages[i].extract_text() or ""
-        text_blocks.append(t)
+def _ingest_pdf(src, title:str, sha=None):
+    text_blocks = extract_pdf_text_sync(src, max_pages=35, sha=sha)
     full_text = "\n".join(text_blocks)
     with db() as c:
         with c.cursor() as cur:
-            for i in range(0, len(full_text), 1200):
-                chunk = full_text[i:i+1200]
-                eid = f"{title}-{i//1200+1}"
-                vec = embed(chunk, dim=int(os.getenv("EMBED_DIM","256")))
-                cur.execute("INSERT INTO rag_docs (id,title,content,embedding) VALUES (%s,%s,%s,%s) ON CONFLICT (id) DO UPDATE SET content=EXCLUDED.content, embedding=EXCLUDED.embedding;",
-                            (eid, title, chunk, vec))
+            chunks = [full_text[i:i+1200] for i in range(0, len(full_text), 1200)]
+            vecs = embed_cache.embed_many(cur, chunks)
+            cur.executemany("INSERT INTO rag_docs (id,title,content,embedding) VALUES (%s,%s,%s,%s) ON CONFLICT (id) DO UPDATE SET content=EXCLUDED.content, embedding=EXCLUDED.embedding "
+                            "WHERE (rag_docs.content, rag_docs.embedding) IS DISTINCT FROM (EXCLUDED.content, EXCLUDED.embedding);",
+                            [(f"{title}-{n}", title, chunk, vec) for n, (chunk, vec) in enumerate(zip(chunks, vecs), 1)])
 
 # ---- RAG ----
 class RAGIn(BaseModel): text:str
@@ -143,20 +141,21 @@ def rag_ingest(body: RAGIn, payload=Depends(auth_required())):
     txt = body.text.strip()
     if not txt: raise HTTPException(400,"empty")
     vid = f"user-{uuid.uuid4()}"
-    vec = embed(txt, dim=int(os.getenv("EMBED_DIM","256")))
     with db() as c:
         with c.cursor() as cur:
+            vec = embed_cache.embed(cur, txt)
             cur.execute("INSERT INTO rag_docs (id,title,content,embedding) VALUES (%s,%s,%s,%s)",
                         (vid, "user", txt, vec))
     return {"ok":True, "id":vid}
 
-class RAGQuery(BaseModel): query:str; k:int=5
+class RAGQuery(BaseModel): query:str; k:int=5; ef_search:int|None=None
 @app.post("/v1/rag/search")
 def rag_search(body: RAGQuery, payload=Depends(auth_required())):
-    vec = embed(body.query, dim=int(os.getenv("EMBED_DIM","256")))
+    vec = embed_cache.embed(None, body.query)
     sql = "SELECT id,title,content, (embedding <#> %s::vector) AS dist FROM rag_docs ORDER BY embedding <#> %s::vector ASC LIMIT %s"
     with db() as c:
-        with c.cursor() as cur:
+        with c.transaction(), c.cursor() as cur:
+            if body.ef_search: cur.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(body.ef_search),))
             cur.execute(sql, (vec, vec, body.k))
             rows = cur.fetchall()
     return {"results":[{"id":r[0],"title":r[1],"content":r[2][:300],"distance":float(r[3])} for r in rows]}
@@ -13,6 +13,7 @@ import qrcode
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
+from .utils.tokenizer import tokenize
 
 app = FastAPI(title="SIMA AI Unified API", version="1.1.0")
 origins = os.getenv("CORS_ORIGINS","http://localhost:3000").split(",")
@@ -73,9 +74,8 @@ def db_init():
 db_init()
 
 def hash_embed(text: str, dim: int = 384):
-    import hashlib, numpy as np, re
     vec = np.zeros(dim, dtype=np.float32)
-    for tok in re.findall(r"\\w+", text.lower()):
+    for tok in tokenize(text):
         h = int(hashlib.md5(tok.encode()).hexdigest(), 16)
         vec[h % dim] += 1.0
     n = np.linalg.norm(vec) + 1e-9
@@ -2,7 +2,7 @@ from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request,
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, Response, PlainTextResponse
 from pydantic import BaseModel, Field
-import os, io, json, time, uuid, datetime, re, math
+import os, io, json, time, uuid, datetime, re, math, hashlib
 import psycopg
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 from pypdf import PdfReader
@@ -11,7 +11,8 @@ from passlib.context import CryptContext
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
-from .utils.embedder import embed
+from .utils.embedder import VERSION as EMBED_VERSION, embed
+from .utils.embed_cache import EMBED_CACHE_DDL, EmbedCache
 
 app = FastAPI(title="SIMA API v4.2 + Upgrade Pack 1")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True)
@@ -23,6 +24,7 @@ FAIL = Counter("sima_cert_fail_total","fail")
 
 DB = os.getenv("DB_DSN","postgresql://postgres:postgres@db:5432/sima")
 EMB_DIM = int(os.getenv("EMBED_DIM","256"))
+embed_cache = EmbedCache(lambda t: embed(t, dim=EMB_DIM), f"{EMBED_VERSION}-{EMB_DIM}")
 JWT_SECRET = os.getenv("JWT_SECRET","dev")
 JWT_ISS = os.getenv("JWT_ISS","sima")
 JWT_AUD = os.getenv("JWT_AUD","web")
@@ -37,6 +39,8 @@ def init():
             cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
             cur.execute("CREATE TABLE IF NOT EXISTS users(id UUID PRIMARY KEY,email TEXT UNIQUE,full_name TEXT,role TEXT,password_hash TEXT,created_at TIMESTAMPTZ DEFAULT now());")
             cur.execute(f"CREATE TABLE IF NOT EXISTS rag_docs(id TEXT PRIMARY KEY,title TEXT,content TEXT,embedding vector({EMB_DIM}));")
+            cur.execute("CREATE INDEX IF NOT EXISTS rag_docs_embedding_hnsw_ip ON rag_docs USING hnsw (embedding vector_ip_ops);")
+            cur.execute(EMBED_CACHE_DDL)
             cur.execute("CREATE TABLE IF NOT EXISTS projects(id UUID PRIMARY KEY,tracking_no TEXT UNIQUE,title TEXT,consultant UUID,region TEXT,function TEXT,city TEXT,status TEXT,files JSONB DEFAULT '[]',created_at TIMESTAMPTZ DEFAULT now());")
             cur.execute("CREATE TABLE IF NOT EXISTS models(id UUID PRIMARY KEY,project_id UUID,name TEXT,state JSONB DEFAULT '{}',created_at TIMESTAMPTZ DEFAULT now());")
             cur.execute("CREATE TABLE IF NOT EXISTS sensor_data(id UUID PRIMARY KEY,project_id UUID,sensor_type TEXT,val REAL,ts TIMESTAMPTZ DEFAULT now());")
@@ -126,12 +130,11 @@ def _ingest_pdf(pdf_bytes:bytes, title:str):
     full_text = "\n".join(text_blocks)
     with db() as c:
         with c.cursor() as cur:
-            for i in range(0, len(full_text), 1200):
-                chunk = full_text[i:i+1200]
-                eid = f"{title}-{i//1200+1}"
-                vec = embed(chunk, dim=int(os.getenv("EMBED_DIM","256")))
-                cur.execute("INSERT INTO rag_docs (id,title,content,embedding) VALUES (%s,%s,%s,%s) ON CONFLICT (id) DO UPDATE SET content=EXCLUDED.content, embedding=EXCLUDED.embedding;",
-                            (eid, title, chunk, vec))
+            chunks = [full_text[i:i+1200] for i in range(0, len(full_text), 1200)]
+            vecs = embed_cache.embed_many(cur, chunks)
+            cur.executemany("INSERT INTO rag_docs (id,title,content,embedding) VALUES (%s,%s,%s,%s) ON CONFLICT (id) DO UPDATE SET content=EXCLUDED.content, embedding=EXCLUDED.embedding "
+                            "WHERE (rag_docs.content, rag_docs.embedding) IS DISTINCT FROM (EXCLUDED.content, EXCLUDED.embedding);",
+                            [(f"{title}-{n}", title, chunk, vec) for n, (chunk, vec) in enumerate(zip(chunks, vecs), 1)])
 
 # ---- DASC EXTRACTOR (Upgrade Pack 1) ----
 class ExtractResult(BaseModel):
@@ -160,24 +163,22 @@ def extract_dasc(region: str, file: UploadFile = File(...), payload=Depends(auth
             items.append(it)
     with db() as c:
         with c.cursor() as cur:
-            for it in items:
-                eid = f"{region}-{it['code']}-{uuid.uuid4().hex[:8]}"
-                vec = embed(it["text"], dim=int(os.getenv("EMBED_DIM","256")))
-                cur.execute("""
-                  INSERT INTO rag_docs (id,title,content,embedding)
-                  VALUES (%s,%s,%s,%s)
-                  ON CONFLICT (id) DO NOTHING
-                """, (eid, f"{region} guideline", it["text"], vec))
+            vecs = embed_cache.embed_many(cur, [it["text"] for it in items])
+            # ids derive from the clause text, so re-extracting the same PDF lands on the existing rows
+            cur.executemany("INSERT INTO rag_docs (id,title,content,embedding) VALUES (%s,%s,%s,%s) ON CONFLICT (id) DO NOTHING;",
+                            [(f"{region}-{it['code']}-{hashlib.sha256(it['text'].encode('utf-8')).hexdigest()[:8]}", f"{region} guideline", it["text"], vec)
+                             for it, vec in zip(items, vecs)])
     return {"region": region, "items": items}
 
 # ---- RAG Query ----
-class RAGQuery(BaseModel): query:str; k:int=5
+class RAGQuery(BaseModel): query:str; k:int=5; ef_search:int|None=None
 @app.post("/v1/rag/search")
 def rag_search(body: RAGQuery, payload=Depends(auth_required())):
-    vec = embed(body.query, dim=int(os.getenv("EMBED_DIM","256")))
+    vec = embed_cache.embed(None, body.query)
     sql = "SELECT id,title,content, (embedding <#> %s::vector) AS dist FROM rag_docs ORDER BY embedding <#> %s::vector ASC LIMIT %s"
     with db() as c:
-        with c.cursor() as cur:
+        with c.transaction(), c.cursor() as cur:
+            if body.ef_search: cur.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(body.ef_search),))
             cur.execute(sql, (vec, vec, body.k))
             rows = cur.fetchall()
     return {"results":[{"id":r[0],"title":r[1],"content":r[2][:300],"distance":float(r[3])} for r in rows]}
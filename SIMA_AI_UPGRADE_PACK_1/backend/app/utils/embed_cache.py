@@ -0,0 +1,69 @@
+import os, json, hashlib, threading, unicodedata
+from collections import OrderedDict
+from typing import Callable, List, Optional
+from prometheus_client import Counter, Gauge
+
+# Content-addressed embedding cache: sha256(embedder version + normalized text) -> vector, kept in the
+# embed_cache table with an in-process LRU in front. Re-uploads and re-extracts of unchanged chunks are
+# resolved with one SELECT per batch instead of being re-embedded; bump the version when the embedder changes.
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE","20000"))
+EMBED_CACHE_DDL = "CREATE TABLE IF NOT EXISTS embed_cache(key TEXT PRIMARY KEY, version TEXT NOT NULL, embedding REAL[] NOT NULL, created_at TIMESTAMPTZ DEFAULT now());"
+
+EMBED_CACHE = Counter("sima_embed_cache_total","Embedding lookups",["result"])   # memory | store | miss
+EMBED_CACHE_RATIO = Gauge("sima_embed_cache_hit_ratio","Embedding lookups served from memory or the store since start")
+
+def _hit_ratio() -> float:
+    counts = {m.labels["result"]: m.value for f in EMBED_CACHE.collect() for m in f.samples if m.name.endswith("_total")}
+    total = sum(counts.values())
+    return (total - counts.get("miss", 0.0)) / total if total else 0.0
+EMBED_CACHE_RATIO.set_function(_hit_ratio)
+
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFC", " ".join((text or "").split()))
+
+def _floats(vec) -> List[float]:
+    if isinstance(vec, str): vec = json.loads(vec)   # pgvector text literal
+    return [float(x) for x in vec]
+
+class EmbedCache:
+    def __init__(self, embed_fn: Callable[[str], list], version: str, size: int = EMBED_CACHE_SIZE):
+        self.embed_fn, self.version, self.size = embed_fn, version, size
+        self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.version}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, k: str, v: List[float]):
+        with self._lock:
+            self._lru[k] = v; self._lru.move_to_end(k)
+            while len(self._lru) > self.size: self._lru.popitem(last=False)
+
+    def embed_many(self, cur, texts: List[str]) -> List[List[float]]:
+        """Vectors for `texts`; `cur` (psycopg cursor) enables the embed_cache table tier, None = memory only."""
+        keys = [self.key(t) for t in texts]
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        with self._lock:
+            for i, k in enumerate(keys):
+                v = self._lru.get(k)
+                if v is not None: self._lru.move_to_end(k); out[i] = v
+        EMBED_CACHE.labels(result="memory").inc(sum(v is not None for v in out))
+        todo = {keys[i]: texts[i] for i, v in enumerate(out) if v is None}
+        found = {}
+        if todo and cur is not None:
+            cur.execute("SELECT key, embedding FROM embed_cache WHERE key = ANY(%s);", (list(todo),))
+            found = {k: list(v) for k, v in cur.fetchall()}
+            EMBED_CACHE.labels(result="store").inc(len(found))
+        fresh = {k: _floats(self.embed_fn(t)) for k, t in todo.items() if k not in found}
+        EMBED_CACHE.labels(result="miss").inc(len(fresh))
+        if fresh and cur is not None:
+            cur.executemany("INSERT INTO embed_cache (key, version, embedding) VALUES (%s,%s,%s) ON CONFLICT (key) DO NOTHING;",
+                            [(k, self.version, v) for k, v in fresh.items()])
+        found.update(fresh)
+        for i, k in enumerate(keys):
+            if out[i] is None:
+                out[i] = found[k]; self._remember(k, out[i])
+        return out
+
+    def embed(self, cur, text: str) -> List[float]:
+        return self.embed_many(cur, [text])[0]
@@ -0,0 +1,5 @@
+-- rag_search orders by <#> (negative inner product); the cosine-ops index from 2025_10_23_add_hnsw is never used for it.
+DROP INDEX CONCURRENTLY IF EXISTS rag_docs_embedding_hnsw;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS rag_docs_embedding_hnsw_ip
+ON rag_docs USING hnsw (embedding vector_ip_ops)
+WITH (m = 16, ef_construction = 64);
@@ -2,10 +2,15 @@ from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request,
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, Response, PlainTextResponse
 from pydantic import BaseModel, Field
-import os, io, json, time, uuid, datetime, re
+import os, io, json, time, uuid, datetime, re, hashlib
 import psycopg
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from pypdf import PdfReader
+from .utils.pdf_extract import extract_pdf_text_sync
+from .utils.uploads import UploadLimit, safe_name, save_upload_sync
+from .utils import jobs
+from .utils.embed_cache import EMBED_CACHE_DDL, EmbedCache
+from .utils import sensor_partitions
+from .utils.sensor_rollups import Rollups, parse_step, shape
 import jwt
 from passlib.context import CryptContext
 from reportlab.lib.pagesizes import A4
@@ -13,9 +18,9 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
 
 try:
-    from .utils.embedder import embed
+    from .utils.embedder import VERSION as EMBED_VERSION, embed
 except Exception:
-    import hashlib
+    EMBED_VERSION = "sha256-bytes"
     def embed(text: str, dim: int = 256):
         h = hashlib.sha256(text.encode("utf-8")).digest()
         v = (h * ((dim // len(h)) + 1))[:dim]
@@ -23,12 +28,14 @@ except Exception:
 
 app = FastAPI(title="SIMA API v4.3 (Upgrade Pack 2)")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True)
+app.add_middleware(UploadLimit)
 
 REQ = Counter("sima_requests_total","reqs",["route","method"])
 LAT = Histogram("sima_request_latency_seconds","lat",["route"], buckets=[0.05,0.1,0.2,0.5,1,2,5,8,13])
 
 DB = os.getenv("DB_DSN","postgresql://postgres:postgres@db:5432/sima")
 EMB_DIM = int(os.getenv("EMBED_DIM","256"))
+embed_cache = EmbedCache(lambda t: embed(t, dim=EMB_DIM), f"{EMBED_VERSION}-{EMB_DIM}")
 JWT_SECRET = os.getenv("JWT_SECRET","dev")
 JWT_ISS = os.getenv("JWT_ISS","sima")
 JWT_AUD = os.getenv("JWT_AUD","web")
@@ -38,15 +45,18 @@ pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
 def db():
     return psycopg.connect(DB, autocommit=True)
 
+rollups = Rollups("sensor_data", ["id", "project_id", "sensor_type", "val", "ts"], kind="sensor_type", value="val")
+
 def init():
     with db() as c:
         with c.cursor() as cur:
             cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
             cur.execute("CREATE TABLE IF NOT EXISTS users(id UUID PRIMARY KEY,email TEXT UNIQUE,full_name TEXT,role TEXT,password_hash TEXT,created_at TIMESTAMPTZ DEFAULT now());")
             cur.execute(f"CREATE TABLE IF NOT EXISTS rag_docs(id TEXT PRIMARY KEY,title TEXT,content TEXT,embedding vector({EMB_DIM}));")
+            cur.execute("CREATE INDEX IF NOT EXISTS rag_docs_embedding_hnsw_ip ON rag_docs USING hnsw (embedding vector_ip_ops);")
+            cur.execute(EMBED_CACHE_DDL)
             cur.execute("CREATE TABLE IF NOT EXISTS projects(id UUID PRIMARY KEY,tracking_no TEXT UNIQUE,title TEXT,consultant UUID,region TEXT,function TEXT,city TEXT,status TEXT,files JSONB DEFAULT '[]',created_at TIMESTAMPTZ DEFAULT now());")
             cur.execute("CREATE TABLE IF NOT EXISTS models(id UUID PRIMARY KEY,project_id UUID,name TEXT,state JSONB DEFAULT '{}',created_at TIMESTAMPTZ DEFAULT now());")
-            cur.execute("CREATE TABLE IF NOT EXISTS sensor_data(id UUID PRIMARY KEY,project_id UUID,sensor_type TEXT,val REAL,ts TIMESTAMPTZ DEFAULT now());")
             cur.execute("""CREATE TABLE IF NOT EXISTS workflow_instances(
                 id UUID PRIMARY KEY, project_id UUID, stage TEXT, status TEXT, created_at TIMESTAMPTZ DEFAULT now(), updated_at TIMESTAMPTZ DEFAULT now()
             );""")
@@ -61,6 +71,10 @@ def init():
             cur.execute("""CREATE TABLE IF NOT EXISTS model_changes(
                 id UUID PRIMARY KEY, project_id UUID, change JSONB, delta_score REAL, created_at TIMESTAMPTZ DEFAULT now()
             );""")
+            jobs.init_schema(cur)
+    sensor_partitions.setup(DB, "sensor_data", "id UUID NOT NULL,project_id UUID,sensor_type TEXT,val REAL,ts TIMESTAMPTZ NOT NULL DEFAULT now(),PRIMARY KEY (id, ts)",
+                            ["id", "project_id", "sensor_type", "val", "ts"])
+    rollups.setup(DB, backfill=False)   # the ingestor backfills and maintains them
 init()
 
 def issue_token(user_id: str, role: str, email: str):
@@ -105,6 +119,10 @@ def health():
 
 @app.get("/metrics")
 def metrics():
+    try:
+        jobs.refresh_metrics()
+    except Exception:
+        pass
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.post("/auth/register")
@@ -143,36 +161,60 @@ def create_project(body: ProjectIn, payload=Depends(auth_required(["consultant",
 
 @app.post("/v1/project/{pid}/upload")
 def upload(pid: str, file: UploadFile = File(...), payload=Depends(auth_required(["consultant","authority"]))):
-    content = file.file.read()
-    os.makedirs(f"/app/uploads/{pid}", exist_ok=True)
-    path = f"/app/uploads/{pid}/{file.filename}"
-    with open(path, "wb") as f:
-        f.write(content)
-    if file.filename.lower().endswith(".pdf"):
-        _ingest_pdf(content, file.filename)
+    path = os.path.join(jobs.JOB_FILES_DIR, pid, safe_name(file.filename))   # shared storage: any replica's worker reads it
+    saved = save_upload_sync(file, path)
+    job_id = None
     with db() as c:
         with c.cursor() as cur:
             cur.execute("UPDATE projects SET files = COALESCE(files,'[]'::jsonb) || %s::jsonb WHERE id=%s", (json.dumps([{"name": file.filename, "path": path}]), pid))
-    return {"ok": True}
+            if file.filename.lower().endswith(".pdf"):
+                job_id = jobs.enqueue(cur, "pdf_ingest", "extract", {"file": jobs.file_ref(path), "title": file.filename, "sha256": saved.sha256}, project_id=pid)
+    return {"ok": True, "job_id": job_id}
 
-def _ingest_pdf(pdf_bytes: bytes, title: str):
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    pages = min(len(reader.pages), 35)
-    text_blocks = []
-    for i in range(pages):
-        t = reader.pages[i].extract_text() or ""
-        text_blocks.append(t)
-    full_text = "\n".join(text_blocks)
+@app.get("/v1/jobs/{job_id}")
+def job_status(job_id: str, payload=Depends(auth_required())):
+    with db() as c:
+        with c.cursor() as cur:
+            job = jobs.get_job(cur, job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return job
+
+# -------- Ingestion stages: extract -> embed -> index --------
+def _stage_extract(data: dict):
+    path = jobs.file_path(data["file"]) if "file" in data else data["path"]   # "path": jobs queued before JOB_FILES_DIR
+    pages = extract_pdf_text_sync(path, max_pages=35, sha=data.get("sha256"))
+    return "embed", {"title": data["title"], "text": "\n".join(pages)}
+
+def _stage_embed(data: dict):
+    title, full_text, step = data["title"], data["text"], 1200
+    chunks = [full_text[i:i+step] for i in range(0, len(full_text), step)]
     with db() as c:
         with c.cursor() as cur:
-            i = 0
-            step = 1200
-            while i < len(full_text):
-                chunk = full_text[i:i+step]
-                i += step
-                eid = f"{title}-{i//step}"
-                vec = embed(chunk, dim=EMB_DIM)
-                cur.execute("INSERT INTO rag_docs (id,title,content,embedding) VALUES (%s,%s,%s,%s) ON CONFLICT (id) DO UPDATE SET content=EXCLUDED.content, embedding=EXCLUDED.embedding;", (eid, title, chunk, vec))
+            vecs = embed_cache.embed_many(cur, chunks)
+    rows = [[f"{title}-{n}", chunk, vec] for n, (chunk, vec) in enumerate(zip(chunks, vecs), 1)]
+    return "index", {"title": title, "rows": rows}
+
+def _stage_index(data: dict):
+    title, rows = data["title"], data["rows"]
+    with db() as c:
+        with c.transaction(), c.cursor() as cur:
+            cur.executemany("INSERT INTO rag_docs (id,title,content,embedding) VALUES (%s,%s,%s,%s) ON CONFLICT (id) DO UPDATE SET content=EXCLUDED.content, embedding=EXCLUDED.embedding "
+                            "WHERE (rag_docs.content, rag_docs.embedding) IS DISTINCT FROM (EXCLUDED.content, EXCLUDED.embedding);",
+                            [(eid, title, chunk, vec) for eid, chunk, vec in rows])
+    return None, {"title": title, "chunks": len(rows)}
+
+jobs.register("extract", _stage_extract)
+jobs.register("embed", _stage_embed)
+jobs.register("index", _stage_index)
+
+@app.on_event("startup")
+def start_jobs():
+    jobs.start(DB, workers=bool(int(os.getenv("JOB_WORKERS", "1"))))
+
+@app.on_event("shutdown")
+def stop_jobs():
+    jobs.stop()
 
 class ExtractResult(BaseModel):
     region: str
@@ -182,10 +224,11 @@ class ExtractResult(BaseModel):
 def extract_dasc(region: str, file: UploadFile = File(...), payload=Depends(auth_required(["authority","consultant"]))):
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(400, "PDF only")
-    text = ""
-    reader = PdfReader(io.BytesIO(file.file.read()))
-    for p in reader.pages:
-        text += (p.extract_text() or "") + "\n"
+    saved = save_upload_sync(file, f"/app/uploads/.dasc/{uuid.uuid4().hex}.pdf")
+    try:
+        text = "\n".join(extract_pdf_text_sync(saved.path, sha=saved.sha256)) + "\n"
+    finally:
+        os.unlink(saved.path)
     lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
     items = []
     code_pat = re.compile(r"^([A-ZIVX]+\.\d+|\d+\.\d+)\)?[:\- ]?", re.I)
@@ -200,22 +243,25 @@ def extract_dasc(region: str, file: UploadFile = File(...), payload=Depends(auth
             items.append(it)
     with db() as c:
         with c.cursor() as cur:
-            for it in items:
-                eid = f"{region}-{it['code']}-{uuid.uuid4().hex[:8]}"
-                vec = embed(it["text"], dim=EMB_DIM)
-                cur.execute("INSERT INTO rag_docs (id,title,content,embedding) VALUES (%s,%s,%s,%s) ON CONFLICT (id) DO NOTHING;", (eid, f"{region} guideline", it["text"], vec))
+            vecs = embed_cache.embed_many(cur, [it["text"] for it in items])
+            # ids derive from the clause text, so re-extracting the same PDF lands on the existing rows
+            cur.executemany("INSERT INTO rag_docs (id,title,content,embedding) VALUES (%s,%s,%s,%s) ON CONFLICT (id) DO NOTHING;",
+                            [(f"{region}-{it['code']}-{hashlib.sha256(it['text'].encode('utf-8')).hexdigest()[:8]}", f"{region} guideline", it["text"], vec)
+                             for it, vec in zip(items, vecs)])
     return {"region": region, "items": items}
 
 class RAGQuery(BaseModel):
     query: str
     k: int = 5
+    ef_search: int | None = None
 
 @app.post("/v1/rag/search")
 def rag_search(body: RAGQuery, payload=Depends(auth_required())):
-    vec = embed(body.query, dim=EMB_DIM)
+    vec = embed_cache.embed(None, body.query)
     sql = "SELECT id,title,content, (embedding <#> %s::vector) AS dist FROM rag_docs ORDER BY embedding <#> %s::vector ASC LIMIT %s"
     with db() as c:
-        with c.cursor() as cur:
+        with c.transaction(), c.cursor() as cur:
+            if body.ef_search: cur.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(body.ef_search),))
             cur.execute(sql, (vec, vec, body.k))
             rows = cur.fetchall()
     return {"results": [{"id": r[0], "title": r[1], "content": r[2][:300], "distance": float(r[3])} for r in rows]}
@@ -416,6 +462,20 @@ def sensor_latest(project_id: str, limit: int = 50):
             rows = cur.fetchall()
     return {"data": [{"type": r[0], "val": float(r[1]), "ts": r[2].isoformat()} for r in rows]}
 
+@app.get("/v1/sensor/{project_id}/series")
+def sensor_series(project_id: str, start: datetime.datetime | None = Query(None, alias="from"), end: datetime.datetime | None = Query(None, alias="to"),
+                  step: str = "1h", agg: str = "avg", type: str | None = None):
+    try:
+        project_id = str(uuid.UUID(project_id))
+        sql, params, src = rollups.series_query(project_id, start, end, parse_step(step), agg, type)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    with db() as c:
+        with c.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+    return {"project_id": project_id, "step": int(params["step"].total_seconds()), "agg": agg, "source": src, "series": shape(rows)}
+
 # -------- Pack 2: IFC Re-evaluation --------
 class ModifyOp(BaseModel):
     element_id: int | None = None
@@ -0,0 +1,180 @@
+import os, json, time, uuid, socket, threading, logging
+from typing import Callable, Dict, Optional, Tuple
+import psycopg
+from prometheus_client import Counter, Gauge, Histogram
+
+log = logging.getLogger("sima.jobs")
+
+# Durable Postgres job queue: workers claim rows with FOR UPDATE SKIP LOCKED, one row per job,
+# advancing through registered stages; failures are retried with exponential backoff. A running job's
+# lease is extended by a heartbeat while its handler works, so only a dead worker's job is reclaimed.
+# Input files stay on disk: jobs carry a path relative to JOB_FILES_DIR, which every replica must mount
+# (shared volume / NFS), plus the file's sha256; nothing large goes through Postgres.
+JOB_POLL = float(os.getenv("JOB_POLL","1.0"))
+JOB_LEASE = int(os.getenv("JOB_LEASE","600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS","5"))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE","2"))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX","300"))
+JOB_HEARTBEAT = float(os.getenv("JOB_HEARTBEAT", str(JOB_LEASE / 4)))
+JOB_FILES_DIR = os.getenv("JOB_FILES_DIR","/app/uploads")
+
+STAGE_LAT = Histogram("sima_job_stage_seconds", "job stage latency", ["stage"], buckets=[0.1,0.5,1,2,5,10,30,60,120,300])
+STAGE_DONE = Counter("sima_job_stage_total", "job stage outcomes", ["stage", "outcome"])
+QUEUE_DEPTH = Gauge("sima_job_queue_depth", "jobs by stage and status", ["stage", "status"])
+QUEUE_AGE = Gauge("sima_job_oldest_queued_seconds", "age of the oldest runnable job", ["stage"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs(
+    id UUID PRIMARY KEY, kind TEXT NOT NULL, stage TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'queued',
+    project_id UUID NULL, data JSONB NOT NULL DEFAULT '{}', result JSONB NULL, error TEXT NULL,
+    attempts INT NOT NULL DEFAULT 0, max_attempts INT NOT NULL DEFAULT 5,
+    run_after TIMESTAMPTZ NOT NULL DEFAULT now(), locked_by TEXT NULL, locked_at TIMESTAMPTZ NULL,
+    created_at TIMESTAMPTZ DEFAULT now(), updated_at TIMESTAMPTZ DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS jobs_runnable_idx ON jobs(stage, run_after) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS jobs_running_idx ON jobs(locked_at) WHERE status = 'running';
+"""
+
+# queued jobs whose run_after has passed, plus running jobs whose lease expired (worker died)
+CLAIM_SQL = """
+UPDATE jobs SET status='running', locked_by=%s, locked_at=now(), attempts=attempts+1, updated_at=now()
+WHERE id = (
+    SELECT id FROM jobs
+    WHERE stage=%s AND ((status='queued' AND run_after<=now())
+       OR (status='running' AND locked_at < now() - make_interval(secs => %s)))
+    ORDER BY run_after
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING id, kind, data, attempts, max_attempts
+"""
+
+Handler = Callable[[dict], Tuple[Optional[str], dict]]
+
+_handlers: Dict[str, Handler] = {}
+_concurrency: Dict[str, int] = {}
+_threads: list = []
+_stop = threading.Event()
+_dsn: Optional[str] = None
+_worker_id = f"{socket.gethostname()}-{os.getpid()}"
+
+def _connect():
+    return psycopg.connect(_dsn, autocommit=True)
+
+def init_schema(cur):
+    cur.execute(SCHEMA)
+
+def register(stage: str, fn: Handler, concurrency: Optional[int] = None):
+    _handlers[stage] = fn
+    _concurrency[stage] = concurrency if concurrency is not None else int(os.getenv(f"JOB_CONCURRENCY_{stage.upper()}","1"))
+
+def enqueue(cur, kind: str, stage: str, data: dict, project_id: Optional[str] = None, max_attempts: Optional[int] = None) -> str:
+    jid = str(uuid.uuid4())
+    cur.execute("INSERT INTO jobs(id,kind,stage,project_id,data,max_attempts) VALUES(%s,%s,%s,%s,%s,%s)",
+                (jid, kind, stage, project_id, json.dumps(data), max_attempts or JOB_MAX_ATTEMPTS))
+    return jid
+
+def file_ref(path: str) -> str:
+    """Job-data reference for an input file: its path relative to the shared JOB_FILES_DIR."""
+    rel = os.path.relpath(os.path.abspath(path), os.path.abspath(JOB_FILES_DIR))
+    if rel.startswith(".."): raise ValueError(f"{path} is outside JOB_FILES_DIR ({JOB_FILES_DIR})")
+    return rel
+
+def file_path(ref: str) -> str:
+    path = os.path.join(JOB_FILES_DIR, ref)
+    if not os.path.exists(path): raise FileNotFoundError(f"{path} missing: is JOB_FILES_DIR shared by every replica?")
+    return path
+
+def get_job(cur, jid: str) -> Optional[dict]:
+    cur.execute("SELECT id,kind,stage,status,project_id,result,error,attempts,max_attempts,run_after,created_at,updated_at FROM jobs WHERE id=%s", (jid,))
+    r = cur.fetchone()
+    if not r:
+        return None
+    keys = ["id","kind","stage","status","project_id","result","error","attempts","max_attempts","run_after","created_at","updated_at"]
+    return {k: (str(v) if k in ("id","project_id") and v is not None else v) for k, v in zip(keys, r)}
+
+def backoff(attempts: int) -> float:
+    return min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE ** attempts)
+
+def _heartbeat(jid, done: threading.Event):
+    # keep locked_at fresh so CLAIM_SQL does not hand a long-running job to a second worker
+    while not done.wait(JOB_HEARTBEAT):
+        try:
+            with _connect() as c:
+                c.execute("UPDATE jobs SET locked_at=now() WHERE id=%s AND locked_by=%s AND status='running'", (jid, _worker_id))
+        except Exception as e:
+            log.warning("job %s heartbeat: %s", jid, e)
+
+def run_once(stage: str) -> bool:
+    fn = _handlers[stage]
+    with _connect() as c, c.cursor() as cur:
+        cur.execute(CLAIM_SQL, (_worker_id, stage, JOB_LEASE))
+        row = cur.fetchone()
+        if not row:
+            return False
+        jid, kind, data, attempts, max_attempts = row
+        t0 = time.perf_counter()
+        done = threading.Event()
+        threading.Thread(target=_heartbeat, args=(jid, done), name=f"job-heartbeat-{stage}", daemon=True).start()
+        try:
+            nxt, data = fn(dict(data, job_id=str(jid), kind=kind))
+            data.pop("job_id", None); data.pop("kind", None)
+        except Exception as e:
+            STAGE_LAT.labels(stage).observe(time.perf_counter() - t0)
+            failed = attempts >= max_attempts
+            STAGE_DONE.labels(stage, "failed" if failed else "retry").inc()
+            log.warning("job %s stage %s attempt %d/%d: %s", jid, stage, attempts, max_attempts, e)
+            cur.execute("UPDATE jobs SET status=%s, error=%s, locked_by=NULL, locked_at=NULL, run_after=now()+make_interval(secs => %s), updated_at=now() WHERE id=%s AND locked_by=%s",
+                        ("failed" if failed else "queued", f"{type(e).__name__}: {e}"[:2000], backoff(attempts), jid, _worker_id))
+            return True
+        finally:
+            done.set()
+        STAGE_LAT.labels(stage).observe(time.perf_counter() - t0)
+        STAGE_DONE.labels(stage, "ok").inc()
+        if nxt:
+            cur.execute("UPDATE jobs SET stage=%s, status='queued', data=%s, error=NULL, attempts=0, locked_by=NULL, locked_at=NULL, run_after=now(), updated_at=now() WHERE id=%s AND locked_by=%s",
+                        (nxt, json.dumps(data), jid, _worker_id))
+        else:
+            cur.execute("UPDATE jobs SET status='done', data='{}', result=%s, error=NULL, locked_by=NULL, locked_at=NULL, updated_at=now() WHERE id=%s AND locked_by=%s",
+                        (json.dumps(data), jid, _worker_id))
+        return True
+
+def _loop(stage: str):
+    while not _stop.is_set():
+        try:
+            if run_once(stage):
+                continue
+        except Exception as e:
+            log.warning("job worker %s: %s", stage, e)
+        _stop.wait(JOB_POLL)
+
+def refresh_metrics():
+    if not _dsn:
+        return
+    with _connect() as c, c.cursor() as cur:
+        cur.execute("SELECT stage, status, count(*) FROM jobs WHERE status IN ('queued','running','failed') GROUP BY 1,2")
+        seen = {(s, st): n for s, st, n in cur.fetchall()}
+        cur.execute("SELECT stage, EXTRACT(EPOCH FROM now()-min(run_after)) FROM jobs WHERE status='queued' AND run_after<=now() GROUP BY 1")
+        ages = dict(cur.fetchall())
+    for stage in _handlers:
+        for st in ("queued", "running", "failed"):
+            QUEUE_DEPTH.labels(stage, st).set(seen.get((stage, st), 0))
+        QUEUE_AGE.labels(stage).set(float(ages.get(stage) or 0))
+
+def start(dsn: str, workers: bool = True):
+    global _dsn
+    _dsn = dsn
+    _stop.clear()
+    if not workers:
+        return
+    for stage, n in _concurrency.items():
+        for i in range(n):
+            t = threading.Thread(target=_loop, args=(stage,), name=f"job-{stage}-{i}", daemon=True)
+            t.start()
+            _threads.append(t)
+
+def stop(timeout: float = 10.0):
+    _stop.set()
+    for t in _threads:
+        t.join(timeout)
+    _threads.clear()
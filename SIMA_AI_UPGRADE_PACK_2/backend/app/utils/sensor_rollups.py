@@ -0,0 +1,155 @@
+import os, re, math, datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+import psycopg
+
+# Downsampled sensor history: <table>_1m / _1h / _1d hold count, sum, min and max per (project, type,
+# bucket). The ingestor folds every COPY batch into all three inside the same transaction (apply), so the
+# rollups never drift from the raw rows. Series queries read the coarsest level whose width divides the
+# requested step and still holds the window's start (per-level retention), re-bucketed with date_bin; steps
+# finer than a minute, or windows older than every fitting level keeps, fall back to the raw table.
+ROLLUP_1M_DAYS = int(os.getenv("ROLLUP_1M_DAYS","30"))     # 0 = keep everything
+ROLLUP_1H_DAYS = int(os.getenv("ROLLUP_1H_DAYS","400"))
+ROLLUP_1D_DAYS = int(os.getenv("ROLLUP_1D_DAYS","0"))
+SERIES_MAX_POINTS = int(os.getenv("SERIES_MAX_POINTS","5000"))
+
+LEVELS = [("1m", 60, "minute", ROLLUP_1M_DAYS), ("1h", 3600, "hour", ROLLUP_1H_DAYS), ("1d", 86400, "day", ROLLUP_1D_DAYS)]
+AGGS = {"avg": "sum(s) / nullif(sum(n), 0)", "min": "min(lo)", "max": "max(hi)", "count": "sum(n)", "sum": "sum(s)"}
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_step(step: str) -> int:
+    """'300' / '30s' / '5m' / '1h' / '1d' -> seconds."""
+    m = re.fullmatch(r"\s*(\d+)\s*([smhd]?)\s*", str(step))
+    if not m or int(m.group(1)) <= 0: raise ValueError(f"bad step: {step!r}")
+    return int(m.group(1)) * UNITS[m.group(2) or "s"]
+
+def _trunc(ts: datetime.datetime, width: int) -> datetime.datetime:
+    ts = ts.replace(second=0, microsecond=0)
+    if width >= 3600: ts = ts.replace(minute=0)
+    if width >= 86400: ts = ts.replace(hour=0)
+    return ts
+
+class Rollups:
+    def __init__(self, table: str, columns: Sequence[str], kind: str = "type", value: str = "value", tz: bool = True):
+        """`columns` is the BatchWriter column order; `kind`/`value` name the sensor type and reading columns."""
+        self.table, self.kind, self.value, self.tz = table, kind, value, tz
+        cols = list(columns)
+        self._ix = (cols.index("ts"), cols.index("project_id"), cols.index(kind), cols.index(value))
+        self.ts_type = "TIMESTAMPTZ" if tz else "TIMESTAMP"
+
+    def name(self, level: str) -> str:
+        return f"{self.table}_{level}"
+
+    def ddl(self) -> List[str]:
+        return [f"CREATE TABLE IF NOT EXISTS {self.name(lv)}(bucket {self.ts_type} NOT NULL, project_id UUID NOT NULL, type TEXT NOT NULL, "
+                f"n BIGINT NOT NULL, sum DOUBLE PRECISION NOT NULL, min REAL NOT NULL, max REAL NOT NULL, PRIMARY KEY (project_id, type, bucket));"
+                for lv, *_ in LEVELS]
+
+    def _upsert(self, level: str, merge: bool) -> str:
+        r = self.name(level)
+        sets = (f"n = {r}.n + EXCLUDED.n, sum = {r}.sum + EXCLUDED.sum, min = LEAST({r}.min, EXCLUDED.min), max = GREATEST({r}.max, EXCLUDED.max)"
+                if merge else "n = EXCLUDED.n, sum = EXCLUDED.sum, min = EXCLUDED.min, max = EXCLUDED.max")
+        return f"ON CONFLICT (project_id, type, bucket) DO UPDATE SET {sets}"
+
+    def apply(self, cur, rows: List[tuple]):
+        """BatchWriter.in_tx hook: fold a committed-with-it batch into every level (one statement per level)."""
+        its, ipid, ikind, ival = self._ix
+        for level, width, *_ in LEVELS:
+            acc: Dict[Tuple, list] = {}
+            for r in rows:
+                ts, pid, kind, val = r[its], r[ipid], r[ikind], r[ival]
+                if ts is None or pid is None or kind is None or val is None or not math.isfinite(val): continue
+                k = (str(pid), kind, _trunc(ts, width))
+                a = acc.get(k)
+                if a is None: acc[k] = [1, val, val, val]
+                else:
+                    a[0] += 1; a[1] += val
+                    if val < a[2]: a[2] = val
+                    if val > a[3]: a[3] = val
+            if not acc: return
+            keys = sorted(acc)   # same lock order in every writer
+            cur.execute(f"INSERT INTO {self.name(level)} (bucket, project_id, type, n, sum, min, max) "
+                        f"SELECT * FROM unnest(%s::{self.ts_type}[], %s::uuid[], %s::text[], %s::bigint[], %s::float8[], %s::real[], %s::real[]) "
+                        + self._upsert(level, True),
+                        ([k[2] for k in keys], [k[0] for k in keys], [k[1] for k in keys],
+                         [acc[k][0] for k in keys], [acc[k][1] for k in keys], [acc[k][2] for k in keys], [acc[k][3] for k in keys]))
+
+    def _date_trunc(self, unit: str, col: str) -> str:
+        return f"date_trunc('{unit}', {col}, 'UTC')" if self.tz else f"date_trunc('{unit}', {col})"
+
+    def _finite(self) -> str:
+        # NaN/Infinity rows written before the ingestors rejected them would poison sum/min/max
+        return f"{self.value} IS NOT NULL AND {self.value} NOT IN ('NaN', 'Infinity', '-Infinity')"
+
+    def rebuild(self, cur):
+        """Recompute all levels from the raw table (minute level first, coarser levels from it)."""
+        v = self.value
+        cur.execute(f"INSERT INTO {self.name('1m')} (bucket, project_id, type, n, sum, min, max) "
+                    f"SELECT {self._date_trunc('minute', 'ts')}, project_id, {self.kind}, count(*), sum({v}), min({v}), max({v}) FROM {self.table} "
+                    f"WHERE project_id IS NOT NULL AND {self.kind} IS NOT NULL AND {self._finite()} GROUP BY 1, 2, 3 " + self._upsert("1m", False))
+        for level, _, unit, _ in LEVELS[1:]:
+            cur.execute(f"INSERT INTO {self.name(level)} (bucket, project_id, type, n, sum, min, max) "
+                        f"SELECT {self._date_trunc(unit, 'bucket')}, project_id, type, sum(n), sum(sum), min(min), max(max) FROM {self.name('1m')} "
+                        f"GROUP BY 1, 2, 3 " + self._upsert(level, False))
+
+    def setup(self, dsn: str, backfill: bool = True):
+        """Create the rollup tables; backfill from raw rows when the minute level is still empty."""
+        with psycopg.connect(dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (f"rollups:{self.table}",))
+                for ddl in self.ddl(): cur.execute(ddl)
+                if backfill:
+                    cur.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {self.name('1m')}) AND EXISTS (SELECT 1 FROM {self.table});")
+                    if cur.fetchone()[0]: self.rebuild(cur)
+            conn.commit()
+
+    def prune(self, cur):
+        """Maintainer hook: delete buckets older than the level's retention."""
+        for level, _, _, days in LEVELS:
+            if days > 0: cur.execute(f"DELETE FROM {self.name(level)} WHERE bucket < now() - make_interval(days => %s);", (days,))
+
+    def pick(self, step_s: int, start: Optional[datetime.datetime] = None) -> Tuple[str, int]:
+        """Coarsest source whose bucket width divides the step and whose retention still covers `start`:
+        (table, width seconds); width 0 = raw rows."""
+        best = (self.table, 0)
+        now = self._dt(datetime.datetime.now(datetime.timezone.utc))
+        for level, width, _, days in LEVELS:
+            if step_s % width: continue
+            if days > 0 and start is not None and self._dt(start) < now - datetime.timedelta(days=days): continue   # pruned
+            best = (self.name(level), width)
+        return best
+
+    def _dt(self, ts: datetime.datetime) -> datetime.datetime:
+        # aware UTC for TIMESTAMPTZ tables, naive UTC for TIMESTAMP ones
+        if ts.tzinfo is None: ts = ts.replace(tzinfo=datetime.timezone.utc)
+        ts = ts.astimezone(datetime.timezone.utc)
+        return ts if self.tz else ts.replace(tzinfo=None)
+
+    def series_query(self, pid: str, start: Optional[datetime.datetime], end: Optional[datetime.datetime], step_s: int,
+                     agg: str = "avg", kind: Optional[str] = None) -> Tuple[str, dict, str]:
+        """SQL + params for one value per (type, step bucket) over [start, end); raises ValueError on bad input."""
+        if agg not in AGGS: raise ValueError(f"agg must be one of {', '.join(AGGS)}")
+        end = end or datetime.datetime.now(datetime.timezone.utc)
+        start = start or end - min(datetime.timedelta(days=1), datetime.timedelta(seconds=step_s * (SERIES_MAX_POINTS - 1)))
+        end, start = self._dt(end), self._dt(start)
+        if start >= end: raise ValueError("from must be before to")
+        origin = self._dt(EPOCH)
+        start = origin + datetime.timedelta(seconds=(start - origin).total_seconds() // step_s * step_s)   # whole first bucket
+        if (end - start).total_seconds() / step_s > SERIES_MAX_POINTS:
+            raise ValueError(f"more than {SERIES_MAX_POINTS} points per type; use a larger step")
+        src, width = self.pick(step_s, start)
+        if width:
+            col, kcol, cols = "bucket", "type", "type, n, sum AS s, min AS lo, max AS hi"
+        else:
+            v = self.value
+            col, kcol, cols = "ts", self.kind, f"{self.kind} AS type, 1 AS n, {v} AS s, {v} AS lo, {v} AS hi"
+        where = f"project_id = %(pid)s AND {col} >= %(start)s AND {col} < %(end)s" + (f" AND {kcol} = %(kind)s" if kind else "")
+        if not width: where += f" AND {self._finite()}"
+        sql = (f"SELECT date_bin(%(step)s, {col}, %(origin)s) AS b, type, {AGGS[agg]} FROM "
+               f"(SELECT {col}, {cols} FROM {src} WHERE {where}) x GROUP BY 1, 2 ORDER BY 2, 1;")
+        return sql, {"pid": pid, "start": start, "end": end, "kind": kind, "step": datetime.timedelta(seconds=step_s), "origin": origin}, src
+
+def shape(rows) -> Dict[str, list]:
+    out: Dict[str, list] = {}
+    for b, kind, v in rows: out.setdefault(kind, []).append([b.isoformat(), None if v is None or not math.isfinite(v) else float(v)])
+    return out
@@ -0,0 +1,3 @@
+CREATE TABLE IF NOT EXISTS jobs(id UUID PRIMARY KEY, kind TEXT NOT NULL, stage TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'queued', project_id UUID NULL, data JSONB NOT NULL DEFAULT '{}', result JSONB NULL, error TEXT NULL, attempts INT NOT NULL DEFAULT 0, max_attempts INT NOT NULL DEFAULT 5, run_after TIMESTAMPTZ NOT NULL DEFAULT now(), locked_by TEXT NULL, locked_at TIMESTAMPTZ NULL, created_at TIMESTAMPTZ DEFAULT now(), updated_at TIMESTAMPTZ DEFAULT now());
+CREATE INDEX IF NOT EXISTS jobs_runnable_idx ON jobs(stage, run_after) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS jobs_running_idx ON jobs(locked_at) WHERE status = 'running';
@@ -1,15 +1,41 @@
 'use client';
 import { useEffect, useState } from 'react';
 type Row = {type:string; val:number; ts:string};
+type Series = Record<string, [string, number|null][]>;
+const LIVE = process.env.NEXT_PUBLIC_LIVE_BASE || 'http://localhost:9110';
+function merge(prev:Row[], items:Row[]){
+  const m = new Map(prev.map(r=>[r.type, r] as [string, Row]));
+  items.forEach(r=>{ const o = m.get(r.type); if(!o || o.ts <= r.ts) m.set(r.type, r); });
+  return [...m.values()].sort((a,b)=>a.type.localeCompare(b.type));
+}
+function Spark({pts}:{pts:[string, number|null][]}){
+  const v = pts.map(p=>p[1]).filter((x):x is number=>x!==null);
+  if(v.length<2) return null;
+  const lo = Math.min(...v), hi = Math.max(...v), w = 240, h = 40;
+  const xy = pts.filter(p=>p[1]!==null).map((p,i)=>`${(i/(v.length-1))*w},${h-((p[1] as number)-lo)/((hi-lo)||1)*h}`).join(' ');
+  return <svg width={w} height={h}><polyline points={xy} fill="none" stroke="currentColor" strokeWidth={1.5}/></svg>;
+}
 export default function IOT(){
   const [projectId,setProjectId] = useState('demo-project');
   const [data,setData] = useState<Row[]>([]);
+  const [series,setSeries] = useState<Series>({});
   const token = typeof window!=='undefined' ? localStorage.getItem('token')||'' : '';
   async function load(){
     const r = await fetch(`http://localhost:8080/v1/sensor/${projectId}/latest`,{headers:{'Authorization':'Bearer '+token}});
-    const d = await r.json(); setData(d.data||[]);
+    const d = await r.json(); setData(prev=>merge(prev, d.data||[]));
+  }
+  async function loadSeries(){
+    const r = await fetch(`http://localhost:8080/v1/sensor/${projectId}/series?step=1h&agg=avg`,{headers:{'Authorization':'Bearer '+token}});
+    if(r.ok){ const d = await r.json(); setSeries(d.series||{}); }
   }
-  useEffect(()=>{ load(); const id=setInterval(load, 3000); return ()=>clearInterval(id); },[projectId]);
+  useEffect(()=>{
+    // latest value per type: one DB read for the initial state, then pushed updates from the ingestor
+    setData([]); load();
+    const es = new EventSource(`${LIVE}/v1/sensor/${projectId}/stream`);
+    es.addEventListener('values', e=>setData(prev=>merge(prev, JSON.parse((e as MessageEvent).data))));
+    return ()=>es.close();
+  },[projectId]);
+  useEffect(()=>{ loadSeries(); const id=setInterval(loadSeries, 60000); return ()=>clearInterval(id); },[projectId]);
   return (<section className="card">
     <h2>لوحة حساسات IoT — TLS MQTT</h2>
     <div style={{display:'flex', gap:8, marginBottom:12}}>
@@ -20,6 +46,10 @@ export default function IOT(){
       <thead><tr><th>النوع</th><th>القيمة</th><th>الزمن</th></tr></thead>
       <tbody>{data.map((r,i)=>(<tr key={i}><td>{r.type}</td><td>{r.val.toFixed(2)}</td><td>{new Date(r.ts).toLocaleString()}</td></tr>))}</tbody>
     </table>
+    <h3 style={{marginTop:12}}>آخر 24 ساعة (متوسط كل ساعة)</h3>
+    <table style={{width:'100%'}}>
+      <tbody>{Object.entries(series).map(([t,pts])=>(<tr key={t}><td>{t}</td><td><Spark pts={pts}/></td><td>{pts.length} نقطة</td></tr>))}</tbody>
+    </table>
     <p style={{marginTop:8, opacity:.8}}>اختبار سريع: <code>python scripts/sensor_publish_demo.py &lt;PROJECT_ID&gt;</code></p>
   </section>);
 }
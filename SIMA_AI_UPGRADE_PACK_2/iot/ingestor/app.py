@@ -1,6 +1,11 @@
-import os, json, uuid
-import psycopg
+import os, json, math, uuid, signal, logging, datetime
 import paho.mqtt.client as mqtt
+from prometheus_client import start_http_server
+from sensor_ingest import BatchWriter
+import sensor_partitions
+from sensor_rollups import Rollups
+from sensor_live import LiveHub, serve as serve_live
+import sensor_wire
 
 DB=os.getenv("DB_DSN","postgresql://postgres:postgres@db:5432/sima")
 BROKER=os.getenv("MQTT_BROKER","mosquitto")
@@ -9,30 +14,59 @@ USER=os.getenv("MQTT_USER","sima_ingestor")
 PASS=os.getenv("MQTT_PASS","changeme")
 CA=os.getenv("MQTT_CA","/mosquitto/certs/ca.crt")
 TOPIC=os.getenv("MQTT_TOPIC","sensors/#")
+METRICS_PORT=int(os.getenv("INGEST_METRICS_PORT","9108"))
 
-def db():
-    return psycopg.connect(DB, autocommit=True)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+writer = BatchWriter(DB, "sensor_data", ["id", "project_id", "sensor_type", "val", "ts"])
+rollups = Rollups("sensor_data", ["id", "project_id", "sensor_type", "val", "ts"], kind="sensor_type", value="val")
+writer.in_tx.append(rollups.apply)
+live = LiveHub()
 
 def on_connect(client, userdata, flags, rc, properties=None):
     print("Connected:", rc)
     client.subscribe(TOPIC, qos=1)
 
+def _is_uuid(s):
+    try: uuid.UUID(s); return True
+    except ValueError: return False
+
 def on_message(client, userdata, msg):
+    # parse and enqueue only; the writer thread COPYs batches and blocks this callback when its buffer is full
+    now = datetime.datetime.now(datetime.timezone.utc)
     try:
-        payload = json.loads(msg.payload.decode("utf-8"))
-        project_id = payload.get("project_id")
-        sensor_type = payload.get("type")
-        val = float(payload.get("val"))
-        with db() as c:
-            with c.cursor() as cur:
-                cur.execute("INSERT INTO sensor_data(id,project_id,sensor_type,val) VALUES(%s,%s,%s,%s)", (str(uuid.uuid4()), project_id, sensor_type, val))
-    except Exception as e:
-        print("ingest-error", e)
+        if sensor_wire.is_binary(msg.payload):   # batched readings with device time
+            project_id, readings = sensor_wire.decode(msg.payload, now)
+            topic_pid = msg.topic.split("/")[1:2]
+            if topic_pid and _is_uuid(topic_pid[0]) and str(uuid.UUID(topic_pid[0])) != project_id:
+                raise ValueError("project id differs from topic")
+        else:                                     # legacy JSON, one reading
+            payload = json.loads(msg.payload.decode("utf-8"))
+            project_id = str(uuid.UUID(payload.get("project_id")))
+            val = float(payload.get("val"))
+            if not math.isfinite(val): raise ValueError("non-finite value")   # json.loads accepts NaN/Infinity
+            readings = [(payload.get("type"), now, val)]
+    except Exception:
+        writer.drop("parse"); return
+    for sensor_type, ts, val in readings:
+        writer.put((uuid.uuid4(), project_id, sensor_type, val, ts))
+        if sensor_type: live.publish(project_id, sensor_type, val, ts)
+
+def shutdown(*_):
+    client.disconnect()
 
-client = mqtt.Client(client_id="sima-ingestor", protocol=mqtt.MQTTv5)
+start_http_server(METRICS_PORT)
+serve_live(live)
+sensor_partitions.setup(DB, "sensor_data", "id UUID NOT NULL,project_id UUID,sensor_type TEXT,val REAL,ts TIMESTAMPTZ NOT NULL DEFAULT now(),PRIMARY KEY (id, ts)",
+                        ["id", "project_id", "sensor_type", "val", "ts"])
+rollups.setup(DB)
+partitions = sensor_partitions.Maintainer(DB, ["sensor_data"], hooks=[rollups.prune]).start()
+writer.start()
+client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="sima-ingestor", protocol=mqtt.MQTTv5)
 client.tls_set(ca_certs=CA)
 client.username_pw_set(USER, PASS)
 client.on_connect = on_connect
 client.on_message = on_message
+signal.signal(signal.SIGTERM, shutdown)
 client.connect(BROKER, PORT, keepalive=60)
 client.loop_forever()
+writer.stop(); partitions.stop()
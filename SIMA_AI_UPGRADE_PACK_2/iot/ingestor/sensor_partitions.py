@@ -0,0 +1,136 @@
+import os, logging, datetime, threading
+from typing import Callable, Dict, List, Optional, Tuple
+import psycopg
+
+# Time-partitioned sensor tables: the parent is PARTITION BY RANGE (ts) with one partition per day or week
+# (SENSOR_PARTITION), named <table>_d20261018 / <table>_w20261012 after their first day. Indexes are
+# declared on the parent so every partition gets (project_id, ts DESC) for latest-reading queries and a
+# BRIN on ts for range scans. ensure() keeps SENSOR_PARTITION_AHEAD partitions ready beyond today and drops
+# whole partitions once they end more than SENSOR_RETENTION_DAYS ago; a default partition catches stragglers
+# (device clocks, late batches) and is pruned by ts to the same cutoff in the same pass.
+SENSOR_PARTITION = os.getenv("SENSOR_PARTITION","day")          # day | week
+SENSOR_RETENTION_DAYS = int(os.getenv("SENSOR_RETENTION_DAYS","180"))   # 0 = keep everything
+SENSOR_PARTITION_AHEAD = int(os.getenv("SENSOR_PARTITION_AHEAD","3"))
+SENSOR_PARTITION_CHECK_S = float(os.getenv("SENSOR_PARTITION_CHECK_S","3600"))
+
+log = logging.getLogger("sima.partitions")
+SPAN = {"d": datetime.timedelta(days=1), "w": datetime.timedelta(days=7)}
+
+def _start(day: datetime.date, kind: str) -> datetime.date:
+    return day - datetime.timedelta(days=day.weekday()) if kind == "w" else day
+
+def _name(table: str, lo: datetime.date, kind: str) -> str:
+    return f"{table}_{kind}{lo:%Y%m%d}"
+
+def _parse(table: str, name: str) -> Optional[Tuple[datetime.date, str]]:
+    suffix = name[len(table) + 1:]
+    if not name.startswith(table + "_") or len(suffix) != 9 or suffix[0] not in SPAN: return None
+    try: return datetime.datetime.strptime(suffix[1:], "%Y%m%d").date(), suffix[0]
+    except ValueError: return None
+
+def _bound(day: datetime.date, tz: bool) -> str:
+    return f"'{day.isoformat()} 00:00:00{'+00' if tz else ''}'"
+
+def parent_ddl(table: str, columns: str) -> List[str]:
+    return [f"CREATE TABLE IF NOT EXISTS {table}({columns}) PARTITION BY RANGE (ts);",
+            f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT;",
+            f"CREATE INDEX IF NOT EXISTS {table}_pid_ts ON {table} (project_id, ts DESC);",
+            f"CREATE INDEX IF NOT EXISTS {table}_ts_brin ON {table} USING brin (ts);"]
+
+def _kind(cur, table: str) -> Optional[str]:
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (table,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def _tz(cur, table: str) -> bool:
+    cur.execute("SELECT format_type(atttypid, atttypmod) FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'ts';", (table,))
+    return "with time zone" in cur.fetchone()[0]
+
+def partitions(cur, table: str) -> Dict[str, Tuple[datetime.date, str]]:
+    cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass;", (table,))
+    return {r[0]: p for r in cur.fetchall() if (p := _parse(table, r[0]))}
+
+def _attach(cur, table: str, name: str, lo: str, hi: str):
+    # rows that already landed in the default partition for this range move into the new partition
+    with cur.connection.transaction():
+        cur.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);")
+        cur.execute(f"WITH m AS (DELETE FROM {table}_default WHERE ts >= {lo} AND ts < {hi} RETURNING *) INSERT INTO {name} SELECT * FROM m;")
+        cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({lo}) TO ({hi});")
+
+def ensure(cur, table: str, today: Optional[datetime.date] = None, kind: Optional[str] = None,
+           ahead: int = SENSOR_PARTITION_AHEAD, retention_days: int = SENSOR_RETENTION_DAYS, since: Optional[datetime.date] = None) -> dict:
+    """Create partitions from `since` (default today) to `ahead` spans past today, drop those past retention
+    and delete default-partition rows older than the retention cutoff."""
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    kind = (kind or SENSOR_PARTITION)[0]
+    tz, have = _tz(cur, table), partitions(cur, table)
+    created, dropped, pruned = [], [], 0
+    lo = _start(since or today, kind)
+    cutoff = today - datetime.timedelta(days=retention_days) if retention_days > 0 else None
+    while lo <= today + SPAN[kind] * ahead:
+        hi = lo + SPAN[kind]
+        name = _name(table, lo, kind)
+        if name not in have and not (cutoff and hi <= cutoff) and not any(l < hi and l + SPAN[k] > lo for l, k in have.values()):
+            _attach(cur, table, name, _bound(lo, tz), _bound(hi, tz))
+            created.append(name); have[name] = (lo, kind)
+        lo = hi
+    for name, (l, k) in sorted(have.items()):
+        if cutoff and l + SPAN[k] <= cutoff:
+            cur.execute(f"DROP TABLE IF EXISTS {name};"); dropped.append(name)
+    if cutoff:
+        cur.execute(f"DELETE FROM {table}_default WHERE ts < {_bound(cutoff, tz)};"); pruned = max(cur.rowcount, 0)
+    return {"created": created, "dropped": dropped, "pruned": pruned}
+
+def setup(dsn: str, table: str, columns: str, col_names: List[str]) -> dict:
+    """Create the partitioned table, converting an existing plain table in place (one transaction)."""
+    with psycopg.connect(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (f"partitions:{table}",))
+            old = _kind(cur, table) == "r"
+            if old:
+                cur.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s;", (table,))
+                for (ix,) in cur.fetchall(): cur.execute(f"ALTER INDEX {ix} RENAME TO {ix}_unpartitioned;")
+                cur.execute(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned;")
+            for ddl in parent_ddl(table, columns): cur.execute(ddl)
+            since, cutoff = None, None
+            if SENSOR_RETENTION_DAYS > 0:
+                cutoff = datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=SENSOR_RETENTION_DAYS)
+            if old:
+                cur.execute(f"SELECT min(ts)::date FROM {table}_unpartitioned;")
+                since = cur.fetchone()[0]
+                if since and cutoff: since = max(since, cutoff)
+            st = ensure(cur, table, since=since)
+            if old:   # rows without ts or already past retention are not carried over
+                cols = ", ".join(col_names)
+                keep = f" AND ts >= '{cutoff.isoformat()}'" if cutoff else ""
+                cur.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {table}_unpartitioned WHERE ts IS NOT NULL{keep};")
+                st["migrated"] = cur.rowcount
+                cur.execute(f"DROP TABLE {table}_unpartitioned;")
+        conn.commit()
+    return st
+
+class Maintainer:
+    """Background thread running ensure() for some tables every SENSOR_PARTITION_CHECK_S, then each hook(cur)."""
+    def __init__(self, dsn: str, tables: List[str], every: float = SENSOR_PARTITION_CHECK_S, hooks: Optional[List[Callable]] = None):
+        self.dsn, self.tables, self.every, self.hooks = dsn, tables, every, list(hooks or [])
+        self._stop = threading.Event()
+
+    def run_once(self):
+        with psycopg.connect(self.dsn, autocommit=True) as conn:
+            with conn.cursor() as cur:
+                for t in self.tables:
+                    st = ensure(cur, t)
+                    if st["created"] or st["dropped"] or st["pruned"]: log.info("partitions %s: %s", t, st)
+                for fn in self.hooks: fn(cur)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try: self.run_once()
+            except Exception as e: log.warning("partition maintenance failed: %s", e)
+            self._stop.wait(self.every)
+
+    def start(self):
+        threading.Thread(target=self._run, name="partitions", daemon=True).start()
+        return self
+
+    def stop(self): self._stop.set()
@@ -0,0 +1,91 @@
+import os, math, uuid, struct, datetime, functools
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+# Compact binary sensor envelope, published alongside the legacy payloads (bare float text on
+# sensors/<pid>/<type>, JSON {"project_id","type","val"}) and told apart by its first byte.
+# v1, little-endian:
+#   header   B magic 0xB5 | B version 1 | B flags | H count | 16s project uuid | q base time (ms since epoch)
+#   dict     (flags & 1) B n, then n x (B id, B len, utf-8 name): ids >= 128 for types outside TYPES
+#   readings count x (B type id | I ms after base | f float32 value)  -> 9 bytes per reading
+# Timestamps come from the device; ones further than WIRE_MAX_SKEW_S ahead or WIRE_MAX_AGE_S behind the
+# receiver's clock are replaced by the receive time so a bad device clock cannot scatter rows over partitions.
+WIRE_MAX_READINGS = int(os.getenv("WIRE_MAX_READINGS","1024"))
+WIRE_MAX_SKEW_S = float(os.getenv("WIRE_MAX_SKEW_S","300"))
+WIRE_MAX_AGE_S = float(os.getenv("WIRE_MAX_AGE_S","604800"))
+
+MAGIC, VERSION, FLAG_DICT = 0xB5, 1, 1
+HEAD = struct.Struct("<BBBH16sq")
+READING = struct.Struct("<BIf")
+TYPES = ("temperature", "humidity", "co2", "pm25", "pm10", "noise", "lux", "voc", "pressure", "energy", "power", "water", "occupancy")
+TYPE_IDS = {t: i + 1 for i, t in enumerate(TYPES)}
+TYPE_NAMES = {i: t for t, i in TYPE_IDS.items()}
+CUSTOM_BASE = 128
+UTC = datetime.timezone.utc
+
+Reading = Tuple[str, datetime.datetime, float]
+
+def is_binary(payload: bytes) -> bool:
+    return payload[:1] == b"\xb5"
+
+@functools.lru_cache(maxsize=8192)
+def _pid(b: bytes) -> str:
+    return str(uuid.UUID(bytes=b))
+
+def _ms(ts: Union[datetime.datetime, int]) -> int:
+    return int(ts.timestamp() * 1000) if isinstance(ts, datetime.datetime) else int(ts)
+
+def encode(project_id: str, readings: Sequence[Tuple[str, Union[datetime.datetime, int], float]]) -> bytes:
+    """Pack (type, device time as datetime or epoch ms, value) readings of one project into one message."""
+    if not 0 < len(readings) <= WIRE_MAX_READINGS: raise ValueError(f"1..{WIRE_MAX_READINGS} readings per message")
+    ms = [_ms(ts) for _, ts, _ in readings]
+    base = min(ms)
+    if max(ms) - base > 0xFFFFFFFF: raise ValueError("readings span more than 49 days")
+    custom: Dict[str, int] = {}
+    for kind, _, _ in readings:
+        if kind not in TYPE_IDS and kind not in custom:
+            if CUSTOM_BASE + len(custom) > 255: raise ValueError("too many custom sensor types in one message")
+            custom[kind] = CUSTOM_BASE + len(custom)
+    out = [HEAD.pack(MAGIC, VERSION, FLAG_DICT if custom else 0, len(readings), uuid.UUID(str(project_id)).bytes, base)]
+    if custom:
+        out.append(bytes([len(custom)]))
+        for name, i in custom.items():
+            b = name.encode("utf-8")
+            if len(b) > 255: raise ValueError(f"sensor type name too long: {name[:32]!r}")
+            out.append(bytes([i, len(b)]) + b)
+    out.extend(READING.pack(TYPE_IDS.get(kind) or custom[kind], m - base, val) for (kind, _, val), m in zip(readings, ms))
+    return b"".join(out)
+
+def decode(payload: bytes, now: Optional[datetime.datetime] = None) -> Tuple[str, List[Reading]]:
+    """-> (project id, [(type, timestamp, value)]); raises ValueError on anything malformed. Non-finite values are skipped."""
+    if len(payload) < HEAD.size: raise ValueError("short message")
+    magic, version, flags, count, pid, base = HEAD.unpack_from(payload)
+    if magic != MAGIC: raise ValueError("not a binary sensor message")
+    if version != VERSION: raise ValueError(f"unsupported version {version}")
+    if count > WIRE_MAX_READINGS: raise ValueError(f"{count} readings in one message")
+    names, pos = TYPE_NAMES, HEAD.size
+    if flags & FLAG_DICT:
+        names = dict(TYPE_NAMES)
+        try:
+            n = payload[pos]; pos += 1
+            for _ in range(n):
+                i, ln = payload[pos], payload[pos + 1]
+                name = payload[pos + 2:pos + 2 + ln]
+                if i < CUSTOM_BASE or len(name) != ln: raise ValueError("bad type dictionary")
+                names[i] = name.decode("utf-8"); pos += 2 + ln
+        except (IndexError, UnicodeDecodeError):
+            raise ValueError("bad type dictionary")
+    if len(payload) - pos != count * READING.size: raise ValueError("reading block size mismatch")
+    now = now or datetime.datetime.now(UTC)
+    now_s = now.timestamp()
+    lo, hi = (now_s - WIRE_MAX_AGE_S) * 1000 - base, (now_s + WIRE_MAX_SKEW_S) * 1000 - base
+    out: List[Reading] = []
+    stamps: Dict[int, datetime.datetime] = {}
+    for tid, off, val in READING.iter_unpack(memoryview(payload)[pos:]):
+        kind = names.get(tid)
+        if kind is None: raise ValueError(f"unknown sensor type id {tid}")
+        if not math.isfinite(val): continue
+        ts = stamps.get(off)
+        if ts is None:   # readings of one sample share their offset
+            ts = stamps[off] = datetime.datetime.fromtimestamp((base + off) / 1000, UTC) if lo <= off <= hi else now
+        out.append((kind, ts, val))
+    return _pid(pid), out
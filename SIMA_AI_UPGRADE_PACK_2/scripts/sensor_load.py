@@ -0,0 +1,75 @@
+import os, json, time, uuid, random, argparse, datetime
+import multiprocessing as mp
+import paho.mqtt.client as mqtt
+from sensor_wire import encode
+
+# Synthetic sensor load for the ingestors (sensor_publish_demo.py at scale): N publisher processes pace
+# --rate msgs/s in total across --projects x --types topics for --seconds, then report the achieved rate.
+#   python scripts/sensor_load.py --rate 50000 --procs 4 --seconds 30                  # pack 2 ingestor (JSON)
+#   python scripts/sensor_load.py --format text --port 1883 --insecure                  # backend mqtt_loop (bare float)
+#   python scripts/sensor_load.py --format bin --batch 20                                # compact envelope, 20 readings/msg
+HOST=os.getenv("MQTT_HOST","localhost")
+PORT=int(os.getenv("MQTT_PORT","8883"))
+USER=os.getenv("MQTT_USER","sima_device")
+PASS=os.getenv("MQTT_PASS","changeme")
+CA=os.getenv("MQTT_CA","mosquitto/certs/ca.crt")
+
+def publisher(n, args, out):
+    cli = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"sensor-load-{os.getpid()}", protocol=mqtt.MQTTv311 if args.v311 else mqtt.MQTTv5)
+    if not args.insecure: cli.tls_set(ca_certs=CA)
+    if USER: cli.username_pw_set(USER, PASS)
+    cli.max_queued_messages_set(args.queue)
+    cli.connect(args.host, args.port, 60); cli.loop_start()
+    pids = [str(uuid.uuid5(uuid.NAMESPACE_DNS, f"sima-load-{i}")) for i in range(args.projects)]
+    types = args.types.split(",")
+    topics = [(pid, t, f"sensors/{pid}/{t}") for pid in pids for t in types]
+    batch = args.batch if args.format == "bin" else 1
+    rnd = random.Random(n)
+    rate, tick = args.rate / args.procs / batch, 0.01   # --rate counts readings
+    sent = full = 0; start = time.perf_counter(); end = start + args.seconds
+    while True:
+        now = time.perf_counter()
+        if now >= end: break
+        due = int((now - start) * rate) - sent - full
+        for _ in range(max(0, due)):
+            pid, t, topic = topics[rnd.randrange(len(topics))]
+            val = round(20 + rnd.random() * 10, 2)
+            if args.format == "bin":
+                now = datetime.datetime.now(datetime.timezone.utc)
+                body = encode(pid, [(types[j % len(types)], now, round(20 + rnd.random() * 10, 2)) for j in range(batch)])
+                topic = f"sensors/{pid}/bin"
+            else:
+                body = json.dumps({"project_id": pid, "type": t, "val": val}) if args.format == "json" else str(val)
+            if cli.publish(topic, body, qos=args.qos).rc == mqtt.MQTT_ERR_SUCCESS: sent += 1
+            else: full += 1   # client-side queue full: the broker/network is the bottleneck
+        time.sleep(tick)
+    took = time.perf_counter() - start
+    cli.loop_stop(); cli.disconnect()
+    out.put((sent * batch, full * batch, took))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rate", type=int, default=50000, help="total readings/s across processes")
+    ap.add_argument("--procs", type=int, default=min(8, os.cpu_count() or 1))
+    ap.add_argument("--seconds", type=float, default=30)
+    ap.add_argument("--projects", type=int, default=50)
+    ap.add_argument("--types", default="temperature,humidity,co2")
+    ap.add_argument("--format", choices=["json","text","bin"], default="json")
+    ap.add_argument("--batch", type=int, default=10, help="readings per message with --format bin")
+    ap.add_argument("--qos", type=int, default=0)
+    ap.add_argument("--queue", type=int, default=20000, help="per-client max queued messages")
+    ap.add_argument("--host", default=HOST); ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--insecure", action="store_true", help="plain TCP (local broker on 1883)")
+    ap.add_argument("--v311", action="store_true", help="MQTT 3.1.1 instead of 5")
+    args = ap.parse_args()
+    out = mp.Queue()
+    procs = [mp.Process(target=publisher, args=(i, args, out)) for i in range(args.procs)]
+    for p in procs: p.start()
+    res = [out.get() for _ in procs]
+    for p in procs: p.join()
+    sent, full = sum(r[0] for r in res), sum(r[1] for r in res)
+    took = max(r[2] for r in res)
+    print(f"sent {sent} readings in {took:.1f}s = {sent/took:.0f} readings/s (target {args.rate}), {full} rejected by full client queues")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import ssl, json, time, os, sys
+import ssl, json, time, os, sys, datetime
 import paho.mqtt.client as mqtt
 
 HOST=os.getenv("MQTT_HOST","localhost")
@@ -8,10 +8,19 @@ PASS=os.getenv("MQTT_PASS","changeme")
 CA=os.getenv("MQTT_CA","mosquitto/certs/ca.crt")
 
 pid = sys.argv[1] if len(sys.argv)>1 else "demo-project"
+binary = len(sys.argv)>2 and sys.argv[2] == "bin"   # compact envelope (sensor_wire.py), needs a UUID project id
 cli = mqtt.Client(client_id="sensor-demo", protocol=mqtt.MQTTv5)
 cli.tls_set(ca_certs=CA)
 cli.username_pw_set(USER, PASS)
 cli.connect(HOST, PORT, 60)
+cli.loop_start()
+if binary:
+    from sensor_wire import encode
+    now = datetime.datetime.now(datetime.timezone.utc)
+    readings = [("temperature", now - datetime.timedelta(seconds=10-i), 24.5 + i*0.1) for i in range(10)] + [("co2", now, 415.0)]
+    cli.publish(f"sensors/{pid}/bin", encode(pid, readings), qos=1, retain=False).wait_for_publish(10)
+    print(f"sent {len(readings)} readings in one message")
+    sys.exit(0)
 for i in range(10):
     payload = {"project_id": pid, "type":"temperature", "val": 24.5 + i*0.1}
     cli.publish(f"sensors/{pid}/temperature", json.dumps(payload), qos=1, retain=False)
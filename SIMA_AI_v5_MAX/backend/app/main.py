@@ -79,10 +79,10 @@ async def identity_score(body: IdentityIn):
 
 @app.post("/v1/vision/analyze")
 async def vision_analyze(file: UploadFile = File(...)):
-    content = await file.read()
+    file.file.seek(0, 2); size = file.file.tell()
     # Placeholder analysis — integrate ML detectors here.
     return {"predicted_regions":[{"region":"Central_Najdi","confidence":0.65},{"region":"Hejazi_Coast","confidence":0.2}],
-            "notes":[f"Received {file.filename} ({len(content)} bytes). Demo mode."]}
+            "notes":[f"Received {file.filename} ({size} bytes). Demo mode."]}
 
 @app.post("/v1/plan/upload")
 async def plan_upload(file: UploadFile = File(...)):
@@ -111,5 +111,5 @@ async def chat(body: ChatIn):
 @app.post("/v1/admin/retrain")
 async def retrain():
     # In real ops, this would schedule a job; here we rebuild index synchronously.
-    RAG.build_index()
+    RAG.build_index(force=True)
     return {"ok": True, "indexed_docs": len(RAG.documents)}
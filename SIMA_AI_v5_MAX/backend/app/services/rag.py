@@ -1,6 +1,5 @@
 import os, glob, re, json
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from .rag_snapshot import FittedTfidf, TFIDF_PARAMS, fit_tfidf, load_or_build
 
 class RAGEngine:
     def __init__(self, corpus_dir: str):
@@ -8,30 +7,22 @@ class RAGEngine:
         os.makedirs(self.corpus_dir, exist_ok=True)
         self.documents = []
         self.doc_ids = []
-        self.vectorizer = None
-        self.matrix = None
+        self.index = None
         self.build_index()
 
-    def build_index(self):
+    def build_index(self, force: bool = False):
+        # workers map a shared on-disk snapshot; the corpus is re-vectorized only when its files change
         paths = sorted(glob.glob(os.path.join(self.corpus_dir, "*.md")))
-        self.documents = [open(p, "r", encoding="utf-8").read() for p in paths]
-        self.doc_ids = [os.path.basename(p) for p in paths]
-        if self.documents:
-            self.vectorizer = TfidfVectorizer(stop_words='english')
-            self.matrix = self.vectorizer.fit_transform(self.documents)
-        else:
-            self.vectorizer = None
-            self.matrix = None
+        self.index = FittedTfidf(load_or_build("tfidf", TFIDF_PARAMS, paths, fit_tfidf, force=force))
+        self.documents, self.doc_ids = self.index.docs, self.index.ids
 
     def retrieve(self, query: str, topk: int = 3):
-        if not self.matrix or not self.vectorizer:
+        if self.index is None:
             return []
-        qv = self.vectorizer.transform([query])
-        sims = cosine_similarity(qv, self.matrix).ravel()
-        top_idx = sims.argsort()[::-1][:topk]
         out = []
-        for i in top_idx:
-            out.append({"doc": self.doc_ids[i], "score": float(sims[i]), "excerpt": self.documents[i][:600]})
+        for i, score in self.index.search(query, topk):
+            h = self.index.hit(i, score)   # a passage of the source doc, not its first 600 chars
+            out.append({"doc": h["doc_id"], "score": score, "excerpt": h["excerpt"], "span": h["span"]})
         return out
 
     def generate_answer(self, message: str, ctx, region_hint=None):
@@ -153,8 +153,8 @@ async def identity_score(body: IdentityScoreIn):
 async def vision_analyze(file: UploadFile = File(...)):
     # Demo: we don't run heavy ML here; return a structured placeholder
     # In production, plug Grounding-DINO + SAM2 + CLIP to detect & classify facade elements.
-    content = await file.read()
-    size_kb = round(len(content) / 1024, 2)
+    file.file.seek(0, 2); size = file.file.tell()   # already spooled by Starlette; don't copy it into memory
+    size_kb = round(size / 1024, 2)
     notes = [
         f"Received image: {file.filename} ({size_kb} KB)",
         "This is a demo analysis; integrate ML models for real predictions."
@@ -120,9 +120,9 @@ async def identity_score(body: IdentityIn):
 
 @app.post("/v1/vision/analyze")
 async def vision_analyze(file: UploadFile = File(...)):
-    content = await file.read()
+    file.file.seek(0, 2); size = file.file.tell()
     return {"predicted_regions":[{"region":"Central_Najdi","confidence":0.64},{"region":"Hejazi_Coast","confidence":0.22},{"region":"Northern_Najdi","confidence":0.14}],
-            "notes":[f"Received {file.filename} ({len(content)} bytes). Demo analysis."]}
+            "notes":[f"Received {file.filename} ({size} bytes). Demo analysis."]}
 
 @app.post("/v1/3d/reconstruct")
 async def reconstruct(width: float = Form(6.0), depth: float = Form(4.0), height: float = Form(3.0), openings_json: str = Form("[]")):
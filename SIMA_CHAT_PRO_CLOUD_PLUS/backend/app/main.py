@@ -3,17 +3,19 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-import os, io, json, time, math, glob, uuid, re, asyncio
+import os, io, json, time, math, glob, uuid, re, asyncio, mmap
 import numpy as np
 import httpx
 from sklearn.feature_extraction.text import TfidfVectorizer
 from pypdf import PdfReader
+from .utils.uploads import UploadLimit, safe_name, save_upload
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 
 APP = FastAPI(title="SIMA Chat Pro Cloud+", description="Local-first Saudi RAG + optional cloud relay", version="8.0.0")
 origins = os.getenv("CORS_ORIGINS","http://localhost:3000").split(",")
 APP.add_middleware(CORSMiddleware, allow_origins=[o.strip() for o in origins],
                    allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+APP.add_middleware(UploadLimit)
 
 REQ_COUNT = Counter("sima_cloud_chat_requests_total","Total HTTP Requests",["route","method"])
 REQ_LAT = Histogram("sima_cloud_chat_request_latency_seconds","Request latency",["route"])
@@ -66,22 +68,24 @@ async def rag_search(body: RAGQuery):
     hits=[{"doc_id":DOC_IDS[i],"score":float(sims[i]),"excerpt":DOCS[i][:280]} for i in idx]
     return {"hits": hits}
 
+def pdf_text(path: str) -> str:
+    # parse through an mmap of the saved upload rather than a bytes copy of it
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return "\n".join([p.extract_text() or "" for p in PdfReader(mm).pages])
+
 @APP.post("/v1/rag/upload")
 async def rag_upload(file: UploadFile = File(...)):
-    raw = await file.read()
-    name=file.filename.lower()
+    name=safe_name(file.filename).lower()
     path=f"uploads/{uuid.uuid4().hex}_{name}"
+    await save_upload(file, path)
     if name.endswith(".pdf"):
         # extract PDF
         try:
-            r=PdfReader(io.BytesIO(raw))
-            txt="\n".join([p.extract_text() or "" for p in r.pages])
+            txt=pdf_text(path)
             path=path.replace(".pdf",".txt")
             with open(path,"w",encoding="utf-8") as fh: fh.write(txt)
         except Exception as e:
             return JSONResponse({"ok":False,"error":str(e)}, status_code=400)
-    else:
-        with open(path,"wb") as fh: fh.write(raw)
     build_index()
     return {"ok":True,"docs":len(DOCS)}
 
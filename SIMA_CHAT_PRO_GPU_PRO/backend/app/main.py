@@ -3,17 +3,24 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-import os, io, json, time, math, glob, uuid, re, asyncio, hashlib
+import os, io, json, time, math, glob, uuid, re, asyncio, hashlib, mmap
 import numpy as np
-import httpx, psycopg
-from sklearn.feature_extraction.text import TfidfVectorizer
+import psycopg
 from pypdf import PdfReader
+from .utils.uploads import UploadLimit, safe_name, save_upload
+from .utils.http_clients import http_client, open_clients, close_clients
+from .utils.llm_router import Router
+from .utils.tfidf_index import TfidfIndex, SNAPSHOT_PARAMS, build_arrays
+from .utils.rag_snapshot import load_or_build
+from .utils.hybrid import fts_ddl, hybrid_search_sync
+from .utils.tokenizer import tokenize
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 
 APP = FastAPI(title="SIMA Chat Pro GPU-PRO", description="Local-first Saudi RAG + pgvector + optional vLLM GPU", version="12.0.0")
 origins = os.getenv("CORS_ORIGINS","http://localhost:3000").split(",")
 APP.add_middleware(CORSMiddleware, allow_origins=[o.strip() for o in origins],
                    allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+APP.add_middleware(UploadLimit)
 
 REQ_COUNT = Counter("sima_gpu_requests_total","Total HTTP Requests",["route","method"])
 REQ_LAT = Histogram("sima_gpu_request_latency_seconds","Request latency",["route"])
@@ -41,15 +48,11 @@ async def readyz(): return PlainTextResponse("ready")
 async def metrics(): return StreamingResponse(io.BytesIO(generate_latest()), media_type=CONTENT_TYPE_LATEST)
 
 # ---------------- RAG STORE: TF-IDF + (optional) pgvector ----------------
-VEC=None; DOCS=[]; DOC_IDS=[]
-def build_index():
-    global VEC, DOCS, DOC_IDS
-    DOCS=[]; DOC_IDS=[]
-    for f in sorted(glob.glob("app/corpus/*.md")) + sorted(glob.glob("uploads/*.txt")) + sorted(glob.glob("uploads/*.md")):
-        with open(f,"r",encoding="utf-8") as fh:
-            DOCS.append(fh.read()); DOC_IDS.append(os.path.basename(f))
-    VEC = TfidfVectorizer(stop_words="english")
-    if DOCS: VEC.fit(DOCS)
+RAG = TfidfIndex()
+def build_index(force=False):
+    # maps the on-disk snapshot; the corpus is only re-read and re-vectorized when its files changed
+    files = sorted(glob.glob("app/corpus/*.md")) + sorted(glob.glob("uploads/*.txt")) + sorted(glob.glob("uploads/*.md"))
+    RAG.load(load_or_build("tfidf-hash", SNAPSHOT_PARAMS, files, build_arrays, force=force))
 
 os.makedirs("uploads", exist_ok=True)
 build_index()
@@ -59,7 +62,7 @@ PG_DSN = os.getenv("PG_DSN","").strip()
 EMBED_DIM = int(os.getenv("EMBED_DIM","384"))
 def hash_embed(text: str, dim: int = 384):
     vec = np.zeros(dim, dtype=np.float32)
-    for tok in re.findall(r"\w+", text.lower()):
+    for tok in tokenize(text):
         h = int(hashlib.md5(tok.encode()).hexdigest(), 16)
         idx = h % dim
         vec[idx] += 1.0
@@ -79,49 +82,50 @@ def ensure_pg_schema():
             );
             """.replace("{{EMBED_DIM}}", str(EMBED_DIM)))
             cur.execute("CREATE INDEX IF NOT EXISTS docs_embedding_hnsw ON docs USING hnsw (embedding vector_cosine_ops);")
+            for ddl in fts_ddl("docs", "coalesce(content,'')"): cur.execute(ddl)
         conn.commit()
 
+def pg_search(q: str, k: int, timing: bool = False):
+    # full-text + vector legs fused with RRF in one statement (see utils/hybrid.py)
+    qv = "[" + ",".join(f"{x:.6f}" for x in hash_embed(q, EMBED_DIM)) + "]"
+    with psycopg.connect(PG_DSN) as conn:
+        with conn.cursor() as cur:
+            hits, t = hybrid_search_sync(cur, "docs", q, qv, k, timing, title_expr="d.id")
+    return [{"doc_id":h["id"], "score":h["score"], "excerpt":(h["content"] or "")[:280],
+             "vector_rank":h["vector_rank"], "lexical_rank":h["lexical_rank"]} for h in hits], t
+
 ensure_pg_schema()
 
 class RAGQuery(BaseModel):
-    query:str; k:int=4
+    query:str; k:int=4; timing: bool=False
 @APP.post("/v1/rag/search")
 async def rag_search(body: RAGQuery):
     if PG_DSN:
-        qv = hash_embed(body.query, EMBED_DIM)
-        with psycopg.connect(PG_DSN) as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT id, content, 1 - (embedding <=> %s) AS similarity FROM docs ORDER BY embedding <=> %s LIMIT %s;", (qv, qv, body.k))
-                rows = cur.fetchall()
-        hits=[{"doc_id":r[0], "score": float(r[2]), "excerpt": (r[1] or "")[:280]} for r in rows]
-        return {"hits": hits, "backend":"pgvector"}
-    if not DOCS: return {"hits":[],"backend":"tfidf"}
-    qv = VEC.transform([body.query]); dv = VEC.transform(DOCS)
-    sims = (dv @ qv.T).toarray().ravel()
-    idx = sims.argsort()[::-1][:body.k]
-    hits=[{"doc_id":DOC_IDS[i],"score":float(sims[i]),"excerpt":DOCS[i][:280]} for i in idx]
+        hits, timing = pg_search(body.query, body.k, body.timing)
+        return {"hits": hits, "backend":"hybrid", "timing": timing}
+    hits=[RAG.hit(i, s) for i, s in RAG.search(body.query, body.k)]
     return {"hits": hits, "backend":"tfidf"}
 
+def pdf_text(path: str) -> str:
+    # parse through an mmap of the saved upload rather than a bytes copy of it
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return "\n".join([p.extract_text() or "" for p in PdfReader(mm).pages])
+
 @APP.post("/v1/rag/upload")
 async def rag_upload(file: UploadFile = File(...)):
-    raw = await file.read()
-    name=file.filename.lower()
+    name=safe_name(file.filename).lower()
     path=f"uploads/{uuid.uuid4().hex}_{name}"
+    await save_upload(file, path)
     text=""
     if name.endswith(".pdf"):
         try:
-            r=PdfReader(io.BytesIO(raw))
-            text="\n".join([p.extract_text() or "" for p in r.pages])
+            text=await asyncio.to_thread(pdf_text, path)   # pypdf is CPU-bound; keep the loop free
             path=path.replace(".pdf",".txt")
             with open(path,"w",encoding="utf-8") as fh: fh.write(text)
         except Exception as e:
             return JSONResponse({"ok":False,"error":str(e)}, status_code=400)
     else:
-        with open(path,"wb") as fh: fh.write(raw)
-        try:
-            text = raw.decode("utf-8", errors="ignore")
-        except:
-            text = ""
+        with open(path,"r",encoding="utf-8",errors="ignore") as fh: text = fh.read()
     if PG_DSN and text.strip():
         ensure_pg_schema()
         emb = hash_embed(text, EMBED_DIM)
@@ -130,11 +134,11 @@ async def rag_upload(file: UploadFile = File(...)):
                 cur.execute("INSERT INTO docs (id, content, embedding) VALUES (%s,%s,%s) ON CONFLICT (id) DO UPDATE SET content=EXCLUDED.content, embedding=EXCLUDED.embedding;",
                             (os.path.basename(path), text, emb))
             conn.commit()
-    build_index()
-    return {"ok":True,"docs":len(DOCS),"pgvector": bool(PG_DSN)}
+    if path.endswith((".txt",".md")): RAG.add([text], [os.path.basename(path)])
+    return {"ok":True,"docs":len(RAG),"pgvector": bool(PG_DSN)}
 
 @APP.post("/v1/admin/retrain")
-async def retrain(): build_index(); return {"ok":True,"docs":len(DOCS)}
+async def retrain(): build_index(force=True); return {"ok":True,"docs":len(RAG)}
 
 class IdentityIn(BaseModel):
     region_hint: Optional[str]="Central_Najdi"; wwr: Optional[float]=22.0; height_ratio: Optional[float]=1.6
@@ -176,33 +180,36 @@ def sse_pack(event, data): return f"event: {event}\ndata: {json.dumps(data, ensu
 
 async def call_local_llm(prompt: str):
     url = os.getenv("LOCAL_LLM_URL","http://llm:7070/generate")
-    async with httpx.AsyncClient(timeout=60) as client:
-        async with client.stream("POST", url, json={"prompt":prompt}) as r:
-            async for chunk in r.aiter_bytes():
-                yield chunk
+    async with http_client("local_llm").stream("POST", url, json={"prompt":prompt}) as r:
+        r.raise_for_status()
+        async for chunk in r.aiter_bytes():
+            yield chunk
 
 async def call_cloud_llm(prompt: str):
     relay = os.getenv("CLOUD_RELAY_URL","").strip()
-    if not relay:
-        async for c in call_local_llm(prompt): yield c; return
-    async with httpx.AsyncClient(timeout=120) as client:
-        async with client.stream("POST", relay, json={"prompt":prompt}) as r:
-            async for chunk in r.aiter_bytes():
-                yield chunk
+    async with http_client("cloud_relay").stream("POST", relay, json={"prompt":prompt}) as r:
+        r.raise_for_status()
+        async for chunk in r.aiter_bytes():
+            yield chunk
+
+# local is the fallback; cloud is skipped without a relay and circuit-broken when it keeps failing.
+# hybrid = local for HYBRID_LOCAL_BUDGET_MS, then the cloud continues the answer.
+HYBRID_LOCAL_BUDGET_MS = float(os.getenv("HYBRID_LOCAL_BUDGET_MS","1000"))
+HYBRID_SUFFIX = os.getenv("HYBRID_SUFFIX","\nأكمل باقتراحات عالمية متوافقة مع الهوية السعودية.")
+llm_router = Router(providers={"local": call_local_llm, "cloud": call_cloud_llm}, priority=["cloud"], fallback="local",
+                    configured={"cloud": lambda: bool(os.getenv("CLOUD_RELAY_URL","").strip())})
+
+@APP.on_event("startup")
+async def start_http_clients():
+    await open_clients("local_llm", "cloud_relay")
+
+@APP.on_event("shutdown")
+async def stop_http_clients():
+    await close_clients()
 
 def retrieve_ctx(q: str, k=4):
-    if os.getenv("PG_DSN","").strip():
-        qv = hash_embed(q, EMBED_DIM)
-        with psycopg.connect(os.getenv("PG_DSN")) as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT id, content, 1 - (embedding <=> %s) AS similarity FROM docs ORDER BY embedding <=> %s LIMIT %s;", (qv, qv, k))
-                rows = cur.fetchall()
-        return [{"doc_id":r[0], "excerpt": (r[1] or "")[:240], "score": float(r[2])} for r in rows]
-    if not DOCS: return []
-    qv = VEC.transform([q]); dv = VEC.transform(DOCS)
-    sims=(dv @ qv.T).toarray().ravel()
-    idx=sims.argsort()[::-1][:k]
-    return [{"doc_id":DOC_IDS[i], "excerpt": DOCS[i][:240], "score": float(sims[i])} for i in idx]
+    if PG_DSN: return pg_search(q, k)[0]
+    return [RAG.hit(i, s) for i, s in RAG.search(q, k)]
 
 def tool_router(msg: str):
     actions=[]
@@ -226,14 +233,10 @@ async def chat_stream(body: ChatIn):
             results=[{"tool":t[0],"result":{"ok":True}} for t in tools]
             yield sse_pack("tools", results)
         if mode=="local":
-            async for c in call_local_llm(prompt): yield c
+            async for c in llm_router.stream(prompt, order=["local"]): yield c
         elif mode=="hybrid":
-            deadline = time.time()+1.0
-            async for c in call_local_llm(prompt):
-                yield c
-                if time.time()>deadline: break
-            async for c in call_cloud_llm(prompt + "\nأكمل باقتراحات عالمية متوافقة مع الهوية السعودية."): yield c
+            async for c in llm_router.hybrid(prompt, "local", "cloud", HYBRID_LOCAL_BUDGET_MS, HYBRID_SUFFIX): yield c
         else:
-            async for c in call_cloud_llm(prompt): yield c
+            async for c in llm_router.stream(prompt, order=["cloud"]): yield c
         yield sse_pack("done", {"finished":True})
     return StreamingResponse(events(), media_type="text/event-stream")
@@ -0,0 +1,86 @@
+import os, time, json
+from typing import List, Optional, Tuple
+from prometheus_client import Histogram
+
+# Hybrid retrieval: Postgres full-text (generated tsvector column + GIN) and the pgvector ANN index,
+# fused with reciprocal rank fusion in one SQL statement, so hybrid costs one round-trip like vector alone.
+# Each leg is a MATERIALIZED CTE over its own index (top RAG_LEG_DEPTH candidates); fusion dedupes by
+# chunk id and by identical content. Per-leg timings come from EXPLAIN ANALYZE of the same statement.
+RAG_FTS_CONFIG = os.getenv("RAG_FTS_CONFIG","simple")   # text search config baked into the tsv column
+RAG_RRF_K = int(os.getenv("RAG_RRF_K","60"))
+RAG_LEG_DEPTH = int(os.getenv("RAG_LEG_DEPTH","50"))
+
+RAG_SEARCH_LAT = Histogram("sima_rag_search_seconds","RAG search round-trip",["mode"], buckets=[0.002,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1])
+
+def fts_ddl(table: str, text_expr: str, config: str = RAG_FTS_CONFIG) -> List[str]:
+    return [f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS tsv tsvector GENERATED ALWAYS AS (to_tsvector('{config}'::regconfig, {text_expr})) STORED;",
+            f"CREATE INDEX IF NOT EXISTS {table}_tsv_gin ON {table} USING gin (tsv);"]
+
+def hybrid_sql(table: str, title_expr: str = "d.title") -> str:
+    return f"""
+WITH vec AS MATERIALIZED (
+    SELECT id, row_number() OVER (ORDER BY dist) AS r, 1 - dist AS sim FROM (
+        SELECT id, embedding <=> %(v)s::vector AS dist FROM {table}
+        ORDER BY embedding <=> %(v)s::vector LIMIT %(depth)s) s
+),
+lex AS MATERIALIZED (
+    SELECT id, row_number() OVER (ORDER BY rank DESC) AS r FROM (
+        SELECT id, ts_rank_cd(tsv, q) AS rank FROM {table}, websearch_to_tsquery(%(cfg)s::regconfig, %(q)s) q
+        WHERE tsv @@ q ORDER BY rank DESC LIMIT %(depth)s) s
+),
+fused AS (
+    SELECT id, sum(1.0 / (%(rrf_k)s + r)) AS rrf, min(vr) AS vector_rank, min(lr) AS lexical_rank, max(sim) AS sim
+    FROM (SELECT id, r, r AS vr, NULL::bigint AS lr, sim FROM vec
+          UNION ALL SELECT id, r, NULL, r, NULL FROM lex) u
+    GROUP BY id
+),
+ranked AS (
+    SELECT f.*, {title_expr} AS title, d.content,
+           row_number() OVER (PARTITION BY md5(d.content) ORDER BY f.rrf DESC) AS dup
+    FROM fused f JOIN {table} d USING (id)
+)
+SELECT id, title, content, rrf, vector_rank, lexical_rank, sim FROM ranked WHERE dup = 1 ORDER BY rrf DESC LIMIT %(k)s"""
+
+def params(query: str, qvec: str, k: int, depth: Optional[int] = None) -> dict:
+    return {"q": query, "v": qvec, "k": k, "depth": max(k, depth or RAG_LEG_DEPTH), "cfg": RAG_FTS_CONFIG, "rrf_k": RAG_RRF_K}
+
+def hits(rows) -> List[dict]:
+    return [{"id": r[0], "title": r[1], "content": r[2], "score": float(r[3]), "vector_rank": r[4], "lexical_rank": r[5],
+             "sim": None if r[6] is None else float(r[6])} for r in rows]
+
+def leg_timings(plan) -> dict:
+    """Per-CTE actual time (ms) from EXPLAIN (ANALYZE, FORMAT JSON) output."""
+    if isinstance(plan, str): plan = json.loads(plan)
+    root = plan[0] if isinstance(plan, list) else plan
+    out = {"db_ms": round(root.get("Execution Time", 0.0), 3)}
+    def walk(node):
+        name = node.get("Subplan Name", "")
+        if name in ("CTE vec", "CTE lex"):
+            out["vector_ms" if name == "CTE vec" else "lexical_ms"] = round(node.get("Actual Total Time", 0.0) * node.get("Actual Loops", 1), 3)
+        for ch in node.get("Plans", []): walk(ch)
+    walk(root["Plan"])
+    return out
+
+async def hybrid_search(cur, table: str, query: str, qvec: str, k: int, timing: bool = False, title_expr: str = "d.title") -> Tuple[List[dict], dict]:
+    sql, p = hybrid_sql(table, title_expr), params(query, qvec, k)
+    s = time.perf_counter()
+    await cur.execute(sql, p)
+    rows = await cur.fetchall()
+    took = time.perf_counter() - s; RAG_SEARCH_LAT.labels(mode="hybrid").observe(took)
+    t = {"round_trip_ms": round(took * 1000, 3)}
+    if timing:
+        await cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, p)
+        t.update(leg_timings((await cur.fetchone())[0]))
+    return hits(rows), t
+
+def hybrid_search_sync(cur, table: str, query: str, qvec: str, k: int, timing: bool = False, title_expr: str = "d.title") -> Tuple[List[dict], dict]:
+    sql, p = hybrid_sql(table, title_expr), params(query, qvec, k)
+    s = time.perf_counter()
+    cur.execute(sql, p)
+    rows = cur.fetchall()
+    took = time.perf_counter() - s; RAG_SEARCH_LAT.labels(mode="hybrid").observe(took)
+    t = {"round_trip_ms": round(took * 1000, 3)}
+    if timing:
+        cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, p)
+        t.update(leg_timings(cur.fetchone()[0]))
+    return hits(rows), t
@@ -0,0 +1,178 @@
+import os, time, asyncio, logging, contextlib
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from prometheus_client import Counter, Gauge
+
+log = logging.getLogger("sima.router")
+
+# Multi-provider LLM router. Providers are `prompt -> async iterator of chunks` (text or SSE bytes).
+# Candidates are ranked by priority, TTFT EWMA and recent error rate; if the leader has not produced a
+# chunk within ROUTER_HEDGE_MS a second provider is started and the first to answer wins. Failing
+# providers are circuit-broken, and the fallback provider (always last) guarantees a stream.
+# `admit(name, max_wait) -> bool` optionally gates each provider on its rate budget.
+ROUTER_HEDGE_MS = float(os.getenv("ROUTER_HEDGE_MS","1500"))       # 0 disables hedging
+ROUTER_FIRST_TOKEN_TIMEOUT = float(os.getenv("ROUTER_FIRST_TOKEN_TIMEOUT","20"))
+ROUTER_PRIORITY_STEP = float(os.getenv("ROUTER_PRIORITY_STEP","1.0"))   # seconds of TTFT one priority rank is worth
+ROUTER_ERROR_PENALTY = float(os.getenv("ROUTER_ERROR_PENALTY","5.0"))   # seconds added at 100% error rate
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA","0.3"))
+ROUTER_ERROR_WINDOW = int(os.getenv("ROUTER_ERROR_WINDOW","20"))
+ROUTER_CB_FAILURES = int(os.getenv("ROUTER_CB_FAILURES","3"))           # consecutive failures that open the circuit
+ROUTER_CB_COOLDOWN = float(os.getenv("ROUTER_CB_COOLDOWN","30"))
+
+ROUTER_PICKS = Counter("sima_router_selected_total","Streams served by provider",["provider"])
+ROUTER_FAILS = Counter("sima_router_failures_total","Provider failures seen by the router",["provider","stage"])
+ROUTER_HEDGES = Counter("sima_router_hedges_total","Hedged second requests started",["provider"])
+ROUTER_CIRCUIT = Gauge("sima_router_circuit_open","1 while a provider's circuit breaker is open",["provider"])
+ROUTER_EWMA = Gauge("sima_router_ttft_ewma_seconds","Smoothed time-to-first-chunk per provider",["provider"])
+
+class NoChunks(Exception):
+    pass
+
+class ProviderState:
+    def __init__(self, name: str):
+        self.name, self.ewma, self.results = name, None, deque(maxlen=ROUTER_ERROR_WINDOW)
+        self.consecutive, self.open_until, self.probing = 0, 0.0, False
+
+    @property
+    def error_rate(self) -> float:
+        return (self.results.count(False) / len(self.results)) if self.results else 0.0
+
+    def available(self, now: float) -> bool:
+        if self.open_until and now < self.open_until: return False
+        if self.open_until and self.probing: return False   # half-open: one trial request at a time
+        return True
+
+    def success(self, ttft: float):
+        self.ewma = ttft if self.ewma is None else ROUTER_EWMA_ALPHA * ttft + (1 - ROUTER_EWMA_ALPHA) * self.ewma
+        self.results.append(True); self.consecutive = 0; self.open_until = 0.0; self.probing = False
+        ROUTER_EWMA.labels(provider=self.name).set(self.ewma); ROUTER_CIRCUIT.labels(provider=self.name).set(0)
+
+    def failure(self):
+        self.results.append(False); self.consecutive += 1; self.probing = False
+        if self.consecutive >= ROUTER_CB_FAILURES:
+            self.open_until = time.monotonic() + ROUTER_CB_COOLDOWN
+            ROUTER_CIRCUIT.labels(provider=self.name).set(1)
+
+class Router:
+    def __init__(self, providers: Dict[str, Callable[[str], AsyncIterator]], priority: List[str], fallback: str,
+                 configured: Optional[Dict[str, Callable[[], bool]]] = None, hedge_ms: float = ROUTER_HEDGE_MS,
+                 admit: Optional[Callable[[str, Optional[float]], Awaitable[bool]]] = None):
+        self.providers, self.priority, self.fallback = providers, priority, fallback
+        self.configured, self.admit = configured or {}, admit
+        self.hedge_ms = hedge_ms
+        self.state = {n: ProviderState(n) for n in providers}
+
+    def ranked(self, order: Optional[List[str]] = None) -> List[str]:
+        now = time.monotonic(); prio = order or self.priority
+        names = [n for n in prio if n in self.providers and n != self.fallback
+                 and self.configured.get(n, lambda: True)() and self.state[n].available(now)]
+        def score(n):
+            st = self.state[n]
+            return prio.index(n) * ROUTER_PRIORITY_STEP + (st.ewma or 0.0) + st.error_rate * ROUTER_ERROR_PENALTY
+        return sorted(names, key=score)
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        def circuit(st):
+            if not st.open_until: return "closed"
+            return "open" if now < st.open_until else "half-open"
+        return {n: {"ewma_ttft_s": st.ewma, "error_rate": round(st.error_rate, 3), "circuit": circuit(st),
+                    "configured": self.configured.get(n, lambda: True)()} for n, st in self.state.items()}
+
+    async def _first(self, name: str, prompt: str):
+        """Start a provider and wait for its first non-empty chunk. Returns (name, gen, chunk, ttft)."""
+        st = self.state[name]
+        probe = bool(st.open_until)
+        if probe: st.probing = True
+        t0 = time.monotonic(); gen = self.providers[name](prompt)
+        try:
+            async for chunk in gen:
+                if chunk: return name, gen, chunk, time.monotonic() - t0
+            raise NoChunks(name)
+        except BaseException:
+            await _close(gen)
+            raise
+        finally:
+            # a probe that loses a hedge race or is cancelled never reports back; let the next request retry
+            if probe: st.probing = False
+
+    async def stream(self, prompt: str, order: Optional[List[str]] = None, info: Optional[dict] = None) -> AsyncIterator:
+        """Stream from the best available provider; `info["provider"]` is set to the one serving."""
+        queue = self.ranked(order) + [self.fallback]
+        pending: Dict[asyncio.Task, str] = {}
+        winner = None
+        try:
+            while winner is None:
+                if not pending:
+                    name = await self._admit(queue)
+                    pending[asyncio.create_task(self._first(name, prompt))] = name
+                # hedge only while a non-fallback candidate is still queued
+                hedge = self.hedge_ms / 1000 if self.hedge_ms > 0 and len(pending) == 1 and queue and queue[0] != self.fallback else None
+                timeout = hedge if hedge is not None else ROUTER_FIRST_TOKEN_TIMEOUT
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if hedge is not None:
+                        name = await self._admit(queue, wait=False)
+                        if name:
+                            ROUTER_HEDGES.labels(provider=name).inc()
+                            pending[asyncio.create_task(self._first(name, prompt))] = name
+                        continue
+                    for t, n in list(pending.items()):   # nobody answered in time: give up on them
+                        t.cancel(); self._failed(n, "timeout"); del pending[t]
+                    continue
+                for t in done:
+                    n = pending.pop(t)
+                    try: res = t.result()
+                    except Exception as e:
+                        log.warning("provider %s failed before first chunk: %s", n, e); self._failed(n, "first")
+                        continue
+                    if winner is None: winner = res
+                    else: asyncio.ensure_future(_close(res[1]))
+        finally:
+            for t in pending: t.cancel()
+        name, gen, chunk, ttft = winner
+        self.state[name].success(ttft); ROUTER_PICKS.labels(provider=name).inc()
+        if info is not None: info["provider"] = name
+        try:
+            yield chunk
+            async for chunk in gen: yield chunk
+        except (Exception, asyncio.CancelledError) as e:
+            if not isinstance(e, asyncio.CancelledError): self._failed(name, "mid")
+            raise
+        finally:
+            await _close(gen)
+
+    async def _admit(self, queue: List[str], wait: bool = True) -> Optional[str]:
+        """Pop the next candidate whose provider budget has a token (the fallback is never throttled)."""
+        while queue:
+            name = queue.pop(0)
+            if name == self.fallback:
+                if wait: return name
+                queue.insert(0, name); return None   # never hedge with the fallback
+            # only the last real candidate may queue for its budget; the others are skipped when empty
+            if self.admit is None or await self.admit(name, None if wait and queue == [self.fallback] else 0):
+                return name
+        if wait: raise RuntimeError("no provider available")
+        return None
+
+    def _failed(self, name: str, stage: str):
+        ROUTER_FAILS.labels(provider=name, stage=stage).inc()
+        if name != self.fallback: self.state[name].failure()
+
+    async def hybrid(self, prompt: str, first: str, then: str, budget_ms: float, suffix: str = "",
+                     info: Optional[dict] = None) -> AsyncIterator:
+        """Stream `first` for up to budget_ms, then continue with `then` (falling back as usual)."""
+        deadline = time.monotonic() + budget_ms / 1000
+        try:
+            async with contextlib.aclosing(self.stream(prompt, order=[first], info=info)) as s:
+                async for c in s:
+                    yield c
+                    if time.monotonic() > deadline: break
+        except Exception as e:
+            log.warning("hybrid: %s failed, handing over to %s: %s", first, then, e)
+        async for c in self.stream(prompt + suffix, order=[then], info=info):
+            yield c
+
+async def _close(gen):
+    try: await gen.aclose()
+    except BaseException: pass
@@ -1,13 +1,16 @@
 from fastapi import FastAPI
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import time, json, re
+import os, json, re, asyncio
 
 app = FastAPI(title="SIMA Local LLM (heuristic)", version="0.2")
 
 class Inp(BaseModel):
     prompt: str
 
+TOKEN_DELAY_MS = float(os.getenv("TOKEN_DELAY_MS","0"))
+FLUSH_CHARS = int(os.getenv("FLUSH_CHARS","32"))
+
 def sse(data): return f"event: token\ndata: {json.dumps({'text': data})}\n\n".encode("utf-8")
 
 @app.post("/generate")
@@ -21,6 +24,11 @@ async def generate(inp: Inp):
     answer += "\nمواد: لياسة RAL 1013، قرميد طيني، شرائح خشبية."
     answer += "\nتحسين: زوايا فتحات محسوبة حسب التوجه + تشجير الواجهة."
     async def gen():
+        buf = ""
         for w in re.split(r"(\s+)", answer):
-            yield sse(w); time.sleep(0.008)
+            buf += w
+            if len(buf) >= FLUSH_CHARS:
+                yield sse(buf); buf = ""
+                await asyncio.sleep(TOKEN_DELAY_MS / 1000)
+        if buf: yield sse(buf)
     return StreamingResponse(gen(), media_type="text/event-stream")
@@ -4,10 +4,12 @@ from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-import os, io, time, json, math, glob, uuid, re
+import os, io, time, json, math, glob, uuid, re, mmap, asyncio
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
 from pypdf import PdfReader
+from .utils.uploads import UploadLimit, safe_name, save_upload
+from .utils.tfidf_index import TfidfIndex, SNAPSHOT_PARAMS, build_arrays
+from .utils.rag_snapshot import load_or_build
 
 APP = FastAPI(title="SIMA Chat Pro V7", version="7.0.0", description="Local generative chat with RAG + SSE + tools")
 
@@ -15,6 +17,7 @@ origins = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
 APP.add_middleware(CORSMiddleware,
     allow_origins=[o.strip() for o in origins],
     allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+APP.add_middleware(UploadLimit)
 
 REQ_COUNT = Counter("sima_chat_requests_total", "Total HTTP Requests", ["route","method"])
 REQ_LAT = Histogram("sima_chat_request_latency_seconds", "Request latency", ["route"])
@@ -85,54 +88,47 @@ async def layout_generate(body: LayoutIn):
     return {"rooms":placed,"fit_score":75.0}
 
 # ------------------- RAG Store -------------------
-VEC = None
-DOCS = []
-DOC_IDS = []
-def build_index():
-    global VEC, DOCS, DOC_IDS
-    texts=[]; DOC_IDS=[]; DOCS=[]
-    for f in sorted(glob.glob("app/corpus/*.md")) + sorted(glob.glob("uploads/*.txt")) + sorted(glob.glob("uploads/*.md")):
-        with open(f,"r",encoding="utf-8") as fh:
-            DOCS.append(fh.read()); DOC_IDS.append(os.path.basename(f))
-    VEC = TfidfVectorizer(stop_words="english")
-    if DOCS: VEC.fit(DOCS)
+RAG = TfidfIndex()
+def build_index(force=False):
+    # maps the on-disk snapshot; the corpus is only re-read and re-vectorized when its files changed
+    files = sorted(glob.glob("app/corpus/*.md")) + sorted(glob.glob("uploads/*.txt")) + sorted(glob.glob("uploads/*.md"))
+    RAG.load(load_or_build("tfidf-hash", SNAPSHOT_PARAMS, files, build_arrays, force=force))
 
 os.makedirs("uploads", exist_ok=True)
 build_index()
 
+def pdf_text(path: str) -> str:
+    # parse through an mmap of the saved upload rather than a bytes copy of it
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return "\n".join([p.extract_text() or "" for p in PdfReader(mm).pages])
+
 @APP.post("/v1/rag/upload")
 async def rag_upload(file: UploadFile = File(...)):
-    name = file.filename.lower()
-    raw = await file.read()
+    name = safe_name(file.filename).lower()
     path = f"uploads/{uuid.uuid4().hex}_{name}"
+    await save_upload(file, path)
     if name.endswith(".pdf"):
         # extract text
         try:
-            r = PdfReader(io.BytesIO(raw))
-            txt = "\n".join([p.extract_text() or "" for p in r.pages])
+            txt = await asyncio.to_thread(pdf_text, path)   # pypdf is CPU-bound; keep the loop free
         except Exception as e:
             return JSONResponse({"ok":False,"error":str(e)}, status_code=400)
-        with open(path.replace(".pdf",".txt"), "w", encoding="utf-8") as fh: fh.write(txt)
-    else:
-        with open(path, "wb") as fh: fh.write(raw)
-    build_index()
-    return {"ok":True, "docs": len(DOCS)}
+        path = path.replace(".pdf",".txt")
+        with open(path, "w", encoding="utf-8") as fh: fh.write(txt)
+    if path.endswith((".txt",".md")):
+        with open(path,"r",encoding="utf-8",errors="ignore") as fh: RAG.add([fh.read()], [os.path.basename(path)])
+    return {"ok":True, "docs": len(RAG)}
 
 class RAGQuery(BaseModel):
     query: str
     k: int = 3
 @APP.post("/v1/rag/search")
 async def rag_search(body: RAGQuery):
-    if not DOCS or VEC is None: return {"hits":[]}
-    qvec = VEC.transform([body.query])
-    dvec = VEC.transform(DOCS)
-    sims = (dvec @ qvec.T).toarray().ravel()
-    idx = sims.argsort()[::-1][:max(1,body.k)]
-    return {"hits":[{"doc_id":DOC_IDS[i], "score": float(sims[i]), "excerpt": DOCS[i][:240]} for i in idx]}
+    return {"hits":[RAG.hit(i, s) for i, s in RAG.search(body.query, body.k)]}
 
 @APP.post("/v1/admin/retrain")
 async def retrain():
-    build_index(); return {"ok":True,"docs":len(DOCS)}
+    build_index(force=True); return {"ok":True,"docs":len(RAG)}
 
 # ------------------- Generative Stub + Tool-calling -------------------
 class ChatIn(BaseModel):
@@ -144,11 +140,18 @@ def sse_pack(event: str, data: Any):
     payload = json.dumps(data, ensure_ascii=False)
     return f"event: {event}\ndata: {payload}\n\n".encode("utf-8")
 
-def simple_generate(answer: str):
-    # stream word by word
+TOKEN_DELAY_MS = float(os.getenv("TOKEN_DELAY_MS","0"))
+FLUSH_CHARS = int(os.getenv("FLUSH_CHARS","32"))
+
+async def simple_generate(answer: str):
+    # stream word by word, coalesced into FLUSH_CHARS chunks; never block the event loop
+    buf = ""
     for w in re.split(r"(\s+)", answer):
-        yield sse_pack("token", {"text": w})
-        time.sleep(0.01)
+        buf += w
+        if len(buf) >= FLUSH_CHARS:
+            yield sse_pack("token", {"text": buf}); buf = ""
+            await asyncio.sleep(TOKEN_DELAY_MS / 1000)
+    if buf: yield sse_pack("token", {"text": buf})
 
 def run_tools_if_needed(msg: str):
     out = []
@@ -161,11 +164,8 @@ def run_tools_if_needed(msg: str):
     return out
 
 def retrieve_ctx(q: str, topk=2):
-    if not DOCS or VEC is None: return []
-    qv = VEC.transform([q]); dv = VEC.transform(DOCS)
-    sims = (dv @ qv.T).toarray().ravel()
-    idx = sims.argsort()[::-1][:topk]
-    return [{"doc_id":DOC_IDS[i], "excerpt": DOCS[i][:280]} for i in idx]
+    # passages, not document prefixes: only the matching text goes into the prompt
+    return [RAG.hit(i, s) for i, s in RAG.search(q, topk)]
 
 @APP.post("/v1/chat", response_class=JSONResponse)
 async def chat(body: ChatIn):
@@ -190,7 +190,7 @@ async def chat_stream(body: ChatIn):
 
     async def eventgen():
         yield sse_pack("start", {"ok":True, "tools": tools, "context": ctx})
-        for chunk in simple_generate(answer):
+        async for chunk in simple_generate(answer):
             yield chunk
         yield sse_pack("done", {"finished": True})
 
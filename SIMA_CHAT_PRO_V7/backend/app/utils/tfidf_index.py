@@ -0,0 +1,126 @@
+import os, threading
+from typing import List, Tuple
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+from .rag_snapshot import Snapshot, csr_arrays, csr_from
+from .chunker import RAG_CHUNK_CHARS, RAG_CHUNK_OVERLAP, Passages, passage_spans
+
+# Incremental TF-IDF store over passages (see chunker.py). Passages are hashed to raw term counts once (HashingVectorizer is stateless,
+# so no vocabulary refit); document frequencies are kept as a running array and the l2-normalised
+# TF-IDF matrix is cached, so a query only hashes itself and does one sparse mat-vec.
+# New documents are weighted with the current idf and appended; once the corpus has grown by
+# TFIDF_REWEIGHT_RATIO since the last full weighting, the matrix is re-weighted in a background thread.
+TFIDF_FEATURES = int(os.getenv("TFIDF_FEATURES", str(2**18)))
+TFIDF_REWEIGHT_RATIO = float(os.getenv("TFIDF_REWEIGHT_RATIO","0.1"))
+SNAPSHOT_PARAMS = {"n_features": TFIDF_FEATURES, "stop_words": "english", "alternate_sign": False,
+                   "chunk_chars": RAG_CHUNK_CHARS, "chunk_overlap": RAG_CHUNK_OVERLAP}
+
+class TfidfIndex(Passages):
+    def __init__(self, n_features: int = TFIDF_FEATURES):
+        self.hv = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None, stop_words="english")
+        self.n_features = n_features
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.docs: List[str] = []; self.ids: List[str] = []
+        self.p_src = np.zeros(0, np.int32); self.p_start = self.p_end = np.zeros(0, np.int64)
+        self.counts = sp.csr_matrix((0, self.n_features), dtype=np.float32)
+        self.df = np.zeros(self.n_features, dtype=np.int64)
+        self.idf = np.ones(self.n_features, dtype=np.float32)
+        self.X = sp.csr_matrix((0, self.n_features), dtype=np.float32)
+        self._weighted_n = 0; self._reweighting = False
+
+    def __len__(self): return len(self.docs)
+
+    def _weigh(self, counts, idf):
+        if counts.shape[0] == 0: return sp.csr_matrix((0, self.n_features), dtype=np.float32)   # normalize() rejects 0 rows
+        return normalize(sp.csr_matrix(counts.multiply(idf), dtype=np.float32), copy=False)
+
+    def _compute_idf(self, n: int, df: np.ndarray) -> np.ndarray:
+        # same smoothing as sklearn's TfidfTransformer(smooth_idf=True)
+        return (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+
+    def _count(self, docs: List[str], first_doc: int = 0):
+        src, start, end = passage_spans(docs)
+        texts = [docs[d][s:e] for d, s, e in zip(src, start, end)]
+        counts = self.hv.transform(texts).astype(np.float32) if texts else sp.csr_matrix((0, self.n_features), dtype=np.float32)
+        return counts, src + first_doc, start, end
+
+    def build(self, docs: List[str], ids: List[str]):
+        """Full (re)build, e.g. at startup or /v1/admin/retrain. An empty corpus gives an empty index."""
+        counts, src, start, end = self._count(docs)
+        if counts.shape[0] == 0:   # nothing to weigh; build_index() runs at import, so this must not raise
+            with self._lock:
+                self._reset(); self.docs, self.ids = list(docs), list(ids)
+            return
+        df = np.bincount(counts.indices, minlength=self.n_features)
+        idf = self._compute_idf(counts.shape[0], df)
+        X = self._weigh(counts, idf)
+        with self._lock:
+            self.docs, self.ids, self.counts, self.df, self.idf, self.X = list(docs), list(ids), counts, df, idf, X
+            self.p_src, self.p_start, self.p_end = src, start, end
+            self._weighted_n = X.shape[0]
+
+    def arrays(self) -> dict:
+        with self._lock:
+            return {"df": self.df, "idf": self.idf, "p_src": self.p_src, "p_start": self.p_start, "p_end": self.p_end,
+                    **csr_arrays("counts", self.counts), **csr_arrays("X", self.X)}
+
+    def load(self, snap: Snapshot):
+        """Adopt a mapped snapshot: matrices stay file-backed until the next append copies them."""
+        a = snap.arrays
+        with self._lock:
+            self.docs, self.ids = snap.docs, list(snap.ids)
+            self.counts, self.X = csr_from(a, "counts"), csr_from(a, "X")
+            self.df, self.idf = np.array(a["df"]), np.array(a["idf"])
+            self.p_src, self.p_start, self.p_end = np.array(a["p_src"]), np.array(a["p_start"]), np.array(a["p_end"])
+            self._weighted_n = self.X.shape[0]
+
+    def add(self, docs: List[str], ids: List[str]):
+        """Append documents without touching the rest of the corpus."""
+        if not docs: return
+        with self._lock:
+            counts, src, start, end = self._count(docs, len(self.docs))
+            if counts.shape[0] == 0:   # no passages (empty text, scanned PDF): keep the doc, nothing to index
+                self.docs.extend(docs); self.ids.extend(ids); return
+            self.df += np.bincount(counts.indices, minlength=self.n_features)
+            self.counts = sp.vstack([self.counts, counts], format="csr")
+            self.X = sp.vstack([self.X, self._weigh(counts, self.idf)], format="csr")
+            self.p_src, self.p_start, self.p_end = np.concatenate([self.p_src, src]), np.concatenate([self.p_start, start]), np.concatenate([self.p_end, end])
+            self.docs.extend(docs); self.ids.extend(ids)
+            stale = self.X.shape[0] - self._weighted_n > TFIDF_REWEIGHT_RATIO * max(1, self._weighted_n)
+            if stale and not self._reweighting:
+                self._reweighting = True
+                threading.Thread(target=self.reweight, daemon=True).start()
+
+    def reweight(self):
+        """Recompute idf over the whole corpus and swap in the re-weighted matrix."""
+        try:
+            with self._lock: counts, df, n = self.counts, self.df.copy(), self.counts.shape[0]
+            idf = self._compute_idf(n, df)
+            X = self._weigh(counts, idf)
+            with self._lock:
+                if X.shape[0] < self.X.shape[0]:   # documents appended meanwhile: weigh them too
+                    X = sp.vstack([X, self._weigh(self.counts[X.shape[0]:], idf)], format="csr")
+                self.X, self.idf, self._weighted_n = X, idf, X.shape[0]
+        finally:
+            self._reweighting = False
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (passage index, score); see Passages.passage for the text and source."""
+        with self._lock: X, idf = self.X, self.idf
+        if X.shape[0] == 0: return []
+        q = self._weigh(self.hv.transform([query]).astype(np.float32), idf)
+        sims = (X @ q.T).toarray().ravel()
+        k = min(max(1, k), sims.shape[0])
+        idx = np.argpartition(-sims, k - 1)[:k]
+        idx = idx[np.argsort(-sims[idx])]
+        return [(int(i), float(sims[i])) for i in idx]
+
+def build_arrays(docs: List[str], ids: List[str]):
+    """rag_snapshot build callback."""
+    ix = TfidfIndex(); ix.build(docs, ids)
+    return ix.arrays(), {}
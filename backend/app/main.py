@@ -1,29 +1,48 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse, Response
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
-import os, io, json, time, uuid, re, threading, hashlib
+import os, io, json, math, time, uuid, re, threading, hashlib, functools, asyncio, datetime
 import numpy as np
-import httpx, psycopg
-from datetime import datetime, timedelta
+import psycopg
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from pypdf import PdfReader
 import qrcode
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
+from .utils.db import open_pool, close_pool, get_conn
+from .utils.embedder import load_embedder, to_pgvector
+from .utils.embed_service import EMBED_CACHE_DDL, EMBED_CACHE_PG, EmbedService, PgEmbedStore
+from .utils.vindex import ensure_index, set_search_params, index_report
+from .utils.rag_bulk import RAG_CHUNK, chunk_docs, bulk_load
+from .utils.hybrid import RAG_SEARCH_LAT, fts_ddl, hybrid_search
+from .utils import pdf_extract
+from .utils.uploads import UPLOAD_DIR, UploadLimit, safe_name, save_upload
+from .utils.sse import sse_pack, paced, coalesce, ttft
+from .utils.http_clients import http_client, open_clients, close_clients
+from .utils.chat_cache import ChatCache
+from .utils.ratelimit import RateLimited, user_limiter, client_key, provider_admit
+from .utils.llm_router import Router
+from .utils.sensor_ingest import BatchWriter
+from .utils import sensor_partitions
+from .utils.sensor_rollups import Rollups, parse_step, shape
+from .utils.sensor_live import HubFull, LiveHub, stream as live_stream
+from .utils import sensor_wire
 
 app = FastAPI(title="SIMA AI Unified API", version="1.1.0")
 origins = os.getenv("CORS_ORIGINS","http://localhost:3000").split(",")
 app.add_middleware(CORSMiddleware, allow_origins=[o.strip() for o in origins],
                    allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(UploadLimit)
 
 REQ_COUNT = Counter("sima_requests_total","Total HTTP Requests",["route","method"])
 REQ_LAT = Histogram("sima_request_latency_seconds","Request latency",["route"])
 
 def track(route, method="GET"):
     def deco(fn):
+        @functools.wraps(fn)   # keep the handler signature so FastAPI sees its real params
         async def wrap(*a, **kw):
             s=time.time(); REQ_COUNT.labels(route=route, method=method).inc()
             try: return await fn(*a, **kw)
@@ -34,6 +53,7 @@ def track(route, method="GET"):
 DB_DSN = os.getenv("DB_DSN","postgresql://postgres:postgres@db:5432/sima")
 EMBED_DIM = int(os.getenv("EMBED_DIM","384"))
 PGVECTOR = os.getenv("PGVECTOR","1") == "1"
+RAG_SEARCH_MODE = os.getenv("RAG_SEARCH_MODE","hybrid")
 MQTT_URL=os.getenv("MQTT_URL","mosquitto"); MQTT_PORT=int(os.getenv("MQTT_PORT","8883"))
 MQTT_TLS_CA=os.getenv("MQTT_TLS_CA",""); MQTT_TLS_CERT=os.getenv("MQTT_TLS_CERT",""); MQTT_TLS_KEY=os.getenv("MQTT_TLS_KEY","")
 MQTT_USER=os.getenv("MQTT_USER",""); MQTT_PASS=os.getenv("MQTT_PASS","")
@@ -41,45 +61,64 @@ CLOUD_RELAY_URL=os.getenv("CLOUD_RELAY_URL",""); CLOUD_MODEL_NAME=os.getenv("CLO
 OPENAI_API_KEY=os.getenv("OPENAI_API_KEY","")
 ANTHROPIC_API_KEY=os.getenv("ANTHROPIC_API_KEY","")
 GEMINI_API_KEY=os.getenv("GEMINI_API_KEY","")
-
-# Rate limiting for free API
-api_calls = {"count": 0, "reset_time": datetime.now()}
-response_cache = {}
-
-def db_init():
-    with psycopg.connect(DB_DSN, autocommit=True) as conn:
-        with conn.cursor() as cur:
-            if PGVECTOR: cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-            cur.execute("CREATE TABLE IF NOT EXISTS projects(id UUID PRIMARY KEY, consultant TEXT, region TEXT, function TEXT, files JSONB, location TEXT, created_at TIMESTAMP DEFAULT now());")
-            cur.execute("CREATE TABLE IF NOT EXISTS guidelines(id TEXT PRIMARY KEY, region TEXT, article_code TEXT, text TEXT, weight REAL);")
-            cur.execute("CREATE TABLE IF NOT EXISTS scores(project_id UUID, identity REAL, climate REAL, context REAL, function REAL, human REAL, total REAL, PRIMARY KEY(project_id));")
-            cur.execute("CREATE TABLE IF NOT EXISTS violations(project_id UUID, article_code TEXT, severity REAL, evidence TEXT);")
-            cur.execute("CREATE TABLE IF NOT EXISTS improvements(project_id UUID, suggestion TEXT, impact REAL, cost_est REAL);")
-            cur.execute("CREATE TABLE IF NOT EXISTS certificates(project_id UUID PRIMARY KEY, status TEXT, pdf_url TEXT, qr_hash TEXT);")
-            if PGVECTOR: cur.execute(f"CREATE TABLE IF NOT EXISTS rag_docs(id TEXT PRIMARY KEY, title TEXT, content TEXT, embedding vector({EMBED_DIM}));")
-            cur.execute("CREATE TABLE IF NOT EXISTS iot_readings(ts TIMESTAMP DEFAULT now(), project_id UUID, type TEXT, value REAL);")
+GEMINI_BASE_URL=os.getenv("GEMINI_BASE_URL","https://generativelanguage.googleapis.com/v1beta"); GEMINI_MODEL=os.getenv("GEMINI_MODEL","gemini-pro")
+LLM_PRIORITY=os.getenv("LLM_PRIORITY","gemini,openai,anthropic,vllm")
+
+chat_cache = ChatCache()
+embedder = EmbedService(load_embedder(dim=EMBED_DIM), store=PgEmbedStore(get_conn) if EMBED_CACHE_PG else None)
+
+async def db_init():
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            if PGVECTOR: await cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+            await cur.execute("CREATE TABLE IF NOT EXISTS projects(id UUID PRIMARY KEY, consultant TEXT, region TEXT, function TEXT, files JSONB, location TEXT, created_at TIMESTAMP DEFAULT now());")
+            await cur.execute("CREATE TABLE IF NOT EXISTS guidelines(id TEXT PRIMARY KEY, region TEXT, article_code TEXT, text TEXT, weight REAL);")
+            await cur.execute("CREATE TABLE IF NOT EXISTS scores(project_id UUID, identity REAL, climate REAL, context REAL, function REAL, human REAL, total REAL, PRIMARY KEY(project_id));")
+            await cur.execute("CREATE TABLE IF NOT EXISTS violations(project_id UUID, article_code TEXT, severity REAL, evidence TEXT);")
+            await cur.execute("CREATE TABLE IF NOT EXISTS improvements(project_id UUID, suggestion TEXT, impact REAL, cost_est REAL);")
+            await cur.execute("CREATE TABLE IF NOT EXISTS certificates(project_id UUID PRIMARY KEY, status TEXT, pdf_url TEXT, qr_hash TEXT);")
+            if PGVECTOR:
+                await cur.execute(f"CREATE TABLE IF NOT EXISTS rag_docs(id TEXT PRIMARY KEY, title TEXT, content TEXT, embedding vector({EMBED_DIM}));")
+                for ddl in fts_ddl("rag_docs", "coalesce(title,'') || ' ' || coalesce(content,'')"): await cur.execute(ddl)
+            await cur.execute(EMBED_CACHE_DDL)
+        if PGVECTOR: await ensure_index(conn, "rag_docs", "<=>")
+    await asyncio.to_thread(sensor_partitions.setup, DB_DSN, "iot_readings",
+                            "ts TIMESTAMP NOT NULL DEFAULT now(), project_id UUID, type TEXT, value REAL", ["ts", "project_id", "type", "value"])
+    await asyncio.to_thread(iot_rollups.setup, DB_DSN)
     # seed
     path="app/data/dasc_guidelines.json"
     if os.path.exists(path):
         data=json.load(open(path,"r",encoding="utf-8"))
-        with psycopg.connect(DB_DSN) as conn:
-            with conn.cursor() as cur:
-                for rg in data.get("regions",[]):
-                    for art in rg.get("articles",[]):
-                        gid=f"{rg['code']}-{art['id']}"
-                        cur.execute("INSERT INTO guidelines (id, region, article_code, text, weight) VALUES (%s,%s,%s,%s,%s) ON CONFLICT (id) DO NOTHING;" ,
-                                    (gid, rg["code"], art["id"], art["text"], art["weight"])) ; conn.commit()
-
-db_init()
-
-def hash_embed(text: str, dim: int = 384):
-    import hashlib, numpy as np, re
-    vec = np.zeros(dim, dtype=np.float32)
-    for tok in re.findall(r"\\w+", text.lower()):
-        h = int(hashlib.md5(tok.encode()).hexdigest(), 16)
-        vec[h % dim] += 1.0
-    n = np.linalg.norm(vec) + 1e-9
-    return (vec / n).tolist()
+        rows=[(f"{rg['code']}-{art['id']}", rg["code"], art["id"], art["text"], art["weight"])
+              for rg in data.get("regions",[]) for art in rg.get("articles",[])]
+        async with get_conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany("INSERT INTO guidelines (id, region, article_code, text, weight) VALUES (%s,%s,%s,%s,%s) ON CONFLICT (id) DO NOTHING;", rows)
+
+@app.on_event("startup")
+async def start_db():
+    await open_pool(DB_DSN)
+    await db_init()
+
+@app.on_event("shutdown")
+async def stop_db():
+    await close_pool()
+
+@app.on_event("shutdown")
+def stop_pdf_workers():
+    pdf_extract.shutdown()
+
+@app.on_event("shutdown")
+def stop_embedder():
+    embedder.shutdown()
+
+@app.on_event("startup")
+async def start_http_clients():
+    await open_clients("openai", "anthropic", "gemini", "vllm")
+
+@app.on_event("shutdown")
+async def stop_http_clients():
+    await close_clients()
 
 class UploadOut(BaseModel):
     project_id:str
@@ -87,36 +126,32 @@ class UploadOut(BaseModel):
 @app.post("/v1/project/upload", response_model=UploadOut)
 @track("/v1/project/upload","POST")
 async def project_upload(file: UploadFile = File(...), consultant: str = "unknown", region: str = "Najdi", function: str = "residential", location: str = "KSA"):
-    pid = str(uuid.uuid4()); fname = f"uploads/{pid}_{file.filename}"
-    os.makedirs("uploads", exist_ok=True)
-    raw = await file.read()
-    with open(fname,"wb") as fh: fh.write(raw)
-    meta = {}
-    if file.filename.lower().endswith(".pdf"):
+    pid = str(uuid.uuid4()); fname = f"{UPLOAD_DIR}/{pid}_{safe_name(file.filename)}"
+    saved = await save_upload(file, fname)
+    meta = {"size": saved.size, "sha256": saved.sha256}
+    if fname.lower().endswith(".pdf"):
         try:
-            r=PdfReader(io.BytesIO(raw))
-            text="\\n".join([p.extract_text() or "" for p in r.pages])[:6000]
-            meta["text_sample"]=text
+            pages = await pdf_extract.extract_pdf_text(fname, saved.sha256)
+            meta["text_sample"]="\n".join(pages)[:6000]
         except Exception as e:
             meta["pdf_error"]=str(e)
-    with psycopg.connect(DB_DSN) as conn:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO projects (id, consultant, region, function, files, location) VALUES (%s,%s,%s,%s,%s,%s);",
-                        (pid, consultant, region, function, json.dumps({"primary": fname, "meta": meta}), location))
-        conn.commit()
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("INSERT INTO projects (id, consultant, region, function, files, location) VALUES (%s,%s,%s,%s,%s,%s);",
+                              (pid, consultant, region, function, json.dumps({"primary": fname, "meta": meta}), location))
     return {"project_id": pid}
 
 @app.get("/v1/project/{pid}/analysis")
 @track("/v1/project/{pid}/analysis","GET")
 async def project_analysis(pid: str):
-    with psycopg.connect(DB_DSN) as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT region, files FROM projects WHERE id=%s;", (pid,))
-            row = cur.fetchone()
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT region, files FROM projects WHERE id=%s;", (pid,))
+            row = await cur.fetchone()
             if not row: raise HTTPException(404, "project not found")
             region, files = row[0], row[1]
-            cur.execute("SELECT article_code, text, weight FROM guidelines WHERE region=%s;", (region,))
-            arts = cur.fetchall()
+            await cur.execute("SELECT article_code, text, weight FROM guidelines WHERE region=%s;", (region,))
+            arts = await cur.fetchall()
     violations=[{"article_code":a[0], "text":a[1], "severity": round(max(0.1, 1.0 - a[2]*2),2)} for a in arts[:5]]
     return {"project_id": pid, "region": region, "violations": violations, "files": files}
 
@@ -127,11 +162,10 @@ async def project_score(pid: str):
     identity, climate, context, function, human = [round(random.uniform(0.6,0.95)*100,2) for _ in range(5)]
     total = round(0.35*identity + 0.2*climate + 0.2*context + 0.15*function + 0.1*human, 2)
     status = "PASS" if total>=80 else ("CONDITIONAL" if total>=65 else "FAIL")
-    with psycopg.connect(DB_DSN) as conn:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO scores (project_id, identity, climate, context, function, human, total) VALUES (%s,%s,%s,%s,%s,%s,%s) ON CONFLICT (project_id) DO UPDATE SET identity=EXCLUDED.identity, climate=EXCLUDED.climate, context=EXCLUDED.context, function=EXCLUDED.function, human=EXCLUDED.human, total=EXCLUDED.total;",
-                        (pid, identity, climate, context, function, human, total))
-        conn.commit()
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("INSERT INTO scores (project_id, identity, climate, context, function, human, total) VALUES (%s,%s,%s,%s,%s,%s,%s) ON CONFLICT (project_id) DO UPDATE SET identity=EXCLUDED.identity, climate=EXCLUDED.climate, context=EXCLUDED.context, function=EXCLUDED.function, human=EXCLUDED.human, total=EXCLUDED.total;",
+                              (pid, identity, climate, context, function, human, total))
     return {"project_id": pid, "identity":identity, "climate":climate, "context":context, "function":function, "human":human, "total":total, "status":status}
 
 class ImproveIn(BaseModel):
@@ -144,20 +178,19 @@ async def project_improve(pid: str, body: ImproveIn):
         {"suggestion":"استخدام ألوان RAL 1015/9010 ومواد محلية", "impact":6.5, "cost_est":body.budget*0.1},
         {"suggestion":"إضافة مشربيات خشبية للواجهة الغربية", "impact":5.0, "cost_est":body.budget*0.2}
     ]
-    with psycopg.connect(DB_DSN) as conn:
-        with conn.cursor() as cur:
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
             for s in suggestions:
-                cur.execute("INSERT INTO improvements (project_id, suggestion, impact, cost_est) VALUES (%s,%s,%s,%s);",(pid, s["suggestion"], s["impact"], s["cost_est"]))
-        conn.commit()
+                await cur.execute("INSERT INTO improvements (project_id, suggestion, impact, cost_est) VALUES (%s,%s,%s,%s);",(pid, s["suggestion"], s["impact"], s["cost_est"]))
     return {"project_id": pid, "suggestions": suggestions}
 
 @app.get("/v1/project/{pid}/certificate")
 @track("/v1/project/{pid}/certificate","GET")
 async def project_certificate(pid: str):
-    with psycopg.connect(DB_DSN) as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT total FROM scores WHERE project_id=%s;", (pid,))
-            row = cur.fetchone()
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT total FROM scores WHERE project_id=%s;", (pid,))
+            row = await cur.fetchone()
             if not row: raise HTTPException(404, "score first")
             total=row[0]
     status = "PASS" if total>=80 else ("CONDITIONAL" if total>=65 else "FAIL")
@@ -173,10 +206,9 @@ async def project_certificate(pid: str):
     c.drawImage(qr_path, 160*mm, 240*mm, width=30*mm, height=30*mm)
     c.setFont("Helvetica", 9); c.drawString(40*mm, 20*mm, "Scan QR to verify")
     c.showPage(); c.save()
-    with psycopg.connect(DB_DSN) as conn:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO certificates (project_id, status, pdf_url, qr_hash) VALUES (%s,%s,%s,%s) ON CONFLICT (project_id) DO UPDATE SET status=EXCLUDED.status, pdf_url=EXCLUDED.pdf_url, qr_hash=EXCLUDED.qr_hash;", (pid, status, pdf_path, qr_hash))
-        conn.commit()
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("INSERT INTO certificates (project_id, status, pdf_url, qr_hash) VALUES (%s,%s,%s,%s) ON CONFLICT (project_id) DO UPDATE SET status=EXCLUDED.status, pdf_url=EXCLUDED.pdf_url, qr_hash=EXCLUDED.qr_hash;", (pid, status, pdf_path, qr_hash))
     with open(pdf_path,"rb") as fh: data = fh.read()
     return Response(content=data, media_type="application/pdf")
 
@@ -186,61 +218,84 @@ class RAGIn(BaseModel):
 @app.post("/v1/rag/upload")
 async def rag_upload(body: RAGIn):
     if not PGVECTOR: return {"ok":False, "msg":"pgvector off"}
-    emb = hash_embed(body.content, EMBED_DIM)
-    with psycopg.connect(DB_DSN) as conn:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO rag_docs (id, title, content, embedding) VALUES (%s,%s,%s,%s) ON CONFLICT (id) DO UPDATE SET title=EXCLUDED.title, content=EXCLUDED.content, embedding=EXCLUDED.embedding;",
-                        (body.title, body.title, body.content, emb))
-        conn.commit()
+    emb = to_pgvector(await embedder.embed(body.content))
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("INSERT INTO rag_docs (id, title, content, embedding) VALUES (%s,%s,%s,%s::vector) ON CONFLICT (id) DO UPDATE SET title=EXCLUDED.title, content=EXCLUDED.content, embedding=EXCLUDED.embedding "
+                              "WHERE (rag_docs.title, rag_docs.content, rag_docs.embedding) IS DISTINCT FROM (EXCLUDED.title, EXCLUDED.content, EXCLUDED.embedding);",
+                              (body.title, body.title, body.content, emb))
     return {"ok":True}
 
+@app.post("/v1/rag/bulk")
+async def rag_bulk(request: Request, title: Optional[str] = None, chunk: int = RAG_CHUNK):
+    # NDJSON body ({"title","content"[,"id"]} per line) or multipart with a text `file` (+ optional `title` field)
+    if not PGVECTOR: return {"ok":False, "msg":"pgvector off"}
+    s=time.time()
+    ctype = request.headers.get("content-type","")
+    if ctype.startswith("multipart/"):
+        form = await request.form()
+        f = form.get("file")
+        if f is None: raise HTTPException(400, "multipart body needs a `file` part")
+        text = (await f.read()).decode("utf-8", errors="ignore")
+        docs = [{"title": form.get("title") or title or os.path.splitext(f.filename or "doc")[0], "content": text}]
+    else:
+        docs = []
+        for i, ln in enumerate((await request.body()).decode("utf-8", errors="ignore").splitlines(), 1):
+            if not ln.strip(): continue
+            try: d = json.loads(ln)
+            except ValueError: raise HTTPException(400, f"line {i}: invalid JSON")
+            if not isinstance(d, dict) or not d.get("title"): raise HTTPException(400, f"line {i}: `title` is required")
+            docs.append(d)
+    async with get_conn() as conn:
+        staged, merged = await bulk_load(conn, chunk_docs(docs, max(100, chunk)), EMBED_DIM, encode=embedder.embed_many)
+        await ensure_index(conn, "rag_docs", "<=>")
+    return {"ok":True, "docs":len(docs), "chunks":staged, "merged":merged, "ms":round((time.time()-s)*1000,1)}
+
 class RAGQuery(BaseModel):
     query:str; k:int=6
+    ef_search: Optional[int] = None; probes: Optional[int] = None   # ANN recall/latency knobs (hnsw / ivfflat)
+    mode: Optional[str] = None      # hybrid (full-text + vector, RRF) | vector; default RAG_SEARCH_MODE
+    timing: bool = False            # per-leg timings via EXPLAIN ANALYZE (runs the query twice)
 @app.post("/v1/rag/search")
 async def rag_search(body: RAGQuery):
     if not PGVECTOR: return {"hits":[]}
-    qv = hash_embed(body.query, EMBED_DIM)
-    with psycopg.connect(DB_DSN) as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, title, 1 - (embedding <=> %s) AS sim FROM rag_docs ORDER BY embedding <=> %s LIMIT %s;", (qv, qv, body.k))
-            rows = cur.fetchall()
-    return {"hits":[{"id":r[0], "title":r[1], "score": float(r[2])} for r in rows]}
+    mode = body.mode or RAG_SEARCH_MODE
+    if mode not in ("hybrid","vector"): raise HTTPException(400, "mode must be hybrid or vector")
+    qv = to_pgvector(await embedder.embed(body.query, store=False))   # queries are one-off: LRU only, no embed_cache rows
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            await set_search_params(cur, body.ef_search, body.probes)
+            if mode == "hybrid":
+                hits, timing = await hybrid_search(cur, "rag_docs", body.query, qv, body.k, body.timing)
+                return {"hits": hits, "mode": mode, "timing": timing}
+            s=time.perf_counter()
+            await cur.execute("SELECT id, title, 1 - (embedding <=> %s::vector) AS sim FROM rag_docs ORDER BY embedding <=> %s::vector LIMIT %s;", (qv, qv, body.k))
+            rows = await cur.fetchall()
+            took=time.perf_counter()-s; RAG_SEARCH_LAT.labels(mode="vector").observe(took)
+    return {"hits":[{"id":r[0], "title":r[1], "score": float(r[2])} for r in rows], "mode": mode, "timing": {"round_trip_ms": round(took*1000,3)}}
+
+@app.get("/v1/admin/embedder")
+async def embedder_info(): return embedder.info()
+
+@app.get("/v1/admin/rag/index")
+async def rag_index_report(k: int = 10, samples: int = 20, ef_search: Optional[int] = None, probes: Optional[int] = None):
+    if not PGVECTOR: return {"index": None}
+    async with get_conn() as conn:
+        return await index_report(conn, "rag_docs", "<=>", k=k, samples=samples, ef_search=ef_search, probes=probes)
+
+@app.post("/v1/admin/rag/reindex")
+async def rag_reindex():
+    if not PGVECTOR: return {"ok": False, "msg": "pgvector off"}
+    async with get_conn() as conn:
+        st = await ensure_index(conn, "rag_docs", "<=>", rebuild=True)
+    return {"ok": True, "index": st}
 
 # -------- Chat SSE (local) and optional vLLM proxy
 class ChatIn(BaseModel):
     message:str; mode: Optional[str] = None
 
-def sse_pack(event, data): return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
 
-def check_rate_limit():
-    global api_calls
-    now = datetime.now()
-    # Reset counter every minute
-    if now > api_calls["reset_time"] + timedelta(minutes=1):
-        api_calls["count"] = 0
-        api_calls["reset_time"] = now
-    
-    # Free tier: 15 requests per minute
-    if api_calls["count"] >= 10:  # Conservative limit
-        return False
-    
-    api_calls["count"] += 1
-    return True
-
-def get_cached_response(prompt):
-    prompt_hash = hashlib.md5(prompt.encode()).hexdigest()
-    return response_cache.get(prompt_hash)
-
-def cache_response(prompt, response):
-    prompt_hash = hashlib.md5(prompt.encode()).hexdigest()
-    response_cache[prompt_hash] = response
-    # Keep only last 50 responses
-    if len(response_cache) > 50:
-        oldest_key = next(iter(response_cache))
-        del response_cache[oldest_key]
-
-async def stream_ai(prompt: str):
-    system_prompt = """أنت مساعد ذكي متخصص في العمارة السعودية وأكواد البناء. مهامك:
+SYSTEM_PROMPT = """أنت مساعد ذكي متخصص في العمارة السعودية وأكواد البناء. مهامك:
 1. تحليل المشاريع المعمارية وفق المعايير السعودية
 2. تقييم الهوية المعمارية (نجدية، حجازية، عسيرية)
 3. فحص الامتثال للمعايير البيئية والمناخية
@@ -253,79 +308,78 @@ async def stream_ai(prompt: str):
 - العزل الحراري والمائي
 
 أجب بالعربية بشكل مهني ومفصل."""
-    
-    async for chunk in stream_gemini(prompt, system_prompt): 
-        yield chunk
 
+@ttft("openai")
 async def stream_openai(prompt: str, system_prompt: str):
-    try:
-        async with httpx.AsyncClient(timeout=60) as client:
-            payload = {
-                "model": "gpt-4o-mini",
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                "stream": True,
-                "max_tokens": 1000
-            }
-            headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-            
-            async with client.stream('POST', 'https://api.openai.com/v1/chat/completions', json=payload, headers=headers) as response:
-                async for line in response.aiter_lines():
-                    if line.startswith('data: '):
-                        data_str = line[6:]
-                        if data_str == '[DONE]': break
-                        try:
-                            data = json.loads(data_str)
-                            if 'choices' in data and len(data['choices']) > 0:
-                                delta = data['choices'][0].get('delta', {})
-                                if 'content' in delta:
-                                    yield sse_pack("token", {"text": delta['content']})
-                        except: pass
-    except Exception as e:
-        yield sse_pack("token", {"text": f"خطأ في الاتصال: {e}"})
+    client = http_client("openai")
+    payload = {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        "stream": True,
+        "max_tokens": 1000
+    }
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
 
+    async with client.stream('POST', 'https://api.openai.com/v1/chat/completions', json=payload, headers=headers) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith('data: '):
+                data_str = line[6:]
+                if data_str == '[DONE]': break
+                try:
+                    data = json.loads(data_str)
+                    if 'choices' in data and len(data['choices']) > 0:
+                        delta = data['choices'][0].get('delta', {})
+                        if 'content' in delta:
+                            yield delta['content']
+                except: pass
+
+@ttft("anthropic")
 async def stream_anthropic(prompt: str, system_prompt: str):
-    try:
-        async with httpx.AsyncClient(timeout=60) as client:
-            payload = {
-                "model": "claude-3-haiku-20240307",
-                "system": system_prompt,
-                "messages": [{"role": "user", "content": prompt}],
-                "stream": True,
-                "max_tokens": 1000
-            }
-            headers = {"x-api-key": ANTHROPIC_API_KEY, "Content-Type": "application/json", "anthropic-version": "2023-06-01"}
-            
-            async with client.stream('POST', 'https://api.anthropic.com/v1/messages', json=payload, headers=headers) as response:
-                async for line in response.aiter_lines():
-                    if line.startswith('data: '):
-                        try:
-                            data = json.loads(line[6:])
-                            if data.get('type') == 'content_block_delta':
-                                text = data.get('delta', {}).get('text', '')
-                                if text: yield sse_pack("token", {"text": text})
-                        except: pass
-    except Exception as e:
-        yield sse_pack("token", {"text": f"خطأ في الاتصال: {e}"})
+    client = http_client("anthropic")
+    payload = {
+        "model": "claude-3-haiku-20240307",
+        "system": system_prompt,
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": True,
+        "max_tokens": 1000
+    }
+    headers = {"x-api-key": ANTHROPIC_API_KEY, "Content-Type": "application/json", "anthropic-version": "2023-06-01"}
 
+    async with client.stream('POST', 'https://api.anthropic.com/v1/messages', json=payload, headers=headers) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith('data: '):
+                try:
+                    data = json.loads(line[6:])
+                    if data.get('type') == 'content_block_delta':
+                        text = data.get('delta', {}).get('text', '')
+                        if text: yield text
+                except: pass
+
+@ttft("gemini")
 async def stream_gemini(prompt: str, system_prompt: str):
-    async with httpx.AsyncClient(timeout=60) as client:
-        payload = {
-            "contents": [{"parts": [{"text": f"{system_prompt}\n\n{prompt}"}]}],
-            "generationConfig": {"maxOutputTokens": 1000}
-        }
-        
-        response = await client.post(f'https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key={GEMINI_API_KEY}', json=payload)
+    client = http_client("gemini")
+    payload = {
+        "contents": [{"parts": [{"text": f"{system_prompt}\n\n{prompt}"}]}],
+        "generationConfig": {"maxOutputTokens": 1000}
+    }
+    # alt=sse: one `data: {GenerateContentResponse}` event per generated chunk
+    url = f'{GEMINI_BASE_URL}/models/{GEMINI_MODEL}:streamGenerateContent?alt=sse&key={GEMINI_API_KEY}'
+    async with client.stream('POST', url, json=payload) as response:
         response.raise_for_status()
-        data = response.json()
-        
-        text = data['candidates'][0]['content']['parts'][0]['text']
-        for word in text.split():
-            yield sse_pack("token", {"text": word + " "})
-            time.sleep(0.01)
-
+        async for line in response.aiter_lines():
+            if not line.startswith('data: '): continue
+            try: data = json.loads(line[6:])
+            except ValueError: continue
+            for cand in data.get('candidates', [])[:1]:
+                for part in cand.get('content', {}).get('parts', []):
+                    if part.get('text'): yield part['text']
+
+@ttft("local")
 async def stream_local(prompt: str):
     # Enhanced local responses based on architectural knowledge
     responses = {
@@ -343,37 +397,80 @@ async def stream_local(prompt: str):
             response_text = answer
             break
     
-    for word in response_text.split():
-        yield sse_pack("token", {"text": word + " "})
-        time.sleep(0.02)
+    async for word in paced(response_text.split()):
+        yield word + " "
 
+@ttft("vllm")
 async def stream_vllm(prompt: str):
-    # OpenAI-compatible non-stream then tokenize locally for SSE
-    try:
-        async with httpx.AsyncClient(timeout=60) as client:
-            payload = {"model": CLOUD_MODEL_NAME, "messages":[{"role":"user","content": prompt}], "stream": False}
-            r = await client.post(CLOUD_RELAY_URL, json=payload)
-            r.raise_for_status()
-            data = r.json()
-            text = data["choices"][0]["message"]["content"]
-    except Exception as e:
-        text = f"تعذّر الاتصال بخادم LLM السحابي: {e} — سيتم استخدام المولّد المحلي."
-    for w in text.split():
-        yield sse_pack("token", {"text": w + " "}); time.sleep(0.004)
+    # OpenAI-compatible streaming: relay each delta as it is generated
+    client = http_client("vllm")
+    payload = {"model": CLOUD_MODEL_NAME, "messages":[{"role":"user","content": prompt}], "stream": True}
+    async with client.stream("POST", CLOUD_RELAY_URL, json=payload) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line.startswith("data: "): continue
+            if line[6:].strip() == "[DONE]": break
+            try: choices = json.loads(line[6:]).get("choices") or [{}]
+            except ValueError: continue
+            text = (choices[0].get("delta") or {}).get("content")
+            if text: yield text
+
+# Providers are tried by LLM_PRIORITY, re-ranked by measured TTFT and error rate; unconfigured ones
+# are skipped and the keyword-based local generator always answers last.
+llm_router = Router(
+    providers={"gemini": lambda p: stream_gemini(p, SYSTEM_PROMPT), "openai": lambda p: stream_openai(p, SYSTEM_PROMPT),
+               "anthropic": lambda p: stream_anthropic(p, SYSTEM_PROMPT), "vllm": stream_vllm, "local": stream_local},
+    priority=[x.strip() for x in LLM_PRIORITY.split(",") if x.strip()], fallback="local",
+    configured={"gemini": lambda: bool(GEMINI_API_KEY), "openai": lambda: bool(OPENAI_API_KEY),
+                "anthropic": lambda: bool(ANTHROPIC_API_KEY), "vllm": lambda: bool(CLOUD_RELAY_URL)},
+    admit=provider_admit)
+
+def stream_ai(prompt: str, info: Optional[dict] = None):
+    return llm_router.stream(prompt, info=info)
 
 @app.options("/v1/chat/stream")
 async def chat_options():
     return {"ok": True}
 
 @app.post("/v1/chat/stream")
-async def chat_stream(body: ChatIn):
+async def chat_stream(body: ChatIn, request: Request):
+    ns = body.mode or "default"
+    try: await user_limiter.acquire(client_key(request))
+    except RateLimited as e: raise e.http()
+    cached = await asyncio.to_thread(chat_cache.get, body.message, ns)
     async def gen():
-        yield sse_pack("start", {"ok": True})
-        async for chunk in stream_ai(body.message): yield chunk
+        yield sse_pack("start", {"ok": True, "cached": cached is not None})
+        if cached is not None:
+            async for text in coalesce(paced(re.findall(r"\S+\s*", cached))): yield sse_pack("token", {"text": text})
+        else:
+            parts, info = [], {}
+            try:
+                async for text in coalesce(stream_ai(body.message, info)):
+                    parts.append(text); yield sse_pack("token", {"text": text})
+            except Exception as e:
+                yield sse_pack("error", {"provider": info.get("provider"), "message": str(e)}); return
+            # local keyword answers are not worth caching in place of a real model answer
+            if info.get("provider") != llm_router.fallback:
+                await asyncio.to_thread(chat_cache.put, body.message, "".join(parts), ns)
         yield sse_pack("done", {"finished": True})
     return StreamingResponse(gen(), media_type="text/event-stream")
 
+@app.get("/v1/admin/llm/router")
+async def llm_router_status():
+    return {"priority": llm_router.priority, "fallback": llm_router.fallback, "providers": llm_router.status()}
+
+@app.delete("/v1/admin/chat/cache")
+async def chat_cache_clear():
+    await asyncio.to_thread(chat_cache.clear)
+    return {"ok": True}
+
 # -------- IoT MQTT with TLS/User/Pass
+iot_writer = BatchWriter(DB_DSN, "iot_readings", ["ts", "project_id", "type", "value"])
+iot_rollups = Rollups("iot_readings", ["ts", "project_id", "type", "value"], tz=False)
+iot_writer.in_tx.append(iot_rollups.apply)
+iot_partitions = sensor_partitions.Maintainer(DB_DSN, ["iot_readings"], hooks=[iot_rollups.prune])
+iot_live = LiveHub()
+
 def mqtt_loop():
     try:
         import paho.mqtt.client as mqtt
@@ -382,16 +479,23 @@ def mqtt_loop():
     def on_connect(client, userdata, flags, rc, properties=None):
         client.subscribe("sensors/+/+")
     def on_message(client, userdata, msg):
+        # parse and enqueue only; iot_writer COPYs in batches and blocks here when its buffer is full
+        now = datetime.datetime.now(datetime.timezone.utc)
         try:
             parts = msg.topic.split("/")
-            _type = parts[-1]; pid = parts[-2]
-            val = float(msg.payload.decode("utf-8").strip())
-            with psycopg.connect(DB_DSN) as conn:
-                with conn.cursor() as cur:
-                    cur.execute("INSERT INTO iot_readings (project_id, type, value) VALUES (%s,%s,%s);",(pid, _type, val))
-                conn.commit()
-        except Exception as e:
-            print("MQTT ingest error:", e)
+            pid = str(uuid.UUID(parts[-2]))
+            if sensor_wire.is_binary(msg.payload):   # sensors/<pid>/<anything>, batched readings with device time
+                bin_pid, readings = sensor_wire.decode(msg.payload, now)
+                if bin_pid != pid: raise ValueError("project id differs from topic")
+            else:                                     # legacy: bare float on sensors/<pid>/<type>
+                val = float(msg.payload.decode("utf-8").strip())
+                if not math.isfinite(val): raise ValueError("non-finite value")   # float() accepts nan/inf
+                readings = [(parts[-1], now, val)]
+        except (ValueError, IndexError, UnicodeDecodeError):
+            iot_writer.drop("parse"); return
+        for _type, ts, val in readings:
+            iot_writer.put((ts, pid, _type, val))
+            iot_live.publish(pid, _type, val, ts)
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
     client.on_connect = on_connect; client.on_message = on_message
     if MQTT_TLS_CA:
@@ -408,17 +512,53 @@ MQTT_STARTED=False
 def start_mqtt():
     global MQTT_STARTED
     if not MQTT_STARTED:
+        iot_writer.start(); iot_partitions.start()
         t = threading.Thread(target=mqtt_loop, daemon=True); t.start()
         MQTT_STARTED=True
 
+@app.on_event("shutdown")
+def stop_mqtt():
+    iot_writer.stop(); iot_partitions.stop()
+
 @app.get("/v1/iot/latest/{pid}")
 async def iot_latest(pid: str):
-    with psycopg.connect(DB_DSN) as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT type, value, ts FROM iot_readings WHERE project_id=%s ORDER BY ts DESC LIMIT 50;", (pid,))
-            rows = cur.fetchall()
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT type, value, ts FROM iot_readings WHERE project_id=%s ORDER BY ts DESC LIMIT 50;", (pid,))
+            rows = await cur.fetchall()
     return {"project_id": pid, "readings":[{"type":r[0], "value":float(r[1]), "ts": r[2].isoformat()} for r in rows]}
 
+@app.get("/v1/sensor/{pid}/latest")
+async def sensor_latest(pid: str):
+    # in-memory values from mqtt_loop: no database round trip for live views
+    try: pid = str(uuid.UUID(pid))
+    except ValueError: raise HTTPException(400, "project id must be a UUID")
+    return {"project_id": pid, "data": iot_live.latest(pid)}
+
+@app.get("/v1/sensor/{pid}/stream")
+async def sensor_stream(pid: str):
+    try: pid = str(uuid.UUID(pid))
+    except ValueError: raise HTTPException(400, "project id must be a UUID")
+    try: sub = iot_live.subscribe(pid, asyncio.get_running_loop())
+    except HubFull as e: raise HTTPException(503, str(e))
+    return StreamingResponse(live_stream(iot_live, sub), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(iot_live.unsubscribe, sub))
+
+@app.get("/v1/sensor/{pid}/series")
+async def sensor_series(pid: str, start: Optional[datetime.datetime] = Query(None, alias="from"), end: Optional[datetime.datetime] = Query(None, alias="to"),
+                        step: str = "1h", agg: str = "avg", type: Optional[str] = None):
+    try:
+        pid = str(uuid.UUID(pid))
+        sql, params, src = iot_rollups.series_query(pid, start, end, parse_step(step), agg, type)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            rows = await cur.fetchall()
+    return {"project_id": pid, "step": int(params["step"].total_seconds()), "agg": agg, "source": src, "series": shape(rows)}
+
 @app.get("/healthz")
 async def healthz(): return PlainTextResponse("ok")
 
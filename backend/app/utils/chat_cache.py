@@ -0,0 +1,102 @@
+import os, time, sqlite3, hashlib, threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+import numpy as np
+from prometheus_client import Counter, Gauge
+from .tokenizer import tokenize
+from .embedder import embed_batch
+
+# Chat answer cache: in-process LRU with TTL, optional SQLite tier shared by workers on the host,
+# keyed on the normalized prompt; optionally falls back to embedding similarity over the LRU tier.
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE","512"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL","86400"))       # seconds
+CHAT_CACHE_SQLITE = os.getenv("CHAT_CACHE_SQLITE","")              # e.g. uploads/.chat_cache.sqlite; empty = memory only
+CHAT_CACHE_SIM = float(os.getenv("CHAT_CACHE_SIM","0"))            # cosine threshold (e.g. 0.92); 0 = exact match only
+CHAT_CACHE_DIM = 256
+
+CACHE_HITS = Counter("sima_chat_cache_hits_total","Chat answers served from cache",["tier"])
+CACHE_MISSES = Counter("sima_chat_cache_misses_total","Chat prompts not found in cache")
+CACHE_EVICTIONS = Counter("sima_chat_cache_evictions_total","Chat cache entries dropped",["reason"])
+CACHE_SIZE = Gauge("sima_chat_cache_entries","Entries in the in-process chat cache")
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(tokenize(prompt))
+
+class ChatCache:
+    def __init__(self, size=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL, sqlite_path=CHAT_CACHE_SQLITE, sim=CHAT_CACHE_SIM):
+        self.size, self.ttl, self.sim = size, ttl, sim
+        self._lru: "OrderedDict[str, Tuple[float, str, str, Optional[np.ndarray]]]" = OrderedDict()  # key -> (expires, ns, answer, vec)
+        self._lock = threading.Lock()
+        self._db = None
+        if sqlite_path:
+            os.makedirs(os.path.dirname(sqlite_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS chat_cache(key TEXT PRIMARY KEY, ns TEXT, prompt TEXT, answer TEXT, expires REAL)")
+        CACHE_SIZE.set_function(lambda: len(self._lru))
+
+    @staticmethod
+    def key(norm: str, ns: str) -> str:
+        return hashlib.sha256(f"{ns}\x00{norm}".encode("utf-8")).hexdigest()
+
+    def _vec(self, norm: str):
+        return embed_batch([norm], CHAT_CACHE_DIM)[0] if self.sim > 0 else None
+
+    def _remember(self, k, expires, ns, answer, vec):
+        self._lru[k] = (expires, ns, answer, vec); self._lru.move_to_end(k)
+        while len(self._lru) > self.size:
+            self._lru.popitem(last=False); CACHE_EVICTIONS.labels(reason="lru").inc()
+
+    def get(self, prompt: str, ns: str = "default") -> Optional[str]:
+        norm = normalize_prompt(prompt)
+        if not norm: return None
+        k, now = self.key(norm, ns), time.time()
+        with self._lock:
+            hit = self._lru.get(k)
+            if hit and hit[0] < now:
+                del self._lru[k]; CACHE_EVICTIONS.labels(reason="ttl").inc(); hit = None
+            if hit:
+                self._lru.move_to_end(k); CACHE_HITS.labels(tier="memory").inc()
+                return hit[2]
+        if self._db is not None:
+            row = self._db.execute("SELECT answer, expires FROM chat_cache WHERE key=?", (k,)).fetchone()
+            if row and row[1] >= now:
+                with self._lock: self._remember(k, row[1], ns, row[0], self._vec(norm))
+                CACHE_HITS.labels(tier="sqlite").inc()
+                return row[0]
+            if row:
+                self._db.execute("DELETE FROM chat_cache WHERE key=?", (k,)); CACHE_EVICTIONS.labels(reason="ttl").inc()
+        if self.sim > 0:
+            q = self._vec(norm)
+            with self._lock:
+                cands = [(e[3], e[2]) for e in self._lru.values() if e[1] == ns and e[0] >= now and e[3] is not None]
+            if cands:
+                sims = np.stack([c[0] for c in cands]) @ q
+                i = int(np.argmax(sims))
+                if sims[i] >= self.sim:
+                    CACHE_HITS.labels(tier="semantic").inc()
+                    return cands[i][1]
+        CACHE_MISSES.inc()
+        return None
+
+    def put(self, prompt: str, answer: str, ns: str = "default"):
+        norm = normalize_prompt(prompt)
+        if not norm or not answer.strip(): return
+        k, expires = self.key(norm, ns), time.time() + self.ttl
+        with self._lock: self._remember(k, expires, ns, answer, self._vec(norm))
+        if self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO chat_cache(key, ns, prompt, answer, expires) VALUES (?,?,?,?,?)", (k, ns, norm, answer, expires))
+
+    def purge_expired(self) -> int:
+        now, n = time.time(), 0
+        with self._lock:
+            for k in [k for k, e in self._lru.items() if e[0] < now]:
+                del self._lru[k]; n += 1
+        if self._db is not None:
+            n += self._db.execute("DELETE FROM chat_cache WHERE expires < ?", (now,)).rowcount
+        if n: CACHE_EVICTIONS.labels(reason="ttl").inc(n)
+        return n
+
+    def clear(self):
+        with self._lock: self._lru.clear()
+        if self._db is not None: self._db.execute("DELETE FROM chat_cache")
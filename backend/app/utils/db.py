@@ -0,0 +1,64 @@
+import os, time
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import HTTPException
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from prometheus_client import Counter, Gauge, Histogram
+
+# Shared async Postgres pool: one per worker, opened on startup and reused by every route.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN","2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX","10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT","5"))      # seconds to wait for a free connection
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE","300"))  # close idle extras above min after this
+DB_POOL_CHECK = os.getenv("DB_POOL_CHECK","1") == "1"           # ping connections before handing them out
+
+POOL_WAIT = Histogram("sima_db_pool_acquire_seconds","Time spent waiting for a pooled DB connection",
+                      buckets=[0.001,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2,5])
+POOL_TIMEOUTS = Counter("sima_db_pool_timeouts_total","DB connection requests that hit DB_POOL_TIMEOUT")
+POOL_SIZE = Gauge("sima_db_pool_size","Open connections held by the pool")
+POOL_AVAILABLE = Gauge("sima_db_pool_available","Idle connections ready to be handed out")
+POOL_WAITING = Gauge("sima_db_pool_waiting","Requests queued waiting for a connection")
+POOL_MAX = Gauge("sima_db_pool_max","Configured maximum pool size")
+
+pool: Optional[AsyncConnectionPool] = None
+
+def _stat(key):
+    return pool.get_stats().get(key, 0) if pool is not None else 0
+
+POOL_SIZE.set_function(lambda: _stat("pool_size"))
+POOL_AVAILABLE.set_function(lambda: _stat("pool_available"))
+POOL_WAITING.set_function(lambda: _stat("requests_waiting"))
+POOL_MAX.set_function(lambda: _stat("pool_max"))
+
+async def open_pool(dsn: str):
+    global pool
+    if pool is None:
+        pool = AsyncConnectionPool(dsn, min_size=DB_POOL_MIN, max_size=max(DB_POOL_MIN, DB_POOL_MAX),
+                                   timeout=DB_POOL_TIMEOUT, max_idle=DB_POOL_MAX_IDLE, name="sima",
+                                   check=AsyncConnectionPool.check_connection if DB_POOL_CHECK else None,
+                                   open=False)
+        await pool.open(wait=True, timeout=max(DB_POOL_TIMEOUT, 30.0))
+    return pool
+
+async def close_pool():
+    global pool
+    if pool is not None:
+        await pool.close(); pool = None
+
+@asynccontextmanager
+async def get_conn():
+    # Same semantics as pool.connection(): commit on success, rollback on error, then return to pool.
+    if pool is None: raise RuntimeError("DB pool not opened; call open_pool() on startup")
+    s = time.perf_counter()
+    try:
+        conn = await pool.getconn()
+    except PoolTimeout:
+        POOL_TIMEOUTS.inc()
+        raise HTTPException(503, "database busy, retry shortly")
+    finally:
+        POOL_WAIT.observe(time.perf_counter()-s)
+    try:
+        async with conn:
+            yield conn
+    finally:
+        await pool.putconn(conn)
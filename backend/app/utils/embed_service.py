@@ -0,0 +1,186 @@
+import os, time, asyncio, hashlib, threading, unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+from prometheus_client import Counter, Gauge, Histogram
+
+# Embedding front for the API: concurrent embed() calls are queued and coalesced into one encode()
+# of up to EMBED_BATCH_MAX texts (waiting at most EMBED_BATCH_WAIT_MS for company), run on a thread
+# pool so the event loop stays free, with an LRU keyed by sha256(embedder version + normalized text) in front.
+# Identical texts already in flight share one future. With a store (PgEmbedStore), each batch first
+# looks its misses up in the content-addressed embed_cache table, so re-ingesting unchanged chunks costs
+# one SELECT instead of an encode; new vectors are written back with ON CONFLICT DO NOTHING. One-off
+# texts such as search queries pass store=False: batched and LRU-cached, but never read from or written to the table.
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX","64"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS","3"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS","1"))      # concurrent encode() calls; ORT already uses EMBED_ONNX_THREADS each
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE","20000"))
+EMBED_CACHE_PG = os.getenv("EMBED_CACHE_PG","1") == "1"
+
+EMBED_BATCH = Histogram("sima_embed_batch_size","Texts per encode() call",["backend"], buckets=[1,2,4,8,16,32,64,128,256])
+EMBED_LAT = Histogram("sima_embed_batch_seconds","encode() wall time",["backend"], buckets=[0.001,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5])
+EMBED_CACHE = Counter("sima_embed_cache_total","Embedding lookups",["result"])   # memory | store | miss
+EMBED_CACHE_RATIO = Gauge("sima_embed_cache_hit_ratio","Embedding lookups served from memory or the store since start")
+EMBED_CACHE_DDL = "CREATE TABLE IF NOT EXISTS embed_cache(key TEXT PRIMARY KEY, version TEXT NOT NULL, embedding REAL[] NOT NULL, created_at TIMESTAMPTZ DEFAULT now());"
+
+def _hit_ratio() -> float:
+    counts = {m.labels["result"]: m.value for f in EMBED_CACHE.collect() for m in f.samples if m.name.endswith("_total")}
+    total = sum(counts.values())
+    return (total - counts.get("miss", 0.0)) / total if total else 0.0
+EMBED_CACHE_RATIO.set_function(_hit_ratio)
+
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFC", " ".join(text.split()))
+
+class PgEmbedStore:
+    """embed_cache table behind an async connection factory (utils.db.get_conn)."""
+    def __init__(self, get_conn):
+        self.get_conn = get_conn
+
+    async def get(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        async with self.get_conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT key, embedding FROM embed_cache WHERE key = ANY(%s);", (keys,))
+                return {k: np.asarray(v, dtype=np.float32) for k, v in await cur.fetchall()}
+
+    async def put(self, version: str, items: Dict[str, np.ndarray]):
+        async with self.get_conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany("INSERT INTO embed_cache (key, version, embedding) VALUES (%s,%s,%s) ON CONFLICT (key) DO NOTHING;",
+                                      [(k, version, v.tolist()) for k, v in items.items()])
+
+class EmbedService:
+    def __init__(self, model, max_batch: int = EMBED_BATCH_MAX, wait_ms: float = EMBED_BATCH_WAIT_MS,
+                 workers: int = EMBED_WORKERS, cache_size: int = EMBED_CACHE_SIZE, store: Optional[PgEmbedStore] = None):
+        self.model, self.dim, self.version, self.store = model, model.dim, model.version, store
+        self.max_batch, self.wait, self.cache_size = max(1, max_batch), wait_ms / 1000.0, cache_size
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="embed")
+        self._workers = max(1, workers)
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop = None
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.version}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _cached(self, k: str) -> Optional[np.ndarray]:
+        with self._lock:
+            v = self._cache.get(k)
+            if v is not None: self._cache.move_to_end(k)
+        if v is not None: EMBED_CACHE.labels(result="memory").inc()
+        return v
+
+    def _remember(self, k: str, v: np.ndarray):
+        if self.cache_size <= 0: return
+        with self._lock:
+            self._cache[k] = v; self._cache.move_to_end(k)
+            while len(self._cache) > self.cache_size: self._cache.popitem(last=False)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        s = time.perf_counter()
+        out = self.model.encode(texts)
+        EMBED_LAT.labels(backend=self.model.name).observe(time.perf_counter() - s)
+        EMBED_BATCH.labels(backend=self.model.name).observe(len(texts))
+        return out
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:   # first use, or a new loop (tests, tools): collector belongs to the running loop
+            self._loop, self._queue, self._inflight = loop, asyncio.Queue(), {}
+            self._slots = asyncio.Semaphore(self._workers)
+            loop.create_task(self._collect())
+
+    async def _collect(self):
+        q, loop = self._queue, self._loop
+        while True:
+            batch = [await q.get()]
+            deadline = loop.time() + self.wait
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(q.get_nowait()); continue
+                except asyncio.QueueEmpty:
+                    pass
+                left = deadline - loop.time()
+                if left <= 0: break
+                try: batch.append(await asyncio.wait_for(q.get(), left))
+                except asyncio.TimeoutError: break
+            await self._slots.acquire()
+            loop.create_task(self._infer(batch))
+
+    async def _lookup(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if self.store is None or not keys: return {}
+        try:
+            return await self.store.get(keys)
+        except Exception:
+            return {}   # the store is an optimisation; fall through to encode
+
+    async def _store(self, items: Dict[str, np.ndarray]):
+        try:
+            await self.store.put(self.version, items)
+        except Exception:
+            pass
+
+    async def _infer(self, batch):
+        try:
+            found = await self._lookup([k for k, _, _, keep in batch if keep])
+            todo = [b for b in batch if b[0] not in found]
+            EMBED_CACHE.labels(result="store").inc(len(batch) - len(todo)); EMBED_CACHE.labels(result="miss").inc(len(todo))
+            fresh = {}
+            if todo:
+                vecs = await self._loop.run_in_executor(self._pool, self._encode, [t for _, t, _, _ in todo])
+                found.update((k, v) for (k, _, _, _), v in zip(todo, vecs))
+                fresh = {k: v for (k, _, _, keep), v in zip(todo, vecs) if keep}
+            for k, _, fut, _ in batch:
+                v = found[k]; self._remember(k, v)
+                if not fut.done(): fut.set_result(v)
+            if fresh and self.store is not None: await self._store(fresh)   # callers already have their vectors
+        except Exception as e:
+            for _, _, fut, _ in batch:
+                if not fut.done(): fut.set_exception(e)
+        finally:
+            for k, _, _, _ in batch: self._inflight.pop(k, None)
+            self._slots.release()
+
+    async def embed_many(self, texts: List[str], store: bool = True) -> np.ndarray:
+        if not texts: return np.zeros((0, self.dim), dtype=np.float32)
+        self._start()
+        parts = []
+        for t in texts:
+            k = self.key(t)
+            v = self._cached(k)
+            if v is None:
+                v = self._inflight.get(k)
+                if v is None:
+                    v = self._inflight[k] = self._loop.create_future()
+                    self._queue.put_nowait((k, t, v, store))
+            parts.append(v)
+        pending = [p for p in parts if isinstance(p, asyncio.Future)]
+        # futures are shared with concurrent callers of the same text: shield them so one caller's
+        # cancellation (client hang-up, timeout) does not cancel the vector the others are waiting on
+        if pending: await asyncio.gather(*(asyncio.shield(p) for p in pending))
+        return np.stack([p.result() if isinstance(p, asyncio.Future) else p for p in parts])
+
+    async def embed(self, text: str, store: bool = True) -> np.ndarray:
+        return (await self.embed_many([text], store))[0]
+
+    def embed_sync(self, texts: List[str]) -> np.ndarray:
+        """Cache-aware encode for synchronous callers (threads, tools); no cross-request batching."""
+        keys = [self.key(t) for t in texts]
+        out = [self._cached(k) for k in keys]
+        miss = [i for i, v in enumerate(out) if v is None]
+        EMBED_CACHE.labels(result="miss").inc(len(miss))
+        if miss:
+            for i, v in zip(miss, self._encode([texts[i] for i in miss])):
+                self._remember(keys[i], v); out[i] = v
+        return np.stack(out) if out else np.zeros((0, self.dim), dtype=np.float32)
+
+    def info(self) -> dict:
+        return {"backend": self.model.name, "version": self.version, "dim": self.dim, "max_batch": self.max_batch,
+                "wait_ms": self.wait * 1000, "workers": self._workers, "cache_entries": len(self._cache), "cache_size": self.cache_size,
+                "store": self.store is not None, "hit_ratio": round(_hit_ratio(), 4)}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,116 @@
+import os, glob, hashlib
+from functools import lru_cache
+from typing import Iterable, List
+import numpy as np
+from .tokenizer import tokenize
+
+# Hashing embedder: token -> md5 bucket counts, L2-normalised. Batch-first; embed() is a 1-row batch.
+# Embedder backends (EMBED_BACKEND): "hash" (above) or "onnx", a sentence-transformer exported to ONNX
+# (model.onnx + tokenizer.json in EMBED_MODEL_DIR, see tools/fetch_embed_model.py) run on the ONNX Runtime CPU provider.
+EMBED_DIM = int(os.getenv("EMBED_DIM","384"))
+EMBED_TOKEN_CACHE = int(os.getenv("EMBED_TOKEN_CACHE","65536"))
+EMBED_BACKEND = os.getenv("EMBED_BACKEND","hash")
+EMBED_MODEL_DIR = os.getenv("EMBED_MODEL_DIR","models/paraphrase-multilingual-MiniLM-L12-v2")
+EMBED_MAX_TOKENS = int(os.getenv("EMBED_MAX_TOKENS","256"))
+EMBED_ONNX_THREADS = int(os.getenv("EMBED_ONNX_THREADS", str(min(4, os.cpu_count() or 1))))
+EMBED_ONNX_BATCH = int(os.getenv("EMBED_ONNX_BATCH","32"))   # rows per session.run, length-sorted to cut padding
+
+@lru_cache(maxsize=EMBED_TOKEN_CACHE)
+def _token_hash(tok: str) -> int:
+    # Same value as int(md5(tok).hexdigest(), 16) without the hex round-trip.
+    return int.from_bytes(hashlib.md5(tok.encode()).digest(), "big")
+
+def _buckets(tokens: List[str], dim: int) -> List[int]:
+    return [_token_hash(t) % dim for t in tokens]
+
+def embed_batch(texts: Iterable[str], dim: int = EMBED_DIM) -> np.ndarray:
+    texts = list(texts)
+    n = len(texts)
+    if n == 0: return np.zeros((0, dim), dtype=np.float32)
+    rows, cols = [], []
+    for i, t in enumerate(texts):
+        b = _buckets(tokenize(t), dim)
+        rows.extend([i]*len(b)); cols.extend(b)
+    flat = np.asarray(rows, dtype=np.int64)*dim + np.asarray(cols, dtype=np.int64)
+    mat = np.bincount(flat, minlength=n*dim).astype(np.float32).reshape(n, dim)
+    mat /= (np.linalg.norm(mat, axis=1, keepdims=True) + 1e-9)
+    return mat
+
+def embed(text: str, dim: int = EMBED_DIM) -> np.ndarray:
+    return embed_batch([text], dim)[0]
+
+def to_pgvector(vec) -> str:
+    # pgvector text literal; bind as %s::vector
+    return "[" + ",".join(f"{x:.7g}" for x in np.asarray(vec, dtype=np.float32).tolist()) + "]"
+
+def cache_info():
+    return _token_hash.cache_info()
+
+def _unit(m: np.ndarray) -> np.ndarray:
+    return (m / (np.linalg.norm(m, axis=1, keepdims=True) + 1e-9)).astype(np.float32)
+
+class HashEmbedder:
+    name = "hash"
+    def __init__(self, dim: int = EMBED_DIM):
+        self.dim, self.version = dim, f"hash-md5-{dim}"
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return embed_batch(texts, self.dim)
+
+class OnnxEmbedder:
+    """Mean-pooled sentence embeddings from an ONNX encoder; encode() is thread-safe and releases the GIL in ORT."""
+    name = "onnx"
+    def __init__(self, model_dir: str = EMBED_MODEL_DIR, threads: int = EMBED_ONNX_THREADS,
+                 max_tokens: int = EMBED_MAX_TOKENS, batch: int = EMBED_ONNX_BATCH):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        found = sorted(glob.glob(os.path.join(model_dir, "model.onnx")) + glob.glob(os.path.join(model_dir, "onnx", "model.onnx")))
+        if not found: raise FileNotFoundError(f"no model.onnx under {model_dir} (run tools/fetch_embed_model.py)")
+        so = ort.SessionOptions()
+        so.intra_op_num_threads, so.inter_op_num_threads = threads, 1
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.sess = ort.InferenceSession(found[0], so, providers=["CPUExecutionProvider"])
+        self.inputs = {i.name for i in self.sess.get_inputs()}
+        outputs = [o.name for o in self.sess.get_outputs()]
+        self.output = "sentence_embedding" if "sentence_embedding" in outputs else outputs[0]
+        self.tok = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tok.enable_truncation(max_tokens); self.tok.no_padding()
+        self.batch = max(1, batch)
+        h = hashlib.sha256()
+        with open(found[0], "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""): h.update(block)
+        self.version = f"onnx-{os.path.basename(os.path.normpath(model_dir))}-{h.hexdigest()[:12]}"
+        self.dim = int(self.encode(["probe"]).shape[1])
+
+    def _run(self, ids: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        feed = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self.inputs: feed["token_type_ids"] = np.zeros_like(ids)
+        out = self.sess.run([self.output], feed)[0]
+        if out.ndim == 2: return out
+        m = mask[..., None].astype(np.float32)
+        return (out * m).sum(1) / np.maximum(m.sum(1), 1e-9)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts: return np.zeros((0, getattr(self, "dim", 0)), dtype=np.float32)
+        enc = self.tok.encode_batch(texts)
+        lens = np.array([len(e.ids) for e in enc])
+        order = np.argsort(lens, kind="stable")
+        out = None
+        for s in range(0, len(order), self.batch):
+            idx = order[s:s + self.batch]
+            ids = np.zeros((len(idx), max(1, lens[idx].max())), dtype=np.int64); mask = np.zeros_like(ids)
+            for r, i in enumerate(idx):
+                ids[r, :lens[i]] = enc[i].ids; mask[r, :lens[i]] = 1
+            v = self._run(ids, mask)
+            if out is None: out = np.empty((len(texts), v.shape[1]), dtype=np.float32)
+            out[idx] = v
+        return _unit(out)
+
+def load_embedder(backend: str = EMBED_BACKEND, dim: int = EMBED_DIM):
+    if backend == "hash": return HashEmbedder(dim)
+    if backend == "onnx":
+        model = OnnxEmbedder()
+        if model.dim != dim: raise ValueError(f"{model.version} embeds to {model.dim} dims but EMBED_DIM={dim}")
+        return model
+    raise ValueError(f"unknown EMBED_BACKEND {backend!r}")
@@ -0,0 +1,87 @@
+import os, asyncio
+from typing import Dict, List, Optional, Set
+import httpx
+from prometheus_client import Counter, Gauge
+
+try:
+    import h2  # noqa: F401  -- installed by httpx[http2]; without it clients stay on HTTP/1.1 keep-alive
+    _H2 = True
+except ImportError:
+    _H2 = False
+
+# One long-lived AsyncClient per upstream provider, so TLS handshakes and keep-alive connections are
+# reused across chat messages. Every knob can be overridden per upstream: HTTP_READ_TIMEOUT_GEMINI=90.
+HTTP2 = os.getenv("HTTP2","1") == "1" and _H2
+DEFAULTS = {"connect": 5.0, "read": 60.0, "write": 30.0, "pool": 10.0,
+            "max_connections": 50, "max_keepalive": 20, "keepalive_expiry": 30.0}
+UPSTREAMS: Dict[str, dict] = {
+    "openai": {}, "anthropic": {}, "gemini": {}, "vllm": {},
+    "local_llm": {"http2": False}, "cloud_relay": {"read": 120.0},
+}
+
+HTTP_REQS = Counter("sima_http_client_requests_total","Upstream HTTP requests sent",["upstream"])
+HTTP_CONNS = Counter("sima_http_client_connections_total","New upstream connections opened (TCP connect)",["upstream"])
+HTTP_REUSE = Gauge("sima_http_client_reuse_ratio","Share of upstream requests served on an already-open connection",["upstream"])
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_stats: Dict[str, list] = {}
+_closing: Set[asyncio.Future] = set()   # clients left behind by a loop change, still being closed
+
+def _setting(name: str, key: str):
+    v = os.getenv(f"HTTP_{key.upper()}_{name.upper()}") or os.getenv(f"HTTP_{key.upper()}")
+    d = UPSTREAMS.get(name, {}).get(key, DEFAULTS[key])
+    return type(d)(v) if v else d
+
+def _hooks(name: str):
+    st = _stats.setdefault(name, [0, 0])   # [requests, new connections]
+    async def trace(event: str, info):
+        if event == "connection.connect_tcp.complete":
+            st[1] += 1; HTTP_CONNS.labels(upstream=name).inc()
+    async def on_request(request: httpx.Request):
+        st[0] += 1; HTTP_REQS.labels(upstream=name).inc()
+        request.extensions["trace"] = trace
+    HTTP_REUSE.labels(upstream=name).set_function(lambda: max(0.0, 1.0 - st[1] / st[0]) if st[0] else 0.0)
+    return {"request": [on_request]}
+
+def _build(name: str) -> httpx.AsyncClient:
+    timeout = httpx.Timeout(connect=_setting(name, "connect"), read=_setting(name, "read"),
+                            write=_setting(name, "write"), pool=_setting(name, "pool"))
+    limits = httpx.Limits(max_connections=_setting(name, "max_connections"),
+                          max_keepalive_connections=_setting(name, "max_keepalive"),
+                          keepalive_expiry=_setting(name, "keepalive_expiry"))
+    return httpx.AsyncClient(http2=HTTP2 and UPSTREAMS.get(name, {}).get("http2", True),
+                             timeout=timeout, limits=limits, event_hooks=_hooks(name))
+
+async def _aclose(cs: List[httpx.AsyncClient]):
+    await asyncio.gather(*(c.aclose() for c in cs), return_exceptions=True)
+
+def _retire(cs: List[httpx.AsyncClient], old: Optional[asyncio.AbstractEventLoop]):
+    """Close clients of a previous loop: on that loop while it still runs (it owns their sockets), else here,
+    which still drops their pools when the old loop is already closed (asyncio.run, tests)."""
+    if not cs: return
+    if old is not None and old.is_running() and not old.is_closed():
+        asyncio.run_coroutine_threadsafe(_aclose(cs), old)
+        return
+    t = asyncio.ensure_future(_aclose(cs))
+    _closing.add(t); t.add_done_callback(_closing.discard)
+
+def http_client(name: str) -> httpx.AsyncClient:
+    global _loop
+    loop = asyncio.get_running_loop()
+    if loop is not _loop:   # connections are bound to the loop that opened them
+        cs = list(_clients.values()); _clients.clear()
+        _retire(cs, _loop); _loop = loop
+    c = _clients.get(name)
+    if c is None or c.is_closed:
+        c = _clients[name] = _build(name)
+    return c
+
+async def open_clients(*names: str):
+    for n in names or UPSTREAMS: http_client(n)
+
+async def close_clients():
+    global _loop
+    cs = list(_clients.values()); _clients.clear(); _loop = None
+    await _aclose(cs)
+    await asyncio.gather(*[t for t in _closing if t.get_loop() is asyncio.get_running_loop()], return_exceptions=True)
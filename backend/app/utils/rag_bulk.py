@@ -0,0 +1,46 @@
+import os, asyncio
+from typing import Iterable, Tuple
+from .embedder import EMBED_DIM, embed_batch
+
+# Bulk RAG load: embed in batches off the event loop, COPY (binary) into a temp staging
+# table, then one INSERT ... ON CONFLICT merge into rag_docs. One transaction, one round of WAL;
+# unchanged rows are skipped by the merge's WHERE, so re-ingesting the same corpus writes nothing.
+RAG_CHUNK = int(os.getenv("RAG_CHUNK","1100"))
+RAG_BULK_BATCH = int(os.getenv("RAG_BULK_BATCH","256"))
+
+def chunk_text(text: str, size: int = RAG_CHUNK):
+    return [text[i:i+size] for i in range(0, len(text), size)]
+
+def chunk_docs(docs: Iterable[dict], size: int = RAG_CHUNK):
+    # ids follow tools/ingest_rag.py ("<title>-<n>", 1-based) so bulk and per-chunk uploads overwrite each other
+    for d in docs:
+        base = d.get("id") or d["title"]
+        for i, part in enumerate(chunk_text(d.get("content") or "", size), 1):
+            yield (f"{base}-{i}", d["title"], part)
+
+async def bulk_load(conn, rows: Iterable[Tuple[str,str,str]], dim: int = EMBED_DIM, batch: int = RAG_BULK_BATCH, encode=None):
+    """Stage (id, title, content) rows with their embeddings and merge into rag_docs; returns (staged, merged).
+    `encode` is an async texts -> vectors callable (e.g. EmbedService.embed_many); default is the hash embedder."""
+    staged = 0
+    async with conn.cursor() as cur:
+        await cur.execute("CREATE TEMP TABLE IF NOT EXISTS rag_stage(id TEXT, title TEXT, content TEXT, embedding REAL[]) ON COMMIT DROP;")
+        async with cur.copy("COPY rag_stage (id, title, content, embedding) FROM STDIN (FORMAT BINARY)") as cp:
+            cp.set_types(["text","text","text","real[]"])
+            buf = []
+            async def flush():
+                texts = [r[2] for r in buf]
+                vecs = await encode(texts) if encode else await asyncio.to_thread(embed_batch, texts, dim)
+                for (rid, title, content), v in zip(buf, vecs):
+                    await cp.write_row((rid, title, content, v.tolist()))
+            for r in rows:
+                buf.append(r)
+                if len(buf) >= batch:
+                    await flush(); staged += len(buf); buf = []
+            if buf:
+                await flush(); staged += len(buf)
+        await cur.execute(f"""INSERT INTO rag_docs (id, title, content, embedding)
+            SELECT DISTINCT ON (id) id, title, content, embedding::vector({dim}) FROM rag_stage ORDER BY id
+            ON CONFLICT (id) DO UPDATE SET title=EXCLUDED.title, content=EXCLUDED.content, embedding=EXCLUDED.embedding
+            WHERE (rag_docs.title, rag_docs.content, rag_docs.embedding) IS DISTINCT FROM (EXCLUDED.title, EXCLUDED.content, EXCLUDED.embedding);""")
+        merged = cur.rowcount
+    return staged, merged
@@ -0,0 +1,120 @@
+import os, math, time, asyncio, ipaddress
+from collections import OrderedDict
+from typing import Optional
+from fastapi import HTTPException, Request
+from prometheus_client import Counter, Histogram
+
+# Token buckets for upstream LLM providers and for callers (verified user or client IP). A request
+# that finds the bucket empty queues for up to max_wait seconds instead of failing immediately;
+# beyond that it gets 429 with Retry-After. Buckets are only touched between awaits, so no lock.
+def parse_rate(spec: str) -> float:
+    """'15/min' -> tokens per second (also /s, /sec, /h, /hour, /day)."""
+    n, _, unit = spec.partition("/")
+    per = {"": 1, "s": 1, "sec": 1, "m": 60, "min": 60, "h": 3600, "hour": 3600, "d": 86400, "day": 86400}[unit.strip().lower()]
+    return float(n) / per
+
+RATE_USER = parse_rate(os.getenv("RATE_USER","30/min"))
+RATE_USER_BURST = float(os.getenv("RATE_USER_BURST","10"))
+RATE_USER_MAX_WAIT = float(os.getenv("RATE_USER_MAX_WAIT","2"))
+RATE_PROVIDER_MAX_WAIT = float(os.getenv("RATE_PROVIDER_MAX_WAIT","10"))
+RATE_MAX_KEYS = int(os.getenv("RATE_MAX_KEYS","10000"))
+# reverse proxies (IPs or CIDRs, comma-separated) whose X-Forwarded-For is believed; empty = use the peer address
+RATE_TRUSTED_PROXIES = os.getenv("RATE_TRUSTED_PROXIES","")
+# provider budgets: RATE_PROVIDER_<NAME>=rate, RATE_PROVIDER_<NAME>_BURST=n (Gemini free tier is 15 requests/min)
+PROVIDER_DEFAULTS = {"gemini": ("15/min", 5), "openai": ("500/min", 20), "anthropic": ("50/min", 10), "vllm": ("600/min", 50)}
+
+RATE_ADMITTED = Counter("sima_ratelimit_admitted_total","Requests admitted by a rate limiter",["scope"])
+RATE_QUEUED = Counter("sima_ratelimit_queued_total","Admitted requests that had to wait for a token",["scope"])
+RATE_THROTTLED = Counter("sima_ratelimit_throttled_total","Requests rejected with 429",["scope"])
+RATE_WAIT = Histogram("sima_ratelimit_wait_seconds","Time spent queued for a token",["scope"], buckets=[0.01,0.05,0.1,0.25,0.5,1,2,5,10,30])
+
+class RateLimited(Exception):
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"{scope} rate limit exceeded, retry in {retry_after:.1f}s")
+        self.scope, self.retry_after = scope, retry_after
+
+    def http(self) -> HTTPException:
+        return HTTPException(429, f"rate limit exceeded ({self.scope})", headers={"Retry-After": str(max(1, math.ceil(self.retry_after)))})
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate, self.burst = rate, max(1.0, burst)
+        self.tokens, self.t = self.burst, time.monotonic()
+
+    def reserve(self, max_wait: float):
+        """Take a token now or in the future. Returns (ok, wait): wait to sleep if ok, else time until a token frees up."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate); self.t = now
+        wait = (1.0 - self.tokens) / self.rate if self.tokens < 1.0 else 0.0
+        if wait > max_wait: return False, wait
+        self.tokens -= 1.0   # may go negative: later callers queue behind this reservation
+        return True, wait
+
+class RateLimiter:
+    def __init__(self, scope: str, rate: float, burst: float, max_wait: float, max_keys: int = RATE_MAX_KEYS):
+        self.scope, self.rate, self.burst, self.max_wait, self.max_keys = scope, rate, burst, max_wait, max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def bucket(self, key: str) -> TokenBucket:
+        b = self._buckets.get(key)
+        if b is None:
+            b = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_keys: self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        return b
+
+    async def acquire(self, key: str = "", max_wait: Optional[float] = None):
+        ok, wait = self.bucket(key).reserve(self.max_wait if max_wait is None else max_wait)
+        if not ok:
+            RATE_THROTTLED.labels(scope=self.scope).inc()
+            raise RateLimited(self.scope, wait)
+        RATE_ADMITTED.labels(scope=self.scope).inc(); RATE_WAIT.labels(scope=self.scope).observe(wait)
+        if wait > 0:
+            RATE_QUEUED.labels(scope=self.scope).inc()
+            await asyncio.sleep(wait)
+
+_providers = {}
+
+def provider_limiter(name: str) -> RateLimiter:
+    lim = _providers.get(name)
+    if lim is None:
+        rate, burst = PROVIDER_DEFAULTS.get(name, ("60/min", 10))
+        env = f"RATE_PROVIDER_{name.upper()}"
+        lim = _providers[name] = RateLimiter(name, parse_rate(os.getenv(env, rate)), float(os.getenv(f"{env}_BURST", burst)), RATE_PROVIDER_MAX_WAIT)
+    return lim
+
+async def provider_admit(name: str, max_wait: Optional[float] = None) -> bool:
+    """Router hook: take a token from the provider budget, False if it would wait longer than max_wait."""
+    try: await provider_limiter(name).acquire(max_wait=max_wait)
+    except RateLimited: return False
+    return True
+
+user_limiter = RateLimiter("user", RATE_USER, RATE_USER_BURST, RATE_USER_MAX_WAIT)
+
+def parse_networks(spec: str) -> list:
+    return [ipaddress.ip_network(x.strip(), strict=False) for x in spec.split(",") if x.strip()]
+
+TRUSTED_PROXIES = parse_networks(RATE_TRUSTED_PROXIES)
+
+def _trusted(addr: str, proxies) -> bool:
+    try: ip = ipaddress.ip_address(addr)
+    except ValueError: return False
+    return any(ip in net for net in proxies)
+
+def client_ip(request: Request, proxies=None) -> str:
+    """Peer address; behind trusted proxies, the right-most X-Forwarded-For hop that is not one of them
+    (hops to its left were written by the client and can be anything)."""
+    proxies = TRUSTED_PROXIES if proxies is None else proxies
+    peer = request.client.host if request.client else "unknown"
+    if not proxies or not _trusted(peer, proxies): return peer
+    hops = [h.strip() for v in request.headers.getlist("x-forwarded-for") for h in v.split(",") if h.strip()]
+    for hop in reversed(hops):
+        if not _trusted(hop, proxies): return hop
+    return hops[0] if hops else peer
+
+def client_key(request: Request, proxies=None) -> str:
+    """Bucket key: the principal an auth dependency verified and stored on request.state.principal,
+    otherwise the client IP. Raw Authorization headers are not trusted - any string would get a fresh bucket."""
+    principal = getattr(request.state, "principal", None)
+    if principal: return f"u:{principal}"
+    return "ip:" + client_ip(request, proxies)
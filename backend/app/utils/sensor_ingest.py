@@ -0,0 +1,111 @@
+import os, time, queue, logging, threading
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+import psycopg
+from prometheus_client import Counter, Gauge, Histogram
+
+# Batched sensor ingest: the MQTT callback only parses and enqueues; one writer thread drains the bounded
+# queue and COPYs micro-batches of up to INGEST_BATCH_ROWS rows or INGEST_FLUSH_MS of arrivals over a
+# single long-lived connection. When the queue is full put() blocks the paho network thread for up to
+# INGEST_PUT_TIMEOUT_MS (the broker sees a slow reader and queues/throttles), then drops and counts.
+INGEST_BATCH_ROWS = int(os.getenv("INGEST_BATCH_ROWS","5000"))
+INGEST_FLUSH_MS = float(os.getenv("INGEST_FLUSH_MS","200"))
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX","100000"))
+INGEST_PUT_TIMEOUT_MS = float(os.getenv("INGEST_PUT_TIMEOUT_MS","2000"))
+INGEST_RETRIES = int(os.getenv("INGEST_RETRIES","5"))
+
+INGEST_ROWS = Counter("sima_ingest_rows_total","Sensor rows written",["table"])
+INGEST_DROPPED = Counter("sima_ingest_dropped_total","Sensor messages not written",["table","reason"])   # parse | full | db
+INGEST_BATCH = Histogram("sima_ingest_batch_rows","Rows per COPY",["table"], buckets=[1,10,100,500,1000,2500,5000,10000,25000])
+INGEST_FLUSH = Histogram("sima_ingest_flush_seconds","COPY + commit time",["table"], buckets=[0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5])
+INGEST_LAG = Gauge("sima_ingest_lag_seconds","Receive-to-commit time of the oldest row in the last batch",["table"])
+INGEST_QUEUE = Gauge("sima_ingest_queue_rows","Rows buffered, not yet written",["table"])
+
+log = logging.getLogger("sima.ingest")
+
+class BatchWriter:
+    def __init__(self, dsn: str, table: str, columns: Sequence[str], batch_rows: int = INGEST_BATCH_ROWS,
+                 flush_ms: float = INGEST_FLUSH_MS, queue_max: int = INGEST_QUEUE_MAX,
+                 put_timeout_ms: float = INGEST_PUT_TIMEOUT_MS, connect: Optional[Callable] = None):
+        self.dsn, self.table = dsn, table
+        self.copy_sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+        self.batch_rows, self.flush_s, self.put_timeout = max(1, batch_rows), flush_ms / 1000.0, put_timeout_ms / 1000.0
+        self.q: "queue.Queue[Tuple[float, tuple]]" = queue.Queue(maxsize=queue_max)
+        self.in_tx: List[Callable[[Any, List[tuple]], None]] = []   # called with the COPY cursor before commit; errors retry the batch
+        self.on_flush: List[Callable[[List[tuple]], None]] = []   # called with each committed batch
+        self._connect = connect or (lambda: psycopg.connect(dsn))
+        self._conn = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        INGEST_QUEUE.labels(table=table).set_function(self.q.qsize)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"ingest-{self.table}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10.0):
+        """Stop accepting, flush what is buffered, close the connection."""
+        self._stop.set()
+        if self._thread is not None: self._thread.join(timeout)
+        if self._conn is not None:
+            try: self._conn.close()
+            except Exception: pass
+
+    def put(self, row: tuple) -> bool:
+        try:
+            self.q.put((time.time(), row), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            INGEST_DROPPED.labels(table=self.table, reason="full").inc()
+            return False
+
+    def drop(self, reason: str = "parse", n: int = 1):
+        INGEST_DROPPED.labels(table=self.table, reason=reason).inc(n)
+
+    def _take(self) -> List[Tuple[float, tuple]]:
+        try: batch = [self.q.get(timeout=0.5)]
+        except queue.Empty: return []
+        deadline = time.monotonic() + self.flush_s
+        while len(batch) < self.batch_rows:
+            try:
+                batch.append(self.q.get_nowait()); continue
+            except queue.Empty:
+                pass
+            left = deadline - time.monotonic()
+            if left <= 0: break
+            try: batch.append(self.q.get(timeout=left))
+            except queue.Empty: break
+        return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and self.q.empty()):
+            batch = self._take()
+            if batch: self.flush([r for _, r in batch], batch[0][0])
+
+    def flush(self, rows: List[tuple], oldest: Optional[float] = None) -> bool:
+        for attempt in range(INGEST_RETRIES):
+            try:
+                if self._conn is None or self._conn.closed: self._conn = self._connect()
+                s = time.perf_counter()
+                with self._conn.cursor() as cur:
+                    with cur.copy(self.copy_sql) as cp:
+                        for r in rows: cp.write_row(r)
+                    for fn in self.in_tx: fn(cur, rows)
+                self._conn.commit()
+                INGEST_FLUSH.labels(table=self.table).observe(time.perf_counter() - s)
+                INGEST_BATCH.labels(table=self.table).observe(len(rows)); INGEST_ROWS.labels(table=self.table).inc(len(rows))
+                if oldest is not None: INGEST_LAG.labels(table=self.table).set(time.time() - oldest)
+                for cb in self.on_flush:
+                    try: cb(rows)
+                    except Exception: log.exception("ingest on_flush hook failed")
+                return True
+            except Exception as e:
+                log.warning("COPY into %s failed (attempt %d): %s", self.table, attempt + 1, e)
+                try: self._conn.close()
+                except Exception: pass
+                self._conn = None
+                if self._stop.is_set(): break
+                time.sleep(min(0.2 * 2 ** attempt, 5.0))
+        INGEST_DROPPED.labels(table=self.table, reason="db").inc(len(rows))
+        return False
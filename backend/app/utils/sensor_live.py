@@ -0,0 +1,171 @@
+import os, json, uuid, asyncio, logging, datetime, threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from prometheus_client import Counter, Gauge
+
+# Live sensor values: the MQTT callback publishes every parsed reading into a LiveHub, which keeps the
+# latest value per (project, type) in memory and fans it out to stream subscribers. Each subscriber has a
+# small conflating queue keyed by sensor type: a newer value replaces the pending one (a slow dashboard
+# only ever sees fresh values) and past LIVE_QUEUE_MAX distinct keys the oldest pending value is dropped.
+LIVE_QUEUE_MAX = int(os.getenv("LIVE_QUEUE_MAX","256"))
+LIVE_MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS","1000"))
+LIVE_MAX_PROJECTS = int(os.getenv("LIVE_MAX_PROJECTS","10000"))
+LIVE_HEARTBEAT_S = float(os.getenv("LIVE_HEARTBEAT_S","15"))
+LIVE_PORT = int(os.getenv("LIVE_PORT","9110"))
+
+LIVE_SUBS = Gauge("sima_live_subscribers","Open sensor stream subscriptions")
+LIVE_SENT = Counter("sima_live_sent_total","Sensor values delivered to stream subscribers")
+LIVE_DROPPED = Counter("sima_live_dropped_total","Sensor values not delivered",["reason"])   # stale | full
+
+log = logging.getLogger("sima.live")
+
+class HubFull(Exception):
+    pass
+
+class Subscriber:
+    def __init__(self, pid: str, queue_max: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.pid, self.queue_max, self.loop = pid, queue_max, loop
+        self._pending: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._aready = asyncio.Event() if loop is not None else None
+
+    def offer(self, kind: str, item: dict):
+        with self._lock:
+            if kind in self._pending:
+                LIVE_DROPPED.labels(reason="stale").inc(); del self._pending[kind]
+            elif len(self._pending) >= self.queue_max:
+                self._pending.popitem(last=False); LIVE_DROPPED.labels(reason="full").inc()
+            self._pending[kind] = item
+        self._ready.set()
+        if self.loop is not None:
+            try: self.loop.call_soon_threadsafe(self._aready.set)
+            except RuntimeError: pass   # loop already closed (shutdown)
+
+    def drain(self) -> List[dict]:
+        with self._lock:
+            items = list(self._pending.values()); self._pending.clear()
+            self._ready.clear()
+            if self._aready is not None: self._aready.clear()
+        LIVE_SENT.inc(len(items))
+        return items
+
+    def get(self, timeout: float) -> List[dict]:
+        """Blocking: pending values, or [] after `timeout` seconds without any."""
+        self._ready.wait(timeout)
+        return self.drain()
+
+    async def aget(self, timeout: float) -> List[dict]:
+        try: await asyncio.wait_for(self._aready.wait(), timeout)
+        except asyncio.TimeoutError: pass
+        return self.drain()
+
+class LiveHub:
+    def __init__(self, queue_max: int = LIVE_QUEUE_MAX, max_subs: int = LIVE_MAX_SUBSCRIBERS, max_projects: int = LIVE_MAX_PROJECTS):
+        self.queue_max, self.max_subs, self.max_projects = queue_max, max_subs, max_projects
+        self._latest: "OrderedDict[str, Dict[str, Tuple[datetime.datetime, dict]]]" = OrderedDict()
+        self._subs: Dict[str, List[Subscriber]] = {}
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def publish(self, pid: str, kind: str, val: float, ts: datetime.datetime):
+        """Called from the MQTT thread for every reading; cheap when nobody watches the project.
+        A reading older than the one held (device-timestamped batches arrive out of order) is ignored."""
+        item = {"type": kind, "val": val, "ts": ts.isoformat()}
+        with self._lock:
+            cur = self._latest.get(pid)
+            if cur is None:
+                cur = self._latest[pid] = {}
+                if len(self._latest) > self.max_projects: self._latest.popitem(last=False)
+            else:
+                self._latest.move_to_end(pid)
+                held = cur.get(kind)
+                if held is not None and held[0] > ts: return
+            cur[kind] = (ts, item)
+            subs = self._subs.get(pid)
+            subs = list(subs) if subs else None
+        if subs:
+            for s in subs: s.offer(kind, item)
+
+    def latest(self, pid: str) -> List[dict]:
+        with self._lock:
+            return sorted((item for _, item in (self._latest.get(pid) or {}).values()), key=lambda x: x["type"])
+
+    def subscribe(self, pid: str, loop: Optional[asyncio.AbstractEventLoop] = None) -> Subscriber:
+        """New subscriber primed with the current values; pass the running loop for aget()."""
+        sub = Subscriber(pid, self.queue_max, loop)
+        with self._lock:
+            if self._count >= self.max_subs: raise HubFull(f"{self._count} live subscribers")
+            self._subs.setdefault(pid, []).append(sub); self._count += 1
+            snapshot = [item for _, item in (self._latest.get(pid) or {}).values()]
+        LIVE_SUBS.inc()
+        for item in snapshot: sub.offer(item["type"], item)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            subs = self._subs.get(sub.pid) or []
+            if sub not in subs: return
+            subs.remove(sub); self._count -= 1
+            if not subs: self._subs.pop(sub.pid, None)
+        LIVE_SUBS.dec()
+
+def sse_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+async def stream(hub: LiveHub, sub: Subscriber, heartbeat: float = LIVE_HEARTBEAT_S):
+    """Async SSE body for a subscribe(pid, loop) subscriber: `values` events with the changed readings,
+    a comment line as keep-alive; unsubscribes when the client goes away."""
+    try:
+        while True:
+            items = await sub.aget(heartbeat)
+            yield sse_event("values", items) if items else b": keep-alive\n\n"
+    finally:
+        hub.unsubscribe(sub)
+
+def serve(hub: LiveHub, port: int = LIVE_PORT, heartbeat: float = LIVE_HEARTBEAT_S):
+    """Threaded stdlib HTTP server for processes without an ASGI app (the pack 2 ingestor):
+    GET /v1/sensor/<pid>/stream (SSE) and /v1/sensor/<pid>/latest (JSON)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *a): pass
+
+        def _head(self, code: int, ctype: str, length: Optional[int] = None):
+            self.send_response(code)
+            self.send_header("Content-Type", ctype); self.send_header("Cache-Control", "no-cache")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            if length is not None: self.send_header("Content-Length", str(length))
+            else: self.send_header("Connection", "close")
+            self.end_headers()
+
+        def _json(self, code: int, data):
+            body = json.dumps(data).encode("utf-8")
+            self._head(code, "application/json", len(body)); self.wfile.write(body)
+
+        def do_GET(self):
+            parts = self.path.split("?")[0].strip("/").split("/")
+            if len(parts) != 4 or parts[:2] != ["v1", "sensor"] or parts[3] not in ("stream", "latest"):
+                return self._json(404, {"detail": "not found"})
+            try: pid = str(uuid.UUID(parts[2]))
+            except ValueError: return self._json(400, {"detail": "project id must be a UUID"})
+            if parts[3] == "latest": return self._json(200, {"project_id": pid, "data": hub.latest(pid)})
+            try: sub = hub.subscribe(pid)
+            except HubFull as e: return self._json(503, {"detail": str(e)})
+            self.close_connection = True   # body runs until either side hangs up
+            self._head(200, "text/event-stream")
+            try:
+                while True:
+                    items = sub.get(heartbeat)
+                    self.wfile.write(sse_event("values", items) if items else b": keep-alive\n\n"); self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError, OSError):
+                pass
+            finally:
+                hub.unsubscribe(sub)
+
+    srv = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="live-http", daemon=True).start()
+    log.info("live sensor stream on :%d", port)
+    return srv
@@ -0,0 +1,61 @@
+import os, json, time, asyncio, functools
+from typing import AsyncIterator, Iterable, Optional
+from prometheus_client import Histogram
+
+# Token streaming helpers. Generators must only ever await (never time.sleep): a blocking sleep
+# in an async generator stalls the event loop for every connected client.
+SSE_TOKEN_DELAY_MS = float(os.getenv("SSE_TOKEN_DELAY_MS","0"))   # pacing for backends that return the full text
+SSE_FLUSH_MS = float(os.getenv("SSE_FLUSH_MS","30"))               # coalesce tokens arriving within this window
+SSE_FLUSH_CHARS = int(os.getenv("SSE_FLUSH_CHARS","96"))           # ...or until this much text is buffered
+
+LLM_TTFT = Histogram("sima_llm_ttft_seconds","Time from request to first streamed token",["provider"],
+                     buckets=[0.05,0.1,0.25,0.5,0.75,1,1.5,2,3,5,8,13,20])
+
+def sse_pack(event, data): return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+async def paced(tokens: Iterable[str], delay_ms: Optional[float] = None) -> AsyncIterator[str]:
+    delay = (SSE_TOKEN_DELAY_MS if delay_ms is None else delay_ms) / 1000
+    for t in tokens:
+        yield t
+        await asyncio.sleep(delay)   # sleep(0) still hands the loop to other streams between tokens
+
+async def coalesce(tokens: AsyncIterator[str], window_ms: Optional[float] = None, max_chars: Optional[int] = None) -> AsyncIterator[str]:
+    """Merge tokens into one chunk per flush window; a lone token never waits longer than the window."""
+    window = (SSE_FLUSH_MS if window_ms is None else window_ms) / 1000
+    limit = SSE_FLUSH_CHARS if max_chars is None else max_chars
+    if window <= 0:
+        async for t in tokens: yield t
+        return
+    loop = asyncio.get_running_loop(); it = tokens.__aiter__()
+    buf, size, deadline, pending = [], 0, None, None
+    try:
+        while True:
+            if pending is None: pending = asyncio.ensure_future(it.__anext__())
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if done:
+                fut, pending = pending, None
+                try: t = fut.result()
+                except StopAsyncIteration: break
+                if t:
+                    buf.append(t); size += len(t)
+                    if deadline is None: deadline = loop.time() + window
+                if size < limit and (deadline is None or loop.time() < deadline): continue
+            if buf: yield "".join(buf)
+            buf, size, deadline = [], 0, None
+        if buf: yield "".join(buf)
+    finally:
+        if pending is not None: pending.cancel()
+
+def ttft(provider: str):
+    """Decorate a provider's async token generator to record time-to-first-token per provider."""
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrap(*a, **kw):
+            t0 = time.perf_counter(); first = True
+            async for t in fn(*a, **kw):
+                if first and t:
+                    LLM_TTFT.labels(provider=provider).observe(time.perf_counter() - t0); first = False
+                yield t
+        return wrap
+    return deco
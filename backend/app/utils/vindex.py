@@ -0,0 +1,90 @@
+import os, re, time, math
+from typing import Optional
+
+# ANN index management for pgvector tables. The opclass must match the operator the
+# search query orders by (<=> cosine, <#> inner product, <-> L2) or the planner ignores it.
+RAG_INDEX = os.getenv("RAG_INDEX","hnsw")              # hnsw | ivfflat | none
+HNSW_M = int(os.getenv("HNSW_M","16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION","64"))
+IVF_LISTS = int(os.getenv("IVF_LISTS","0"))            # 0 = rows/1000 (min 10), sqrt(rows) above 1M rows
+IVF_MIN_ROWS = int(os.getenv("IVF_MIN_ROWS","1000"))   # ivfflat centroids need data; build only once this many rows exist
+
+OPS = {"<=>": "vector_cosine_ops", "<#>": "vector_ip_ops", "<->": "vector_l2_ops"}
+
+INDEX_STATE = {}   # index name -> {"build_seconds", "built_at"} for builds done by this worker
+
+def index_name(table: str, kind: str = RAG_INDEX) -> str:
+    return f"{table}_embedding_{kind}"
+
+def ivf_lists(rows: int) -> int:
+    if IVF_LISTS: return IVF_LISTS
+    return max(10, int(math.sqrt(rows)) if rows > 1_000_000 else rows // 1000)
+
+async def _rows(cur, table):
+    await cur.execute(f"SELECT count(*) FROM {table};")
+    return (await cur.fetchone())[0]
+
+async def _index_def(cur, name):
+    await cur.execute("SELECT indexdef FROM pg_indexes WHERE indexname=%s;", (name,))
+    row = await cur.fetchone()
+    return row[0] if row else None
+
+async def ensure_index(conn, table: str = "rag_docs", op: str = "<=>", rebuild: bool = False):
+    """Create (or with rebuild=True, recreate) the ANN index for `table`; returns its state or None."""
+    if RAG_INDEX not in ("hnsw","ivfflat"): return None
+    name = index_name(table); ops = OPS[op]
+    async with conn.cursor() as cur:
+        existing = await _index_def(cur, name)
+        if existing and ops not in existing: rebuild = True   # operator changed since the index was built
+        rows = None
+        if RAG_INDEX == "ivfflat":
+            rows = await _rows(cur, table)
+            if rows < IVF_MIN_ROWS and not existing: return None
+            # lists are fixed at build time; rebuild once the table has grown 4x past what they were sized for
+            m = re.search(r"lists\s*=\s*'?(\d+)", existing or "")
+            if m and ivf_lists(rows) >= 4*int(m.group(1)): rebuild = True
+        if existing and not rebuild:
+            return INDEX_STATE.get(name, {"build_seconds": None, "built_at": None})
+        if existing: await cur.execute(f"DROP INDEX IF EXISTS {name};")
+        if RAG_INDEX == "hnsw":
+            ddl = f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING hnsw (embedding {ops}) WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION});"
+        else:
+            ddl = f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING ivfflat (embedding {ops}) WITH (lists = {ivf_lists(rows)});"
+        s = time.perf_counter()
+        await cur.execute(ddl)
+        INDEX_STATE[name] = {"build_seconds": round(time.perf_counter()-s, 3), "built_at": time.time()}
+    return INDEX_STATE[name]
+
+async def set_search_params(cur, ef_search: Optional[int] = None, probes: Optional[int] = None):
+    # transaction-local, so pooled connections don't leak per-request tuning
+    if ef_search: await cur.execute("SELECT set_config('hnsw.ef_search', %s, true);", (str(int(ef_search)),))
+    if probes: await cur.execute("SELECT set_config('ivfflat.probes', %s, true);", (str(int(probes)),))
+
+async def index_report(conn, table: str = "rag_docs", op: str = "<=>", k: int = 10, samples: int = 20,
+                       ef_search: Optional[int] = None, probes: Optional[int] = None):
+    """Index size/build stats plus recall@k of the ANN plan against an exact (index-disabled) scan."""
+    name = index_name(table)
+    async with conn.cursor() as cur:
+        indexdef = await _index_def(cur, name)
+        rows = await _rows(cur, table)
+        size = 0
+        if indexdef:
+            await cur.execute("SELECT pg_relation_size(%s::regclass);", (name,))
+            size = (await cur.fetchone())[0]
+        await cur.execute(f"SELECT embedding::text FROM {table} WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s;", (samples,))
+        queries = [r[0] for r in await cur.fetchall()]
+        sql = f"SELECT id FROM {table} ORDER BY embedding {op} %s::vector LIMIT %s;"
+        hit = total = 0; ann_t = exact_t = 0.0
+        for q in queries:
+            await set_search_params(cur, ef_search, probes)
+            s = time.perf_counter(); await cur.execute(sql, (q, k)); ann = {r[0] for r in await cur.fetchall()}; ann_t += time.perf_counter()-s
+            await cur.execute("SELECT set_config('enable_indexscan', 'off', true);")
+            s = time.perf_counter(); await cur.execute(sql, (q, k)); exact = {r[0] for r in await cur.fetchall()}; exact_t += time.perf_counter()-s
+            await cur.execute("SELECT set_config('enable_indexscan', 'on', true);")
+            hit += len(ann & exact); total += len(exact)
+    st = INDEX_STATE.get(name, {})
+    n = max(1, len(queries))
+    return {"table": table, "index": name if indexdef else None, "indexdef": indexdef, "rows": rows,
+            "size_bytes": size, "build_seconds": st.get("build_seconds"), "built_at": st.get("built_at"),
+            "k": k, "samples": len(queries), "recall_at_k": round(hit/total, 4) if total else None,
+            "ann_ms": round(1000*ann_t/n, 3), "exact_ms": round(1000*exact_t/n, 3)}
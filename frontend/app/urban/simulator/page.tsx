@@ -8,7 +8,18 @@ export default function Simulator(){
     const r = await fetch(`${API}/v1/iot/latest/${pid}`);
     setIot(await r.json());
   };
+  const [live, setLive] = useState<Record<string, any>>({});
   useEffect(()=>{ load(); },[]);
+  useEffect(()=>{
+    // pushed by the backend's MQTT loop; no polling
+    setLive({});
+    const es = new EventSource(`${API}/v1/sensor/${pid}/stream`);
+    es.addEventListener('values', e=>{
+      const items = JSON.parse((e as MessageEvent).data);
+      setLive(prev=>({...prev, ...Object.fromEntries(items.map((r:any)=>[r.type, r]))}));
+    });
+    return ()=>es.close();
+  },[pid]);
   return (<section className="grid gap-3">
     <h2 className="text-xl font-bold">محاكاة حضرية</h2>
     <div className="card">
@@ -16,6 +27,11 @@ export default function Simulator(){
         <input className="border p-2" value={pid} onChange={e=>setPid(e.target.value)} />
         <button className="btn" onClick={load}>تحديث</button>
       </div>
+      <div className="mt-3 flex gap-4">
+        {Object.values(live).map((r:any)=>(
+          <div key={r.type} className="text-sm font-bold">{r.type}: {r.val}</div>
+        ))}
+      </div>
       <div className="mt-3">
         {iot.readings?.map((r:any, i:number)=>(
           <div key={i} className="text-sm">{r.ts} — {r.type}: {r.value}</div>
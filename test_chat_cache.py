@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import os, sys, json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools"))
+from app.utils.chat_cache import ChatCache
+
+def test_lru_ttl_and_normalized_match():
+    c = ChatCache(size=2, ttl=60, sqlite_path="")
+    c.put("ما هي نسبة النوافذ؟", "15-25%")
+    # diacritics, punctuation, case and spacing do not change the key
+    assert c.get("  مَا هي   نسبة النوافذ ") == "15-25%"
+    assert c.get("ما هي نسبة النوافذ؟", ns="other") is None
+    c.put("q2", "a2"); c.get("ما هي نسبة النوافذ"); c.put("q3", "a3")
+    assert c.get("q2") is None and c.get("q3") == "a3"      # least recently used evicted
+    c.ttl = -1; c.put("old", "x")
+    assert c.get("old") is None
+
+def test_sqlite_tier_and_semantic(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    ChatCache(sqlite_path=path).put("Najdi facade window ratio", "keep WWR low")
+    c = ChatCache(sqlite_path=path, sim=0.8)                  # fresh process: served from SQLite
+    assert c.get("najdi facade window ratio") == "keep WWR low"
+    assert c.get("najdi facade window ratio please") == "keep WWR low"   # near-duplicate via similarity
+    assert c.get("hejazi roshan timber") is None
+
+def test_chat_stream_replays_from_cache():
+    from fastapi.testclient import TestClient
+    from mock_llm import make_app, serve
+    from app import main
+    app, expected = make_app(0, 0)
+    base, server = serve(app)
+    key = main.GEMINI_API_KEY
+    try:
+        main.GEMINI_BASE_URL, main.GEMINI_API_KEY = base + "/v1beta", "test"; main.chat_cache.clear()
+        client = TestClient(main.app)
+        def ask(q):
+            body = client.post("/v1/chat/stream", json={"message": q}).text
+            return '"cached": true' in body, "".join(json.loads(ln[6:])["text"] for ln in body.splitlines() if ln.startswith("data: ") and '"text"' in ln)
+        assert ask("معايير الواجهة النجدية؟") == (False, expected)
+        assert ask("معايير  الواجهة النجدية") == (True, expected)
+    finally:
+        main.GEMINI_API_KEY = key
+        server.should_exit = True
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import os, sys, types, importlib
+
+# SIMA_CHAT_PRO_V7's utils (same chunker.py in GPU_PRO) under their own package name
+UTILS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SIMA_CHAT_PRO_V7", "backend", "app", "utils")
+pkg = types.ModuleType("sima_v7_utils"); pkg.__path__ = [UTILS]; sys.modules.setdefault("sima_v7_utils", pkg)
+chunker = importlib.import_module("sima_v7_utils.chunker")
+
+def texts(t, size, overlap): return [t[s:e] for s, e in chunker.chunk_spans(t, size, overlap)]
+
+def test_packs_sentences_with_overlap_and_paragraph_breaks():
+    t = "First sentence here. Second one follows! Third? Fourth sentence is here.\n\nNew paragraph starts. It has two."
+    assert texts(t, 45, 20) == ["First sentence here. Second one follows!", "Second one follows! Third?",
+                                "Third? Fourth sentence is here.", "New paragraph starts. It has two."], "no overlap across the blank line"
+    assert texts(t, 45, 0)[1] == "Third? Fourth sentence is here.", "without overlap each sentence appears once"
+
+def test_arabic_sentence_ends():
+    a = "جملة أولى عن البيت النجدي؟ جملة ثانية عن الروشان؛ جملة ثالثة."
+    assert texts(a, 30, 0) == ["جملة أولى عن البيت النجدي؟", "جملة ثانية عن الروشان؛", "جملة ثالثة."]
+
+def test_long_sentence_split_at_whitespace_and_empty_docs():
+    spans = chunker.chunk_spans("word " * 50, 60, 0)
+    assert all(e - s <= 60 for s, e in spans) and all(("word " * 50)[s:e].endswith("word") for s, e in spans)
+    assert chunker.chunk_spans("", 600, 120) == [] and chunker.chunk_spans("  \n\n ", 600, 120) == []
+    src, start, end = chunker.passage_spans(["", "a. b.", ""])
+    assert src.tolist() == [1] and (start.tolist(), end.tolist()) == ([0], [5])
+
+if __name__ == "__main__":
+    test_packs_sentences_with_overlap_and_paragraph_breaks(); test_arabic_sentence_ends(); test_long_sentence_split_at_whitespace_and_empty_docs()
+    print("ok")
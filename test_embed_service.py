@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import os, sys, asyncio, tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from app.utils.embedder import HashEmbedder, OnnxEmbedder, embed_batch
+from app.utils.embed_service import EmbedService
+
+class CountingEmbedder(HashEmbedder):
+    def __init__(self):
+        super().__init__(); self.calls = []
+    def encode(self, texts):
+        self.calls.append(len(texts)); return super().encode(texts)
+
+def test_concurrent_requests_share_one_encode():
+    model = CountingEmbedder()
+    svc = EmbedService(model, max_batch=64, wait_ms=20)
+    texts = [f"najdi facade {i}" for i in range(40)]
+    async def main():
+        return await asyncio.gather(*(svc.embed(t) for t in texts))
+    out = asyncio.run(main())
+    assert model.calls == [40]
+    assert np.allclose(np.stack(out), embed_batch(texts), atol=1e-6)
+    svc.shutdown()
+
+def test_cache_and_inflight_dedupe():
+    model = CountingEmbedder()
+    svc = EmbedService(model, max_batch=8, wait_ms=1)
+    async def main():
+        a = await svc.embed_many(["الرواشين", "الرواشين", "roshan"])
+        b = await svc.embed_many(["roshan", "الرواشين"])
+        return a, b
+    a, b = asyncio.run(main())
+    assert model.calls == [2], "duplicates share a future, repeats hit the cache"
+    assert np.allclose(a[0], b[1]) and np.allclose(a[2], b[0])
+    assert svc.embed_sync(["roshan", "new"]).shape == (2, 384) and model.calls == [2, 1]
+    svc.shutdown()
+
+def test_cancelled_caller_does_not_cancel_shared_future():
+    model = CountingEmbedder()
+    svc = EmbedService(model, max_batch=8, wait_ms=20)
+    async def main():
+        a = asyncio.ensure_future(svc.embed("mashrabiya"))
+        b = asyncio.ensure_future(svc.embed("mashrabiya"))
+        await asyncio.sleep(0); a.cancel()
+        v = await asyncio.wait_for(b, 5)
+        assert a.cancelled()
+        return v, await svc.embed("mashrabiya")
+    v, again = asyncio.run(main())
+    assert model.calls == [1] and np.allclose(v, embed_batch(["mashrabiya"])[0], atol=1e-6) and np.allclose(v, again)
+    svc.shutdown()
+
+def test_batches_split_at_max_batch():
+    model = CountingEmbedder()
+    svc = EmbedService(model, max_batch=16, wait_ms=5)
+    asyncio.run(svc.embed_many([f"doc {i}" for i in range(50)]))
+    assert sum(model.calls) == 50 and max(model.calls) <= 16
+    svc.shutdown()
+
+class DictStore:
+    def __init__(self): self.rows, self.gets = {}, 0
+    async def get(self, keys):
+        self.gets += 1; return {k: self.rows[k] for k in keys if k in self.rows}
+    async def put(self, version, items):
+        for k, v in items.items(): self.rows.setdefault(k, v.copy())
+
+def test_store_tier_skips_reembedding_across_workers():
+    store, model = DictStore(), CountingEmbedder()
+    texts = ["najdi  facade", "العمارة النجدية", "roshan"]
+    first = asyncio.run(EmbedService(model, wait_ms=1, store=store).embed_many(texts))
+    assert model.calls == [3] and len(store.rows) == 3
+    fresh = EmbedService(model, wait_ms=1, store=store)   # another worker / restart: empty LRU
+    again = asyncio.run(fresh.embed_many(["najdi facade", "العمارة النجدية", "roshan"]))
+    assert model.calls == [3], "whitespace-normalized re-ingest is served from the store"
+    assert np.allclose(first, again) and fresh.info()["hit_ratio"] > 0
+    gets = store.gets
+    q = asyncio.run(fresh.embed("roshan windows", store=False))   # search query: encoded, never looked up or kept
+    assert model.calls == [3, 1] and store.gets == gets and len(store.rows) == 3 and q.shape == (384,)
+
+def _toy_onnx_model(path):
+    # embedding lookup -> last_hidden_state, like an encoder export without pooling
+    import onnx
+    from onnx import helper, TensorProto, numpy_helper
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    vocab = {"[UNK]": 0, "najdi": 1, "facade": 2, "hejazi": 3, "roshan": 4, "النجدية": 5, "العمارة": 6}
+    table = np.random.default_rng(0).normal(size=(len(vocab), 8)).astype(np.float32)
+    graph = helper.make_graph(
+        [helper.make_node("Gather", ["table", "input_ids"], ["last_hidden_state"])], "toy",
+        [helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["b", "t"]),
+         helper.make_tensor_value_info("attention_mask", TensorProto.INT64, ["b", "t"])],
+        [helper.make_tensor_value_info("last_hidden_state", TensorProto.FLOAT, ["b", "t", 8])],
+        [numpy_helper.from_array(table, "table")])
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)], ir_version=8), os.path.join(path, "model.onnx"))
+    tok = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]")); tok.pre_tokenizer = pre_tokenizers.Whitespace()
+    tok.save(os.path.join(path, "tokenizer.json"))
+    return vocab, table
+
+def test_onnx_mean_pooling_ignores_padding():
+    try:
+        import onnx, onnxruntime, tokenizers
+    except ImportError:
+        return   # optional backend; requirements.txt pins onnxruntime/tokenizers for the image
+    with tempfile.TemporaryDirectory() as d:
+        vocab, table = _toy_onnx_model(d)
+        m = OnnxEmbedder(d, threads=1, batch=4)
+        assert m.dim == 8 and m.version.startswith("onnx-")
+        texts = ["najdi facade", "hejazi roshan roshan najdi facade", "العمارة النجدية", "najdi"]
+        out = m.encode(texts)
+        ref = table[[vocab["najdi"], vocab["facade"]]].mean(0)
+        assert np.allclose(out[0], ref / np.linalg.norm(ref), atol=1e-5), "padding rows must not leak into the mean"
+        assert np.allclose(np.linalg.norm(out, axis=1), 1.0, atol=1e-5)
+        assert np.allclose(m.encode(texts[::-1])[::-1], out, atol=1e-6)
+
+if __name__ == "__main__":
+    test_concurrent_requests_share_one_encode(); test_cache_and_inflight_dedupe(); test_cancelled_caller_does_not_cancel_shared_future(); test_batches_split_at_max_batch()
+    test_store_tier_skips_reembedding_across_workers()
+    test_onnx_mean_pooling_ignores_padding()
+    print("ok")
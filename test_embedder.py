@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from app.utils.tokenizer import tokenize
+from app.utils.embedder import embed, embed_batch
+
+def test_tokenizer():
+    assert tokenize("Najdi facade WWR_25") == ["najdi", "facade", "wwr_25"]
+    # diacritics/tatweel stripped, alef variants folded
+    assert tokenize("الْعِمَارَة النـــجدية") == ["العمارة", "النجدية"]
+    assert tokenize("أحمد إبراهيم آل") == ["احمد", "ابراهيم", "ال"]
+
+def test_embeddings_not_degenerate():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools", "dasc_sample.txt")
+    lines = [ln for ln in open(path, encoding="utf-8").read().splitlines() if ln.strip()]
+    m = embed_batch(lines + ["Najdi facade standards", "Hejazi roshan timber"])
+    norms = np.linalg.norm(m, axis=1)
+    assert np.allclose(norms, 1.0, atol=1e-4), "every document must embed to a unit vector, not zero"
+    assert m[-2] @ m[-1] < 0.99
+    q = embed("النجدية")
+    assert q @ embed("العمارة النَّجْدِيَّة") > q @ embed("الحجازية الرواشين")
+
+if __name__ == "__main__":
+    test_tokenizer(); test_embeddings_not_degenerate()
+    print("ok")
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import os, sys, json, contextlib
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from app.utils.hybrid import hybrid_sql, leg_timings
+
+PLAN = [{"Plan": {"Node Type": "Limit", "Actual Total Time": 3.1, "Plans": [
+    {"Node Type": "Index Scan", "Parent Relationship": "InitPlan", "Subplan Name": "CTE vec", "Actual Total Time": 1.25, "Actual Loops": 1},
+    {"Node Type": "Bitmap Heap Scan", "Parent Relationship": "InitPlan", "Subplan Name": "CTE lex", "Actual Total Time": 0.4, "Actual Loops": 1},
+]}, "Execution Time": 3.3}]
+
+class FakeCursor:
+    def __init__(self): self.sql = []
+    async def __aenter__(self): return self
+    async def __aexit__(self, *a): pass
+    async def execute(self, sql, params=None): self.sql.append((sql, params))
+    async def fetchall(self):
+        return [("najdi-1", "najdi", "مشربيات", Decimal("0.0325"), 1, 1, 0.91), ("hejazi-2", "hejazi", "رواشين", Decimal("0.0161"), None, 2, None)]
+    async def fetchone(self): return (json.dumps(PLAN),)
+
+def test_sql_runs_both_legs_in_one_statement():
+    sql = hybrid_sql("rag_docs")
+    assert sql.count("MATERIALIZED") == 2 and "websearch_to_tsquery" in sql and "<=>" in sql and "PARTITION BY md5(d.content)" in sql
+
+def test_leg_timings_from_explain():
+    assert leg_timings(json.dumps(PLAN)) == {"db_ms": 3.3, "vector_ms": 1.25, "lexical_ms": 0.4}
+
+def test_rag_search_hybrid_endpoint():
+    from fastapi.testclient import TestClient
+    from app import main
+    cur = FakeCursor()
+    class FakeConn:
+        def cursor(self): return cur
+    @contextlib.asynccontextmanager
+    async def fake_conn(): yield FakeConn()
+    saved = main.get_conn
+    main.get_conn = fake_conn
+    try:
+        r = TestClient(main.app).post("/v1/rag/search", json={"query": "مشربيات نجدية", "k": 2, "timing": True}).json()
+    finally:
+        main.get_conn = saved
+    assert r["mode"] == "hybrid" and [h["id"] for h in r["hits"]] == ["najdi-1", "hejazi-2"]
+    assert r["hits"][1]["vector_rank"] is None and r["hits"][0]["score"] == 0.0325
+    assert r["timing"]["vector_ms"] == 1.25 and r["timing"]["lexical_ms"] == 0.4 and "round_trip_ms" in r["timing"]
+    sql, params = cur.sql[0]
+    assert "WITH vec AS MATERIALIZED" in sql and params["q"] == "مشربيات نجدية" and params["k"] == 2 and params["depth"] >= 2
+    assert cur.sql[1][0].startswith("EXPLAIN (ANALYZE, FORMAT JSON)")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import os, sys, time, asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools"))
+from mock_llm import make_app, serve
+from app.utils.llm_router import Router
+from prometheus_client import REGISTRY
+
+def fake(words, first_s=0.0, fail=False):
+    async def gen(prompt):
+        await asyncio.sleep(first_s)
+        if fail: raise ConnectionError("upstream down")
+        for w in words: yield w
+    return gen
+
+def run(router, **kw):
+    async def go():
+        info, t0 = {}, time.perf_counter()
+        text = "".join([c async for c in router.stream("واجهة", info=info, **kw)])
+        return text, info.get("provider"), time.perf_counter() - t0
+    return asyncio.run(go())
+
+def test_falls_back_to_local_when_providers_fail():
+    r = Router({"a": fake([], fail=True), "b": fake([], fail=True), "local": fake(["محلي"])}, ["a", "b"], "local")
+    assert run(r)[:2] == ("محلي", "local")
+    assert r.state["a"].error_rate == 1.0 and r.state["b"].error_rate == 1.0
+
+def test_unconfigured_providers_are_skipped():
+    r = Router({"a": fake(["a"]), "b": fake(["b"]), "local": fake(["l"])}, ["a", "b"], "local", configured={"a": lambda: False})
+    assert run(r)[:2] == ("b", "b")
+
+def test_hedge_starts_second_provider_and_first_answer_wins():
+    r = Router({"slow": fake(["s"], first_s=1.0), "fast": fake(["f"], first_s=0.05), "local": fake(["l"])}, ["slow", "fast"], "local", hedge_ms=100)
+    before = REGISTRY.get_sample_value("sima_router_hedges_total", {"provider": "fast"}) or 0
+    text, provider, took = run(r)
+    assert (text, provider) == ("f", "fast") and took < 0.6
+    assert REGISTRY.get_sample_value("sima_router_hedges_total", {"provider": "fast"}) == before + 1
+
+def test_circuit_opens_after_repeated_failures_and_half_opens_after_cooldown():
+    calls = []
+    async def flaky(prompt):
+        calls.append(1)
+        raise ConnectionError("down")
+        yield ""
+    r = Router({"x": flaky, "local": fake(["l"])}, ["x"], "local")
+    for _ in range(3): run(r)
+    assert r.status()["x"]["circuit"] == "open" and r.ranked() == []
+    run(r); assert len(calls) == 3          # skipped while open
+    r.state["x"].open_until = time.monotonic() - 1
+    assert r.status()["x"]["circuit"] == "half-open" and r.ranked() == ["x"]
+    run(r); assert len(calls) == 4 and r.status()["x"]["circuit"] == "open"
+
+def test_cancelled_probe_does_not_leave_provider_half_open_forever():
+    r = Router({"x": fake(["x"], first_s=1.0), "y": fake(["y"], first_s=0.05), "local": fake(["l"])}, ["x", "y"], "local", hedge_ms=50)
+    r.state["x"].open_until = time.monotonic() - 1   # cooldown over: next request probes x
+    assert run(r)[:2] == ("y", "y"), "the hedge wins and the probe is cancelled"
+    assert not r.state["x"].probing and r.status()["x"]["circuit"] == "half-open" and "x" in r.ranked()
+    async def disconnect():
+        t = asyncio.ensure_future(r.stream("q").__anext__())
+        await asyncio.sleep(0.02); t.cancel()
+        try: await t
+        except asyncio.CancelledError: pass
+    asyncio.run(disconnect())
+    assert not r.state["x"].probing and "x" in r.ranked()
+
+def test_ranking_prefers_faster_provider_once_measured():
+    r = Router({"a": fake(["a"]), "b": fake(["b"]), "local": fake(["l"])}, ["a", "b"], "local")
+    r.state["a"].ewma, r.state["b"].ewma = 3.0, 0.2
+    assert r.ranked() == ["b", "a"]
+
+def test_hybrid_policy_hands_over_after_budget():
+    async def local(prompt):
+        for w in ["l1 ", "l2 ", "l3 "]:
+            await asyncio.sleep(0.05); yield w
+    r = Router({"local": local, "cloud": fake(["c"])}, ["local", "cloud"], "local")
+    async def go():
+        return "".join([c async for c in r.hybrid("q", "local", "cloud", budget_ms=60)])
+    assert asyncio.run(go()) == "l1 l2 c"
+
+def test_app_router_uses_next_provider_when_gemini_is_down():
+    from app import main
+    app, expected = make_app(50, 5)
+    base, server = serve(app)
+    saved = main.GEMINI_API_KEY, main.GEMINI_BASE_URL, main.CLOUD_RELAY_URL, main.OPENAI_API_KEY, main.ANTHROPIC_API_KEY
+    try:
+        main.GEMINI_API_KEY, main.GEMINI_BASE_URL = "k", "http://127.0.0.1:9/v1beta"
+        main.OPENAI_API_KEY = main.ANTHROPIC_API_KEY = ""
+        main.CLOUD_RELAY_URL = base + "/v1/chat/completions"
+        async def go():
+            info = {}
+            return "".join([t async for t in main.stream_ai("واجهة", info)]), info["provider"]
+        assert asyncio.run(go()) == (expected, "vllm")
+    finally:
+        main.GEMINI_API_KEY, main.GEMINI_BASE_URL, main.CLOUD_RELAY_URL, main.OPENAI_API_KEY, main.ANTHROPIC_API_KEY = saved
+        server.should_exit = True
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import os, sys, types, fcntl, tempfile, threading, importlib
+import numpy as np
+
+# SIMA_CHAT_PRO_V7's utils (same rag_snapshot.py in GPU_PRO, ENGINES_MAX and v5_MAX) under their own package name
+UTILS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SIMA_CHAT_PRO_V7", "backend", "app", "utils")
+pkg = types.ModuleType("sima_v7_utils"); pkg.__path__ = [UTILS]; sys.modules.setdefault("sima_v7_utils", pkg)
+rs = importlib.import_module("sima_v7_utils.rag_snapshot")
+
+def corpus(d, **files):
+    out = []
+    for name, text in files.items():
+        p = os.path.join(d, name + ".md")
+        with open(p, "w", encoding="utf-8") as fh: fh.write(text)
+        out.append(p)
+    return sorted(out)
+
+def counting(calls):
+    def build(docs, ids):
+        calls.append(list(ids)); return rs.fit_tfidf(docs, ids)
+    return build
+
+def test_reuses_snapshot_until_corpus_changes():
+    with tempfile.TemporaryDirectory() as d:
+        root, calls = os.path.join(d, "snap"), []
+        files = corpus(d, najdi="Najdi houses use mud brick. Courtyards shade rooms.", hejazi="Hejazi roshan windows of carved timber.")
+        a = rs.load_or_build("tfidf", rs.TFIDF_PARAMS, files, counting(calls), root=root)
+        b = rs.load_or_build("tfidf", rs.TFIDF_PARAMS, files, counting(calls), root=root)
+        assert calls == [["hejazi.md", "najdi.md"]] and a.path == b.path
+        assert isinstance(b.arrays["X_data"], np.memmap) and b.docs[1].startswith("Najdi") and len(b.docs) == 2
+        ix = rs.FittedTfidf(b)
+        assert ix.hit(*ix.search("roshan timber", 1)[0])["doc_id"] == "hejazi.md"
+        with open(files[0], "a", encoding="utf-8") as fh: fh.write(" Mashrabiya screens too.")
+        c = rs.load_or_build("tfidf", rs.TFIDF_PARAMS, files, counting(calls), root=root)
+        assert len(calls) == 2 and c.path != a.path and not os.path.exists(a.path), "old snapshot replaced"
+        assert ix.search("roshan timber", 1), "a mapped snapshot stays readable after its files are removed"
+        assert sorted(os.listdir(root)) == sorted([os.path.basename(c.path), "tfidf.current", "tfidf.lock"])
+
+def test_empty_corpus():
+    with tempfile.TemporaryDirectory() as d:
+        snap = rs.load_or_build("tfidf", rs.TFIDF_PARAMS, [], rs.fit_tfidf, root=d)
+        assert len(snap.docs) == 0 and rs.FittedTfidf(snap).search("x", 3) == []
+
+def test_rebuild_waits_for_loaders():
+    with tempfile.TemporaryDirectory() as d:
+        root = os.path.join(d, "snap")
+        files = corpus(d, a="Najdi mud brick courtyard houses.")
+        old = rs.load_or_build("tfidf", rs.TFIDF_PARAMS, files, rs.fit_tfidf, root=root)
+        with open(os.path.join(root, "tfidf.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)   # another worker in the middle of _load
+            t = threading.Thread(target=rs.load_or_build, args=("tfidf", rs.TFIDF_PARAMS, files, rs.fit_tfidf), kwargs={"root": root, "force": True})
+            t.start(); t.join(0.3)
+            assert t.is_alive() and os.path.exists(os.path.join(old.path, "meta.json")), "forced rebuild must not delete under a loader"
+        t.join(5)
+        assert not t.is_alive() and os.path.exists(os.path.join(old.path, "meta.json"))
+
+if __name__ == "__main__":
+    test_reuses_snapshot_until_corpus_changes(); test_empty_corpus(); test_rebuild_waits_for_loaders()
+    print("ok")
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from app.utils.sensor_ingest import BatchWriter, INGEST_DROPPED
+
+class FakeConn:
+    def __init__(self, fail=0, delay=0.0):
+        self.batches, self.fail, self.delay, self.closed, self.copy_sql = [], fail, delay, False, None
+    def cursor(self): return self
+    def copy(self, sql):
+        self.copy_sql = sql; self._rows = []; return self
+    def __enter__(self): return self
+    def __exit__(self, *a): pass
+    def write_row(self, r): self._rows.append(r)
+    def commit(self):
+        time.sleep(self.delay)
+        if self.fail: self.fail -= 1; raise RuntimeError("db down")
+        self.batches.append(self._rows)
+    def close(self): pass
+
+def dropped(reason, table="t"):
+    return INGEST_DROPPED.labels(table=table, reason=reason)._value.get()
+
+def test_flushes_by_size_and_time():
+    conn = FakeConn()
+    w = BatchWriter("", "t", ["a", "b"], batch_rows=100, flush_ms=50, connect=lambda: conn)
+    seen = []; w.in_tx.append(lambda cur, rows: seen.append((cur is conn, len(rows))))
+    w.start()
+    for i in range(250): w.put((i, "x"))
+    time.sleep(0.3)
+    assert conn.copy_sql == "COPY t (a, b) FROM STDIN"
+    assert [len(b) for b in conn.batches] == [100, 100, 50], "full batches go at once, the tail after flush_ms"
+    assert seen == [(True, 100), (True, 100), (True, 50)]
+    w.put((250, "y")); w.stop()
+    assert sum(len(b) for b in conn.batches) == 251
+
+def test_backpressure_then_drop_when_full():
+    conn = FakeConn(delay=0.3)
+    w = BatchWriter("", "t", ["a"], batch_rows=2, flush_ms=1, queue_max=2, put_timeout_ms=20, connect=lambda: conn).start()
+    before = dropped("full")
+    s = time.perf_counter()
+    ok = [w.put((i,)) for i in range(8)]
+    assert not all(ok) and dropped("full") - before == ok.count(False)
+    assert time.perf_counter() - s >= 0.02, "a full queue blocks the caller before dropping"
+    w.stop()
+    assert sum(len(b) for b in conn.batches) == ok.count(True)
+
+def test_retries_then_counts_db_drops():
+    conn = FakeConn(fail=1)
+    w = BatchWriter("", "t2", ["a"], connect=lambda: conn)
+    assert w.flush([(1,), (2,)]) and conn.batches == [[(1,), (2,)]]
+    conn.fail = 99; before = dropped("db", "t2")
+    w._stop.set()   # no backoff sleeps
+    assert not w.flush([(3,)]) and dropped("db", "t2") - before == 1
+
+if __name__ == "__main__":
+    test_flushes_by_size_and_time(); test_backpressure_then_drop_when_full(); test_retries_then_counts_db_drops()
+    print("ok")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import os, sys, json, time, asyncio, datetime, threading, urllib.error, urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from app.utils.sensor_live import HubFull, LiveHub, LIVE_DROPPED, serve, stream
+
+PID = "6f1c8a9e-2a7b-4c1e-9a53-3f1f5d7b2c10"
+T0 = datetime.datetime(2026, 10, 18, 12, tzinfo=datetime.timezone.utc)
+
+def dropped(reason): return LIVE_DROPPED.labels(reason=reason)._value.get()
+
+def test_slow_subscriber_only_sees_fresh_values():
+    hub = LiveHub(queue_max=2, max_subs=1)
+    hub.publish(PID, "co2", 400.0, T0)
+    sub = hub.subscribe(PID)
+    stale, full = dropped("stale"), dropped("full")
+    for i in range(100): hub.publish(PID, "co2", 400.0 + i, T0)
+    hub.publish(PID, "temp", 21.0, T0); hub.publish(PID, "rh", 40.0, T0)
+    assert [(x["type"], x["val"]) for x in sub.get(0)] == [("temp", 21.0), ("rh", 40.0)], "co2 was evicted as the oldest key"
+    assert dropped("stale") - stale == 100 and dropped("full") - full == 1
+    assert sub.get(0.01) == []
+    try: hub.subscribe(PID); assert False
+    except HubFull: pass
+    hub.unsubscribe(sub); hub.unsubscribe(sub)
+    hub.subscribe(PID)   # slot freed once
+    assert [x["val"] for x in hub.latest(PID)] == [499.0, 40.0, 21.0]
+
+def test_async_stream_wakes_on_publish_from_another_thread():
+    hub = LiveHub()
+    async def run():
+        sub = hub.subscribe(PID, asyncio.get_running_loop())
+        gen = stream(hub, sub, heartbeat=5)
+        threading.Timer(0.05, hub.publish, (PID, "co2", 410.0, T0)).start()
+        s = time.perf_counter(); chunk = await gen.__anext__()
+        assert time.perf_counter() - s < 1 and chunk.startswith(b"event: values\n")
+        assert json.loads(chunk.split(b"data: ")[1]) == [{"type": "co2", "val": 410.0, "ts": T0.isoformat()}]
+        await gen.aclose()
+        assert hub._count == 0
+    asyncio.run(run())
+
+def test_stdlib_server_streams_sse():
+    hub = LiveHub(); hub.publish(PID, "co2", 401.0, T0)
+    srv = serve(hub, port=0, heartbeat=5)
+    base = f"http://127.0.0.1:{srv.server_address[1]}/v1/sensor"
+    try:
+        assert json.load(urllib.request.urlopen(f"{base}/{PID.upper()}/latest"))["data"][0]["val"] == 401.0
+        r = urllib.request.urlopen(f"{base}/{PID}/stream", timeout=5)
+        assert r.headers["Content-Type"] == "text/event-stream"
+        assert r.readline() == b"event: values\n" and b"401.0" in r.readline()
+        r.close()
+        try: urllib.request.urlopen(f"{base}/nope/stream"); assert False
+        except urllib.error.HTTPError as e: assert e.code == 400
+    finally:
+        srv.shutdown()
+
+if __name__ == "__main__":
+    test_slow_subscriber_only_sees_fresh_values(); test_async_stream_wakes_on_publish_from_another_thread(); test_stdlib_server_streams_sse()
+    print("ok")
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+import os, sys, datetime, contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from app.utils import sensor_partitions as sp
+
+class FakeCur:
+    def __init__(self, existing=(), tz=True):
+        self.existing, self.tz, self.sql, self._res, self.rowcount = list(existing), tz, [], None, 0
+        self.connection = self
+    def transaction(self): return contextlib.nullcontext()
+    def execute(self, sql, params=None):
+        self.sql.append(sql)
+        if "format_type" in sql: self._res = [("timestamp with time zone" if self.tz else "timestamp without time zone",)]
+        elif "pg_inherits" in sql: self._res = [(n,) for n in self.existing]
+        self.rowcount = 7 if sql.startswith("DELETE FROM") else 0
+    def fetchone(self): return self._res[0]
+    def fetchall(self): return self._res
+
+def test_creates_ahead_and_drops_past_retention():
+    cur = FakeCur(["t_default", "t_d20260401", "t_d20261017", "t_d20261018"])
+    st = sp.ensure(cur, "t", today=datetime.date(2026, 10, 18), kind="day", ahead=2, retention_days=180)
+    assert st == {"created": ["t_d20261019", "t_d20261020"], "dropped": ["t_d20260401"], "pruned": 7}
+    attach = [s for s in cur.sql if "ATTACH" in s]
+    assert attach[0].endswith("FOR VALUES FROM ('2026-10-19 00:00:00+00') TO ('2026-10-20 00:00:00+00');")
+    assert any(s.startswith("WITH m AS (DELETE FROM t_default WHERE ts >= '2026-10-19") for s in cur.sql), "stragglers move out of the default partition"
+    assert "DROP TABLE IF EXISTS t_d20260401;" in cur.sql and not any("t_default;" in s and "DROP" in s for s in cur.sql)
+    assert "DELETE FROM t_default WHERE ts < '2026-04-21 00:00:00+00';" in cur.sql, "stragglers past retention are pruned too"
+
+def test_weeks_start_monday_and_skip_overlaps():
+    cur = FakeCur(["t_d20261019"], tz=False)
+    st = sp.ensure(cur, "t", today=datetime.date(2026, 10, 18), kind="week", ahead=1, retention_days=0, since=datetime.date(2026, 10, 7))
+    # the week of 2026-10-19 already has a day partition, so only the two earlier weeks are created
+    assert st == {"created": ["t_w20261005", "t_w20261012"], "dropped": [], "pruned": 0}
+    assert not any(s.startswith("DELETE FROM t_default") for s in cur.sql), "no retention, nothing pruned"
+    assert "'2026-10-05 00:00:00'" in [s for s in cur.sql if "ATTACH" in s][0]
+
+if __name__ == "__main__":
+    test_creates_ahead_and_drops_past_retention(); test_weeks_start_monday_and_skip_overlaps()
+    print("ok")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+import os, sys, datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from app.utils.sensor_rollups import Rollups, parse_step, shape
+
+UTC = datetime.timezone.utc
+PID = "6f1c8a9e-2a7b-4c1e-9a53-3f1f5d7b2c10"
+
+class FakeCur:
+    def __init__(self): self.calls = []
+    def execute(self, sql, params=None): self.calls.append((sql, params))
+
+def test_parse_step_and_pick_coarsest_dividing_level():
+    assert [parse_step(s) for s in ("300", "30s", "5m", "1h", "2d")] == [300, 30, 300, 3600, 172800]
+    for bad in ("", "0", "5w", "-1m"):
+        try: parse_step(bad); assert False, bad
+        except ValueError: pass
+    r = Rollups("t", ["ts", "project_id", "type", "value"])
+    assert [r.pick(s) for s in (30, 300, 5400, 7200, 604800)] == [("t", 0), ("t_1m", 60), ("t_1m", 60), ("t_1h", 3600), ("t_1d", 86400)]
+
+def test_apply_folds_batch_into_each_level():
+    r = Rollups("sensor_data", ["id", "project_id", "sensor_type", "val", "ts"], kind="sensor_type", value="val")
+    t0 = datetime.datetime(2026, 10, 18, 9, 59, 30, tzinfo=UTC)
+    rows = [(1, PID, "co2", 400.0, t0), (2, PID, "co2", 420.0, t0 + datetime.timedelta(seconds=20)),
+            (3, PID, "co2", 410.0, t0 + datetime.timedelta(seconds=40)), (4, PID, "co2", None, t0),
+            (5, PID, "co2", float("nan"), t0), (6, PID, "co2", float("-inf"), t0)]   # skipped, not folded into sum/min
+    cur = FakeCur(); r.apply(cur, rows)
+    assert [c[0].split()[2] for c in cur.calls] == ["sensor_data_1m", "sensor_data_1h", "sensor_data_1d"]
+    assert "sum = sensor_data_1m.sum + EXCLUDED.sum" in cur.calls[0][0] and "::TIMESTAMPTZ[]" in cur.calls[0][0]
+    buckets, pids, kinds, n, s, lo, hi = cur.calls[0][1]   # 09:59 and 10:00
+    assert [b.minute for b in buckets] == [59, 0] and n == [2, 1] and s == [820.0, 410.0] and lo == [400.0, 410.0] and hi == [420.0, 410.0]
+    buckets, _, _, n, s, lo, hi = cur.calls[2][1]
+    assert buckets == [datetime.datetime(2026, 10, 18, tzinfo=UTC)] and n == [3] and s == [1230.0] and (lo, hi) == ([400.0], [420.0])
+
+def test_series_query_aligns_and_falls_back_to_raw():
+    r = Rollups("iot_readings", ["ts", "project_id", "type", "value"], tz=False)
+    start = datetime.datetime(2026, 10, 18, 10, 17, tzinfo=datetime.timezone(datetime.timedelta(hours=3)))
+    sql, p, src = r.series_query(PID, start, datetime.datetime(2026, 10, 18, 12), 3600, "max", "co2")
+    assert src == "iot_readings_1h" and "max(hi)" in sql and "type = %(kind)s" in sql
+    assert p["start"] == datetime.datetime(2026, 10, 18, 7) and p["origin"].tzinfo is None, "naive UTC, floored to the step"
+    sql, p, src = r.series_query(PID, None, None, 10, "avg")
+    assert src == "iot_readings" and "value IS NOT NULL AND value NOT IN ('NaN'" in sql and "FROM iot_readings WHERE" in sql
+    assert (p["end"] - p["start"]).total_seconds() <= 10 * 5001, "default window shrinks to the point cap"
+    for args in ((PID, None, None, 60, "median"), (PID, datetime.datetime(2026, 10, 1), None, 1), (PID, datetime.datetime(2026, 10, 18), datetime.datetime(2026, 10, 17), 60)):
+        try: r.series_query(*args); assert False, args
+        except ValueError: pass
+    assert shape([(datetime.datetime(2026, 10, 18), "co2", 1), (datetime.datetime(2026, 10, 18, 1), "co2", float("nan"))]) == \
+        {"co2": [["2026-10-18T00:00:00", 1.0], ["2026-10-18T01:00:00", None]]}, "JSON has no NaN"
+
+def test_pick_skips_levels_pruned_before_the_window_start():
+    r = Rollups("iot_readings", ["ts", "project_id", "type", "value"], tz=False)   # 1m kept 30 days, 1h 400, 1d forever
+    now = datetime.datetime.now(UTC)
+    ago = lambda days: now - datetime.timedelta(days=days)
+    assert r.pick(300, ago(1)) == ("iot_readings_1m", 60)
+    assert r.pick(300, ago(40)) == ("iot_readings", 0), "minute rollups are gone, raw partitions are not"
+    assert r.pick(3600, ago(40)) == ("iot_readings_1h", 3600) and r.pick(7200, ago(500)) == ("iot_readings", 0)
+    assert r.pick(86400, ago(3000)) == ("iot_readings_1d", 86400), "retention 0 keeps everything"
+    sql, p, src = r.series_query(PID, ago(40), ago(39), 300)
+    assert src == "iot_readings" and "FROM iot_readings WHERE" in sql
+
+if __name__ == "__main__":
+    test_parse_step_and_pick_coarsest_dividing_level(); test_apply_folds_batch_into_each_level(); test_series_query_aligns_and_falls_back_to_raw()
+    test_pick_skips_levels_pruned_before_the_window_start()
+    print("ok")
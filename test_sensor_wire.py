@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import os, sys, datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from app.utils.sensor_wire import HEAD, READING, decode, encode, is_binary
+
+PID = "6f1c8a9e-2a7b-4c1e-9a53-3f1f5d7b2c10"
+NOW = datetime.datetime(2026, 10, 18, 12, tzinfo=datetime.timezone.utc)
+
+def test_roundtrip_with_device_time_and_custom_types():
+    readings = [("temperature", NOW - datetime.timedelta(seconds=30), 24.5), ("co2", NOW - datetime.timedelta(milliseconds=1500), 415.0),
+                ("radon", NOW, 12.25), ("radon", NOW, float("nan"))]
+    msg = encode(PID, readings)
+    assert is_binary(msg) and not is_binary(b"24.5") and not is_binary(b'{"val": 1}')
+    assert len(msg) == HEAD.size + 1 + 2 + len("radon") + 4 * READING.size
+    pid, out = decode(msg, NOW)
+    assert pid == PID
+    assert out == [("temperature", NOW - datetime.timedelta(seconds=30), 24.5), ("co2", NOW - datetime.timedelta(milliseconds=1500), 415.0),
+                   ("radon", NOW, 12.25)], "float32 values, ms timestamps, NaN skipped"
+
+def test_bad_device_clock_falls_back_to_receive_time():
+    future, ancient = NOW + datetime.timedelta(hours=1), NOW - datetime.timedelta(days=30)
+    assert decode(encode(PID, [("co2", future, 1.0)]), NOW)[1][0][1] == NOW
+    assert decode(encode(PID, [("co2", ancient, 1.0)]), NOW)[1][0][1] == NOW
+    ok = NOW - datetime.timedelta(days=2)
+    assert decode(encode(PID, [("co2", ok, 1.0)]), NOW)[1][0][1] == ok
+
+def test_rejects_malformed_messages():
+    msg = encode(PID, [("co2", NOW, 1.0), ("humidity", NOW, 2.0)])
+    bad = [msg[:10], msg[:-1], msg + b"\0", b"\xb5\x02" + msg[2:],
+           msg[:HEAD.size] + bytes([99]) + msg[HEAD.size + 1:],                      # unknown type id
+           HEAD.pack(0xB5, 1, 1, 1, bytes(16), 0) + b"\x01\x05\x03abc" + READING.pack(5, 0, 1.0),   # dictionary id below 128
+           HEAD.pack(0xB5, 1, 0, 5000, bytes(16), 0)]
+    for b in bad:
+        try: decode(b, NOW); assert False, b
+        except ValueError: pass
+    for args in ((PID, []), ("not-a-uuid", [("co2", NOW, 1.0)])):
+        try: encode(*args); assert False, args
+        except ValueError: pass
+
+if __name__ == "__main__":
+    test_roundtrip_with_device_time_and_custom_types(); test_bad_device_clock_falls_back_to_receive_time(); test_rejects_malformed_messages()
+    print("ok")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+import os, sys, time, asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools"))
+from mock_llm import make_app, serve
+from app import main
+from prometheus_client import REGISTRY
+
+FIRST_MS, CHUNK_MS = 300, 40
+
+def _collect(gen):
+    async def run():
+        t0 = time.perf_counter(); first = None; out = []
+        async for t in gen:
+            if first is None: first = time.perf_counter() - t0
+            out.append(t)
+        return first, time.perf_counter() - t0, "".join(out)
+    return asyncio.run(run())
+
+def _ttft_count(provider):
+    return REGISTRY.get_sample_value("sima_llm_ttft_seconds_count", {"provider": provider}) or 0
+
+def test_gemini_and_vllm_stream_natively():
+    app, expected = make_app(FIRST_MS, CHUNK_MS)
+    base, server = serve(app)
+    try:
+        main.GEMINI_BASE_URL = base + "/v1beta"
+        main.CLOUD_RELAY_URL = base + "/v1/chat/completions"
+        for provider, gen in (("gemini", lambda: main.stream_gemini("واجهة", "")), ("vllm", lambda: main.stream_vllm("واجهة"))):
+            before = _ttft_count(provider)
+            first, total, text = _collect(gen())
+            assert text == expected
+            # first token arrives after the first chunk, well before the full generation
+            assert first < FIRST_MS / 1000 + 3 * CHUNK_MS / 1000 < total, (provider, first, total)
+            assert _ttft_count(provider) == before + 1
+    finally:
+        server.should_exit = True
+
+def test_provider_client_reuses_connections():
+    from app.utils.http_clients import close_clients
+    app, expected = make_app(0, 0)
+    base, server = serve(app)
+    try:
+        main.GEMINI_BASE_URL = base + "/v1beta"
+        async def run():
+            try:
+                for _ in range(5):
+                    assert "".join([t async for t in main.stream_gemini("واجهة", "")]) == expected
+            finally:
+                await close_clients()
+        reqs = REGISTRY.get_sample_value("sima_http_client_requests_total", {"upstream": "gemini"}) or 0
+        conns = REGISTRY.get_sample_value("sima_http_client_connections_total", {"upstream": "gemini"}) or 0
+        asyncio.run(run())
+        assert REGISTRY.get_sample_value("sima_http_client_requests_total", {"upstream": "gemini"}) == reqs + 5
+        assert REGISTRY.get_sample_value("sima_http_client_connections_total", {"upstream": "gemini"}) == conns + 1
+    finally:
+        server.should_exit = True
+
+def test_loop_change_closes_previous_clients():
+    from app.utils import http_clients
+    async def get(): return http_clients.http_client("gemini")
+    async def swap():
+        c = http_clients.http_client("gemini")
+        await http_clients.close_clients()   # also waits for the retired clients
+        return c
+    old = asyncio.run(get())
+    assert not old.is_closed
+    new = asyncio.run(swap())
+    assert new is not old and old.is_closed and new.is_closed and not http_clients._closing
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+import os, sys, time, types, importlib
+import numpy as np
+
+# SIMA_CHAT_PRO_V7's utils (identical in SIMA_CHAT_PRO_GPU_PRO) under their own package name, so they do
+# not clash with the root backend's `app` package in the same test session
+UTILS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SIMA_CHAT_PRO_V7", "backend", "app", "utils")
+pkg = types.ModuleType("sima_v7_utils"); pkg.__path__ = [UTILS]; sys.modules.setdefault("sima_v7_utils", pkg)
+tfidf_index = importlib.import_module("sima_v7_utils.tfidf_index")
+TfidfIndex = tfidf_index.TfidfIndex
+
+DOCS = ["Najdi houses use mud brick walls and small openings. Courtyards shade the rooms.",
+        "Hejazi facades carry roshan windows of carved timber. The roshan cools the room.",
+        "Asiri villages paint bands of colour around windows. Stone towers rise on the slopes."]
+NEW = ["Roshan screens and mashrabiya balconies filter the light on the Red Sea coast.",
+       "Mud brick needs lime plaster to last through the rains."]
+
+def dense(m): return m.toarray()
+
+def test_build_and_search():
+    t = TfidfIndex(n_features=2**12)
+    t.build(DOCS, ["najdi", "hejazi", "asiri"])
+    assert len(t) == 3 and t.X.shape[0] == len(t.p_src) >= 3
+    assert np.allclose(np.asarray(t.X.multiply(t.X).sum(axis=1)).ravel(), 1.0), "rows are l2-normalised"
+    hits = t.search("roshan timber windows", 2)
+    assert t.hit(*hits[0])["doc_id"] == "hejazi" and hits[0][1] >= hits[1][1]
+    assert "roshan" in t.hit(*hits[0])["excerpt"].lower()
+
+def test_empty_corpus_builds():
+    t = TfidfIndex(n_features=2**12)
+    t.build([], [])
+    assert len(t) == 0 and t.X.shape == (0, 2**12) and t.search("anything", 3) == []
+    arrays, meta = tfidf_index.build_arrays([], [])
+    assert tuple(arrays["X_shape"]) == (0, tfidf_index.TFIDF_FEATURES) and meta == {}
+    t.add(NEW[:1], ["coast"])
+    assert t.hit(*t.search("mashrabiya", 1)[0])["doc_id"] == "coast"
+
+def test_add_uses_current_idf_until_reweight_matches_full_refit():
+    ratio, tfidf_index.TFIDF_REWEIGHT_RATIO = tfidf_index.TFIDF_REWEIGHT_RATIO, 100.0   # no background reweight here
+    try:
+        t, full = TfidfIndex(n_features=2**12), TfidfIndex(n_features=2**12)
+        t.build(DOCS, ["a", "b", "c"]); before = dense(t.X); idf = t.idf.copy()
+        t.add(NEW, ["d", "e"])
+        full.build(DOCS + NEW, ["a", "b", "c", "d", "e"])
+        assert np.array_equal(t.df, full.df) and np.array_equal(t.p_src, full.p_src), "df and passages are exact"
+        assert np.array_equal(dense(t.X)[:len(before)], before) and np.array_equal(t.idf, idf), "existing rows untouched"
+        assert not np.allclose(dense(t.X), dense(full.X)), "appended rows are weighted with the stale idf"
+        t.reweight()
+        assert np.allclose(t.idf, full.idf) and np.allclose(dense(t.X), dense(full.X), atol=1e-6)
+        assert t.search("mud brick plaster", 3) == full.search("mud brick plaster", 3)
+    finally:
+        tfidf_index.TFIDF_REWEIGHT_RATIO = ratio
+
+def test_growth_past_ratio_reweights_in_background():
+    ratio, tfidf_index.TFIDF_REWEIGHT_RATIO = tfidf_index.TFIDF_REWEIGHT_RATIO, 0.1
+    try:
+        t, full = TfidfIndex(n_features=2**12), TfidfIndex(n_features=2**12)
+        t.build(DOCS, ["a", "b", "c"]); t.add(NEW, ["d", "e"])
+        deadline = time.time() + 5
+        while (t._reweighting or t._weighted_n < t.X.shape[0]) and time.time() < deadline: time.sleep(0.01)
+        full.build(DOCS + NEW, ["a", "b", "c", "d", "e"])
+        assert t._weighted_n == t.X.shape[0] and np.allclose(dense(t.X), dense(full.X), atol=1e-6)
+    finally:
+        tfidf_index.TFIDF_REWEIGHT_RATIO = ratio
+
+def test_empty_upload_is_kept_but_not_indexed():
+    t = TfidfIndex(n_features=2**12)
+    t.build(["najdi facade. roshan windows."], ["a"])
+    t.add([""], ["b.txt"]); t.add(["   \n\n "], ["scan.txt"])   # empty .txt, PDF without a text layer
+    assert len(t) == 3 and t.X.shape[0] == t.counts.shape[0] == 1
+    assert [t.hit(i, s)["doc_id"] for i, s in t.search("roshan", 3)] == ["a"]
+    t.add(["courtyard houses keep the heat out."], ["c"])
+    assert t.hit(*t.search("courtyard", 1)[0])["doc_id"] == "c", "passages after an empty doc still map to their source"
+
+if __name__ == "__main__":
+    test_build_and_search(); test_empty_corpus_builds(); test_add_uses_current_idf_until_reweight_matches_full_refit()
+    test_growth_past_ratio_reweights_in_background(); test_empty_upload_is_kept_but_not_indexed()
+    print("ok")
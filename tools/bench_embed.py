@@ -0,0 +1,73 @@
+import sys, os, time, re, hashlib, asyncio
+import numpy as np
+
+# Tokenizer tokens/s and per-call vs batch throughput of the hash embedder on the DASC sample, then
+# docs/s and p95 per batch size for the configured backend (EMBED_BACKEND=hash|onnx, EMBED_MODEL_DIR)
+# and the same load as concurrent single-text requests through EmbedService (dynamic batching).
+# usage: python tools/bench_embed.py [text_path] [repeat] [batch_sizes]
+#        EMBED_BACKEND=onnx EMBED_MODEL_DIR=backend/models/paraphrase-multilingual-MiniLM-L12-v2 python tools/bench_embed.py "" 2
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from app.utils.embedder import embed, embed_batch, cache_info, load_embedder
+from app.utils.embed_service import EmbedService
+from app.utils.tokenizer import tokenize
+
+text_path = sys.argv[1] if len(sys.argv)>1 and sys.argv[1] else os.path.join(os.path.dirname(os.path.abspath(__file__)), "dasc_sample.txt")
+repeat = int(sys.argv[2]) if len(sys.argv)>2 else 50
+batch_sizes = [int(b) for b in (sys.argv[3] if len(sys.argv)>3 else "1,8,32,64,128").split(",")]
+dim = 384
+
+with open(text_path,"r",encoding="utf-8") as f:
+    t = f.read()
+chunk = 1100
+docs = [t[i:i+chunk] for i in range(0,len(t),chunk)] + [ln for ln in t.splitlines() if ln.strip()]
+docs = docs * repeat
+
+def legacy_embed(text, dim=384):
+    # previous main.hash_embed (broken \\w regex), kept here as the speed baseline
+    import hashlib, numpy as np, re
+    vec = np.zeros(dim, dtype=np.float32)
+    for tok in re.findall(r"\\w+", text.lower()):
+        h = int(hashlib.md5(tok.encode()).hexdigest(), 16)
+        vec[h % dim] += 1.0
+    n = np.linalg.norm(vec) + 1e-9
+    return (vec / n).tolist()
+
+def run(name, fn):
+    s = time.perf_counter(); out = fn(); dt = time.perf_counter()-s
+    print(f"{name:<18} {len(docs)/dt:>12.0f} docs/s  ({dt*1000:.1f} ms)")
+    return out
+
+print(f"{len(docs)} docs, dim={dim}")
+s = time.perf_counter(); ntok = sum(len(tokenize(d)) for d in docs); dt = time.perf_counter()-s
+print(f"{'tokenizer':<18} {ntok/dt:>12.0f} tokens/s ({ntok} tokens)")
+a = run("legacy per-call", lambda: [legacy_embed(d, dim) for d in docs])
+b = run("engine per-call", lambda: np.stack([embed(d, dim) for d in docs]))
+c = run("engine batch", lambda: embed_batch(docs, dim))
+assert np.allclose(b, c, atol=1e-6)
+print("token cache:", cache_info())
+
+model = load_embedder()
+print(f"\n{model.version}: dim={model.dim}, {len(docs)} docs")
+print(f"{'batch':>6} {'docs/s':>10} {'p50 ms':>9} {'p95 ms':>9}")
+for bs in batch_sizes:
+    lat = []
+    s = time.perf_counter()
+    for i in range(0, len(docs), bs):
+        t0 = time.perf_counter(); model.encode(docs[i:i+bs]); lat.append(time.perf_counter()-t0)
+    dt = time.perf_counter()-s
+    print(f"{bs:>6} {len(docs)/dt:>10.0f} {np.percentile(lat,50)*1000:>9.2f} {np.percentile(lat,95)*1000:>9.2f}")
+
+async def concurrent(svc, n_clients=64):
+    # n_clients loops each embedding its share of docs one request at a time; uncached (unique text)
+    lat = []
+    async def client(part):
+        for d in part:
+            t0 = time.perf_counter(); await svc.embed(d); lat.append(time.perf_counter()-t0)
+    s = time.perf_counter()
+    await asyncio.gather(*(client([f"{i} {d}" for i, d in enumerate(docs) if i % n_clients == c]) for c in range(n_clients)))
+    return time.perf_counter()-s, lat
+
+svc = EmbedService(model)
+dt, lat = asyncio.run(concurrent(svc))
+print(f"service, 64 concurrent clients: {len(docs)/dt:.0f} docs/s, request p50 {np.percentile(lat,50)*1000:.2f} ms, p95 {np.percentile(lat,95)*1000:.2f} ms  (max_batch={svc.max_batch}, wait={svc.wait*1000:g} ms)")
+svc.shutdown()
@@ -0,0 +1,58 @@
+import sys, os, json, time, uuid, random, datetime
+
+# Decoder throughput on one core for the sensor payload formats the ingestors accept: the pack 2 JSON
+# reading, the backend's bare-float text, and the binary envelope (utils/sensor_wire.py) with 1..N
+# readings per message. Each run parses like the ingestor does (incl. UUID validation) and reports
+# msgs/s, readings/s and bytes per reading.
+# usage: python tools/bench_sensor_wire.py [messages] [batch_sizes]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from app.utils.sensor_wire import encode, decode, is_binary
+
+n = int(sys.argv[1]) if len(sys.argv)>1 else 200000
+batches = [int(b) for b in (sys.argv[2] if len(sys.argv)>2 else "1,10,50").split(",")]
+rnd = random.Random(0)
+pids = [str(uuid.uuid5(uuid.NAMESPACE_DNS, f"sima-load-{i}")) for i in range(50)]
+types = ["temperature", "humidity", "co2"]
+now = datetime.datetime.now(datetime.timezone.utc)
+
+def parse_json(topic, payload):
+    p = json.loads(payload.decode("utf-8"))
+    return [(p.get("type"), now, float(p.get("val")))], str(uuid.UUID(p.get("project_id")))
+
+def parse_text(topic, payload):
+    parts = topic.split("/")
+    return [(parts[-1], now, float(payload.decode("utf-8").strip()))], str(uuid.UUID(parts[-2]))
+
+def parse_bin(topic, payload):
+    assert is_binary(payload)
+    pid, readings = decode(payload, now)
+    return readings, pid
+
+def run(name, msgs, fn, per_msg):
+    s = time.perf_counter(); count = 0
+    for topic, payload in msgs: count += len(fn(topic, payload)[0])
+    dt = time.perf_counter() - s
+    size = sum(len(p) for _, p in msgs) / (len(msgs) * per_msg)
+    print(f"{name:<12} {len(msgs)/dt:>12.0f} {count/dt:>14.0f} {size:>10.1f}")
+    return count / dt
+
+def sample(k):
+    pid = rnd.choice(pids)
+    return pid, [(types[j % 3], now - datetime.timedelta(milliseconds=100 * (k - j)), round(20 + rnd.random() * 10, 2)) for j in range(k)]
+
+print(f"{n} messages per format, one core")
+print(f"{'format':<12} {'msgs/s':>12} {'readings/s':>14} {'B/reading':>10}")
+js, tx = [], []
+for _ in range(n):
+    pid, [(t, _, v)] = sample(1)
+    js.append((f"sensors/{pid}/{t}", json.dumps({"project_id": pid, "type": t, "val": v}).encode()))
+    tx.append((f"sensors/{pid}/{t}", str(v).encode()))
+base = run("json", js, parse_json, 1)
+run("text", tx, parse_text, 1)
+for k in batches:
+    msgs = []
+    for _ in range(max(1, n // k)):
+        pid, readings = sample(k)
+        msgs.append((f"sensors/{pid}/bin", encode(pid, readings)))
+    r = run(f"bin x{k}", msgs, parse_bin, k)
+    print(f"{'':<12} {r/base:>27.1f}x json readings/s")
@@ -0,0 +1,19 @@
+import sys, os, urllib.request
+
+# Download the ONNX export + tokenizer of a sentence-transformers model for EMBED_BACKEND=onnx.
+# usage: python tools/fetch_embed_model.py [hf_repo] [out_dir]
+# default: multilingual (Arabic + English) MiniLM, 384 dims = EMBED_DIM
+repo = sys.argv[1] if len(sys.argv)>1 else "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+out = sys.argv[2] if len(sys.argv)>2 else os.path.join("backend", "models", repo.split("/")[-1])
+base = os.environ.get("HF_ENDPOINT","https://huggingface.co")
+
+os.makedirs(out, exist_ok=True)
+for src, dst in [("onnx/model.onnx","model.onnx"), ("tokenizer.json","tokenizer.json")]:
+    path = os.path.join(out, dst)
+    if os.path.exists(path):
+        print("have", path); continue
+    url = f"{base}/{repo}/resolve/main/{src}"
+    print("get", url)
+    urllib.request.urlretrieve(url, path + ".part", lambda n, bs, total: sys.stdout.write(f"\r  {min(n*bs, total)>>20}/{total>>20} MB"))
+    os.replace(path + ".part", path); print()
+print(f"EMBED_BACKEND=onnx EMBED_MODEL_DIR=models/{os.path.basename(out)}")
@@ -1,13 +1,32 @@
-import sys, requests, textwrap, os, math
+import sys, requests, textwrap, os, math, json
 
 API = os.environ.get("API","http://localhost:8080")
-title = sys.argv[1] if len(sys.argv)>1 else "DASC"
-text_path = sys.argv[2] if len(sys.argv)>2 else "dasc_sample.txt"
+bulk = "--bulk" in sys.argv
+args = [a for a in sys.argv[1:] if a != "--bulk"]
+title = args[0] if len(args)>0 else "DASC"
+text_path = args[1] if len(args)>1 else "dasc_sample.txt"
 
 with open(text_path,"r",encoding="utf-8") as f:
     t = f.read()
 
 chunk = 1100
+
+def progress(done, total, width=40):
+    n = int(width*done/max(1,total))
+    sys.stdout.write(f"\r[{'#'*n}{'.'*(width-n)}] {100*done//max(1,total):3d}%  {done}/{total} bytes")
+    sys.stdout.flush()
+
+if bulk:
+    # one NDJSON request; the server chunks, embeds in batches and COPYs into rag_docs
+    body = (json.dumps({"title": title, "content": t}, ensure_ascii=False) + "\n").encode("utf-8")
+    def stream(step=64*1024):
+        for i in range(0, len(body), step):
+            yield body[i:i+step]; progress(min(i+step, len(body)), len(body))
+    r = requests.post(f"{API}/v1/rag/bulk", params={"chunk": chunk}, data=stream(), headers={"Content-Type": "application/x-ndjson"})
+    print()
+    print(r.status_code, r.text)
+    sys.exit(0 if r.ok else 1)
+
 parts = [t[i:i+chunk] for i in range(0,len(t),chunk)]
 for i,p in enumerate(parts,1):
     r = requests.post(f"{API}/v1/rag/upload", json={"title": f"{title}-{i}", "content": p})
@@ -0,0 +1,64 @@
+import sys, os, json, time, asyncio, argparse, statistics
+import httpx
+from mock_llm import serve
+
+# Concurrent SSE chat load test: opens N streams at once and reports time-to-first-token and
+# total time. If streams serialize (event loop blocked per token), wall time ~ N x one stream.
+# usage: python tools/load_sse.py --url http://localhost:8080/v1/chat/stream -c 50 --message "واجهة"
+#        python tools/load_sse.py --demo -c 50     # blocking vs async generator, in-process server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+async def one(client, url, body):
+    t0 = time.perf_counter(); ttft = None; events = 0
+    async with client.stream("POST", url, json=body) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if line.startswith("event: token"):
+                events += 1
+                if ttft is None: ttft = time.perf_counter() - t0
+    return ttft or 0.0, time.perf_counter() - t0, events
+
+async def load(url, body, n):
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=n)) as client:
+        await one(client, url, body)   # warm up
+        t0 = time.perf_counter()
+        res = await asyncio.gather(*[one(client, url, body) for _ in range(n)])
+        wall = time.perf_counter() - t0
+    ttft = sorted(r[0] for r in res); total = [r[1] for r in res]
+    return {"streams": n, "wall_s": round(wall, 3), "ttft_p50_ms": round(statistics.median(ttft)*1000, 1),
+            "ttft_p95_ms": round(ttft[int(0.95*(n-1))]*1000, 1), "stream_mean_s": round(statistics.mean(total), 3),
+            "overlap": round(sum(total)/wall, 1), "token_events": sum(r[2] for r in res)}
+
+def demo_app(words, delay_ms):
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+    from app.utils.sse import sse_pack, paced, coalesce
+    app = FastAPI(); text = ("نسبة النوافذ إلى الجدران " * (words // 4 + 1)).split()[:words]
+    @app.post("/blocking")
+    async def blocking():
+        async def gen():   # the pattern this replaces: time.sleep inside an async generator
+            for w in text:
+                yield sse_pack("token", {"text": w + " "}); time.sleep(delay_ms / 1000)
+        return StreamingResponse(gen(), media_type="text/event-stream")
+    @app.post("/async")
+    async def nonblocking():
+        async def gen():
+            async for t in coalesce(paced((w + " " for w in text), delay_ms)): yield sse_pack("token", {"text": t})
+        return StreamingResponse(gen(), media_type="text/event-stream")
+    return app
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url"); ap.add_argument("--message", default="واجهة")
+    ap.add_argument("-c", "--concurrency", type=int, default=50)
+    ap.add_argument("--demo", action="store_true"); ap.add_argument("--words", type=int, default=40)
+    ap.add_argument("--delay-ms", type=float, default=5)
+    a = ap.parse_args()
+    if a.demo:
+        base, server = serve(demo_app(a.words, a.delay_ms))
+        for path in ("/blocking", "/async"):
+            print(path, json.dumps(asyncio.run(load(base + path, {}, a.concurrency))))
+        server.should_exit = True
+    else:
+        if not a.url: ap.error("--url or --demo is required")
+        print(json.dumps(asyncio.run(load(a.url, {"message": a.message}, a.concurrency)), ensure_ascii=False))
@@ -0,0 +1,62 @@
+import sys, json, time, socket, asyncio, argparse, threading
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse, JSONResponse
+
+# Local stand-in for the Gemini streamGenerateContent (alt=sse) and OpenAI-compatible
+# /v1/chat/completions endpoints, with a configurable first-chunk and per-chunk delay.
+# usage: python tools/mock_llm.py --port 8009 --first-ms 400 --chunk-ms 40
+#        GEMINI_BASE_URL=http://localhost:8009/v1beta CLOUD_RELAY_URL=http://localhost:8009/v1/chat/completions
+ANSWER = "نسبة النوافذ إلى الجدران بين 15 و 25 بالمئة مع مشربيات وألوان ترابية".split()
+
+def make_app(first_ms=300.0, chunk_ms=30.0, words=ANSWER, chunk_words=2):
+    app = FastAPI(title="mock llm")
+    chunks = [" ".join(words[i:i+chunk_words]) + " " for i in range(0, len(words), chunk_words)]
+
+    async def paced():
+        await asyncio.sleep(first_ms / 1000)
+        for i, c in enumerate(chunks):
+            if i: await asyncio.sleep(chunk_ms / 1000)
+            yield c
+
+    @app.post("/v1beta/models/{target}")
+    async def gemini(target: str, request: Request):
+        model, _, method = target.partition(":")
+        if method == "generateContent":
+            await asyncio.sleep((first_ms + chunk_ms * (len(chunks) - 1)) / 1000)
+            return {"candidates": [{"content": {"parts": [{"text": "".join(chunks)}]}}]}
+        async def gen():
+            async for c in paced():
+                yield f"data: {json.dumps({'candidates': [{'content': {'parts': [{'text': c}], 'role': 'model'}}]}, ensure_ascii=False)}\r\n\r\n"
+        return StreamingResponse(gen(), media_type="text/event-stream")
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        if not body.get("stream"):
+            await asyncio.sleep((first_ms + chunk_ms * (len(chunks) - 1)) / 1000)
+            return JSONResponse({"choices": [{"message": {"role": "assistant", "content": "".join(chunks)}}]})
+        async def gen():
+            yield f"data: {json.dumps({'choices': [{'delta': {'role': 'assistant'}}]})}\n\n"
+            async for c in paced():
+                yield f"data: {json.dumps({'choices': [{'delta': {'content': c}}]}, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(gen(), media_type="text/event-stream")
+
+    return app, "".join(chunks)
+
+def serve(app, port=0):
+    import uvicorn
+    if not port:
+        s = socket.socket(); s.bind(("127.0.0.1", 0)); port = s.getsockname()[1]; s.close()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started: time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8009)
+    ap.add_argument("--first-ms", type=float, default=300); ap.add_argument("--chunk-ms", type=float, default=30)
+    a = ap.parse_args()
+    import uvicorn
+    uvicorn.run(make_app(a.first_ms, a.chunk_ms)[0], host="0.0.0.0", port=a.port)